@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class CellCodec:
+    """
+    Packs integer `(ix, iy, it)` grid cells into a single int64 id.
+
+    The id is a mixed-radix number over the cell ranges the codec was fit to, so it is only
+    comparable between ids produced by the same codec. Ids sort by `it`, then `iy`, then `ix`.
+    """
+    def __init__(self, lo, hi):
+        self.lo = np.asarray(lo, dtype=np.int64)
+        self.size = np.asarray(hi, dtype=np.int64) - self.lo + 1
+        if int(self.size[0]) * int(self.size[1]) * int(self.size[2]) >= 2 ** 63:
+            raise OverflowError('Cell range {} - {} does not fit in an int64 id'.format(lo, hi))
+
+    @classmethod
+    def fit(cls, ix, iy, it, pad=0):
+        """
+        Fits a codec to the given cells, widened by `pad` cells on every side.
+        """
+        if len(ix) == 0:
+            return cls((0, 0, 0), (0, 0, 0))
+        lo = [int(np.min(c)) - pad for c in (ix, iy, it)]
+        hi = [int(np.max(c)) + pad for c in (ix, iy, it)]
+        return cls(lo, hi)
+
+    def encode(self, ix, iy, it):
+        nx, ny = self.size[0], self.size[1]
+        ix = np.asarray(ix, dtype=np.int64) - self.lo[0]
+        iy = np.asarray(iy, dtype=np.int64) - self.lo[1]
+        it = np.asarray(it, dtype=np.int64) - self.lo[2]
+        return (it * ny + iy) * nx + ix
+
+    def decode(self, cell_id):
+        nx, ny = self.size[0], self.size[1]
+        cell_id = np.asarray(cell_id, dtype=np.int64)
+        ix = cell_id % nx + self.lo[0]
+        iy = (cell_id // nx) % ny + self.lo[1]
+        it = cell_id // (nx * ny) + self.lo[2]
+        return ix, iy, it
+
+
+CELL_KEY_BITS = 32
+
+
+def cell_key(ix, iy, it):
+    """
+    Packs an integer grid cell into a single int usable as a stable dictionary key.
+
+    Unlike `CellCodec` ids, keys don't depend on the range of the data; each coordinate is
+    zigzag-encoded into its own `CELL_KEY_BITS`-wide field.
+    """
+    return (_zigzag(it) << (2 * CELL_KEY_BITS)) | (_zigzag(iy) << CELL_KEY_BITS) | _zigzag(ix)
+
+
+def cell_from_key(key):
+    mask = (1 << CELL_KEY_BITS) - 1
+    return _unzigzag(key & mask), _unzigzag((key >> CELL_KEY_BITS) & mask), _unzigzag(key >> (2 * CELL_KEY_BITS))
+
+
+def _zigzag(n):
+    n = int(n)
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _unzigzag(z):
+    return z >> 1 if z & 1 == 0 else -((z + 1) >> 1)
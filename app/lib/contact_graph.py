@@ -0,0 +1,158 @@
+import networkx as nx
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+class ContactGraph:
+    """
+    Undirected, weighted user contact graph held as NumPy edge columns.
+
+    Every edge is a user pair `(uid1, uid2)` (node indices `row < col`) with its contact `count`,
+    lowest and highest contact distance and the time difference of its last contact (the
+    distances and time differences may be None when only counts are known). Its `weight`
+    is the `count` for `count_weight` and `dt - max_distance` (the lowest `dt - distance`, like
+    `weight_by_distance`) for `dist_weight`. Metrics come from the SciPy sparse adjacency matrix;
+    a networkx graph is only built for GML export.
+    """
+    def __init__(self, uid1, uid2, count, min_distance, max_distance, time_diff=None, weight='count_weight', dt=None):
+        assert(weight in ['dist_weight', 'count_weight'])
+        uid1, uid2 = np.asarray(uid1).astype(str), np.asarray(uid2).astype(str)
+        self.nodes, inverse = np.unique(np.concatenate((uid1, uid2)), return_inverse=True)
+        self.row = np.minimum(inverse[:len(uid1)], inverse[len(uid1):])
+        self.col = np.maximum(inverse[:len(uid1)], inverse[len(uid1):])
+        self.count = np.asarray(count, dtype=np.int64)
+        self.min_distance = None if min_distance is None else np.asarray(min_distance, dtype=float)
+        self.max_distance = None if max_distance is None else np.asarray(max_distance, dtype=float)
+        self.time_diff = None if time_diff is None else np.asarray(time_diff, dtype=float)
+        self.weight = weight
+        self.dt = dt
+
+    @classmethod
+    def from_contacts(cls, uid1, uid2, distance=None, time_diff=None, weight='count_weight', dt=None):
+        """
+        Groups individual contacts by user pair (in either order). `time_diff` keeps the value of
+        each pair's last contact.
+        """
+        uid1, uid2 = np.asarray(uid1).astype(str), np.asarray(uid2).astype(str)
+        if len(uid1) == 0:
+            return cls([], [], [], [], [], None if time_diff is None else [], weight, dt)
+        distance = np.zeros(len(uid1)) if distance is None else np.asarray(distance, dtype=float)
+        order, starts, ends = pair_groups(uid1, uid2)
+        first, last = order[starts], order[ends - 1]
+        return cls(
+            uid1[first],
+            uid2[first],
+            ends - starts,
+            np.minimum.reduceat(distance[order], starts),
+            np.maximum.reduceat(distance[order], starts),
+            None if time_diff is None else np.asarray(time_diff, dtype=float)[last],
+            weight,
+            dt,
+        )
+
+    @classmethod
+    def combine(cls, graphs, weight='count_weight', dt=None):
+        """
+        Merges graphs of disjoint sets of contacts: counts add up, distances keep their extremes
+        and `time_diff` the value of the last graph holding the pair. Distances and time
+        differences are only kept when every graph has them.
+        """
+        graphs = [g for g in graphs if g.number_of_edges()]
+        uid1 = np.concatenate([g.nodes[g.row] for g in graphs] + [np.zeros(0, dtype=str)])
+        uid2 = np.concatenate([g.nodes[g.col] for g in graphs] + [np.zeros(0, dtype=str)])
+        columns = [[getattr(g, c) for g in graphs] for c in ('count', 'min_distance', 'max_distance', 'time_diff')]
+        count, min_distance, max_distance, time_diff = (
+            None if any(v is None for v in c) else np.concatenate(c + [np.zeros(0)]) for c in columns)
+        if len(uid1) == 0:
+            return cls([], [], [], [], [], None if time_diff is None else [], weight, dt)
+        order, starts, ends = pair_groups(uid1, uid2)
+        first, last = order[starts], order[ends - 1]
+        return cls(
+            uid1[first],
+            uid2[first],
+            np.add.reduceat(count[order], starts),
+            None if min_distance is None else np.minimum.reduceat(min_distance[order], starts),
+            None if max_distance is None else np.maximum.reduceat(max_distance[order], starts),
+            None if time_diff is None else time_diff[last],
+            weight,
+            dt,
+        )
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.row)
+
+    def weights(self):
+        if self.weight == 'count_weight':
+            return self.count
+        assert(self.max_distance is not None)
+        return self.dt - self.max_distance
+
+    def adjacency(self):
+        """
+        Symmetric `csr_matrix` of edge weights, indexed like `nodes`.
+        """
+        n = self.number_of_nodes()
+        weights = self.weights()
+        return sparse.csr_matrix((np.concatenate((weights, weights)),
+                                  (np.concatenate((self.row, self.col)), np.concatenate((self.col, self.row)))),
+                                 shape=(n, n))
+
+    def connected_components(self):
+        """
+        Returns `(count, labels)`: the number of connected components and the component of every node.
+        """
+        if self.number_of_nodes() == 0:
+            return 0, np.zeros(0, dtype=np.int32)
+        # Structure only: a zero `dist_weight` must not drop its edge.
+        pattern = sparse.csr_matrix((np.ones(self.number_of_edges()), (self.row, self.col)),
+                                    shape=(self.number_of_nodes(),) * 2)
+        return csgraph.connected_components(pattern, directed=False)
+
+    def largest_component(self):
+        count, labels = self.connected_components()
+        return int(np.bincount(labels).max()) if count else 0
+
+    def degrees(self):
+        return np.bincount(np.concatenate((self.row, self.col)), minlength=self.number_of_nodes())
+
+    def average_degree(self):
+        n = self.number_of_nodes()
+        return 2. * self.number_of_edges() / n if n else 0.
+
+    def to_networkx(self):
+        graph = nx.Graph()
+        columns = [self.nodes[self.row].tolist(), self.nodes[self.col].tolist(), self.weights().tolist(),
+                   self.count.tolist()]
+        missing = [None] * self.number_of_edges()
+        distances = self.min_distance.tolist() if self.min_distance is not None else missing
+        time_diffs = self.time_diff.tolist() if self.time_diff is not None else missing
+        for u1, u2, weight, count, distance, time_diff in zip(*columns, distances, time_diffs):
+            attributes = {'weight': weight, 'count': count}
+            if distance is not None:
+                attributes['distance'] = distance
+            if time_diff is not None:
+                attributes['time_diff'] = time_diff
+            graph.add_edge(u1, u2, **attributes)
+        return graph
+
+    def write_gml(self, path):
+        nx.write_gml(self.to_networkx(), path)
+
+
+def pair_groups(uid1, uid2):
+    """
+    Groups rows by user pair (in either order). Returns `(order, starts, ends)`: the stable order
+    putting every pair's rows next to each other and the bounds of each pair's run in it.
+    """
+    nodes, inverse = np.unique(np.concatenate((uid1, uid2)), return_inverse=True)
+    node1, node2 = inverse[:len(uid1)], inverse[len(uid1):]
+    keys = np.minimum(node1, node2) * len(nodes) + np.maximum(node1, node2)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.append(starts[1:], len(keys))
+    return order, starts, ends
@@ -0,0 +1,140 @@
+import os
+import pickle
+import time
+import warnings
+
+
+class ContactSink:
+    """
+    Append-only, checkpointed log of detected contacts.
+
+    Contacts are buffered in memory and appended to `path` as pickled frames whenever `flush_every`
+    contacts are pending or `flush_interval` seconds have passed since the last flush, so the write
+    volume is linear in the number of contacts. Once every contact of a user pair has been appended
+    the pair is marked done with `commit`. Reopening the log after a crash drops everything written
+    after the last committed pair, so a run resumes from there without duplicating contacts.
+
+    The log holds two kinds of frames:
+        ('contacts', pair, [contact, ...])
+        ('commit', pair)
+
+    Pairs are expected to be written one at a time (all of a pair's contacts, then its commit).
+    Opening a sink takes over the log; use `ContactSink.read` to only look at it.
+    """
+    def __init__(self, path, flush_every=10000, flush_interval=30., resume=True):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.committed = set()
+        self.__buffer = []
+        self.__pending = 0
+        self.__last_flush = time.time()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if resume:
+            self.__recover()
+        self.__file = open(path, 'ab' if resume else 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_committed(self, pair):
+        return pair in self.committed
+
+    def append(self, pair, contact):
+        if self.__buffer and self.__buffer[-1][0] == 'contacts' and self.__buffer[-1][1] == pair:
+            self.__buffer[-1][2].append(contact)
+        else:
+            self.__buffer.append(('contacts', pair, [contact]))
+        self.__pending += 1
+        self.__maybe_flush()
+
+    def extend(self, pair, contacts):
+        for contact in contacts:
+            self.append(pair, contact)
+
+    def commit(self, pair):
+        """
+        Marks every contact of `pair` as written. The checkpoint becomes durable with the next flush.
+        """
+        self.__buffer.append(('commit', pair))
+        self.committed.add(pair)
+        self.__maybe_flush()
+
+    def flush(self):
+        if not self.__buffer:
+            return
+        for frame in self.__buffer:
+            pickle.dump(frame, self.__file, pickle.HIGHEST_PROTOCOL)
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__buffer = []
+        self.__pending = 0
+        self.__last_flush = time.time()
+
+    def close(self):
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+    def contacts(self):
+        """
+        Yields every contact of the committed pairs, in the order they were appended.
+        """
+        self.flush()
+        for frame, _ in self.read_frames(self.path):
+            if frame[0] == 'contacts' and frame[1] in self.committed:
+                for contact in frame[2]:
+                    yield contact
+
+    def __maybe_flush(self):
+        if self.__pending >= self.flush_every or time.time() - self.__last_flush >= self.flush_interval:
+            self.flush()
+
+    def __recover(self):
+        """
+        Loads the committed pairs and truncates the log right after the last commit frame.
+        """
+        if not os.path.isfile(self.path):
+            return
+        checkpoint = 0
+        for frame, end in self.read_frames(self.path):
+            if frame[0] == 'commit':
+                self.committed.add(frame[1])
+                checkpoint = end
+        if checkpoint < os.path.getsize(self.path):
+            warnings.warn('Discarding uncommitted contacts after byte {} of {}'.format(checkpoint, self.path))
+            with open(self.path, 'r+b') as f:
+                f.truncate(checkpoint)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Returns `(committed, contacts)` of the log at `path`: the committed pairs and every contact of
+        them, in the order they were appended. Unlike opening a sink, this never creates, truncates
+        or writes to the log, so it is safe while another process is still appending to it.
+        """
+        committed = set(frame[1] for frame, _ in cls.read_frames(path) if frame[0] == 'commit')
+        contacts = []
+        for frame, _ in cls.read_frames(path):
+            if frame[0] == 'contacts' and frame[1] in committed:
+                contacts.extend(frame[2])
+        return committed, contacts
+
+    @staticmethod
+    def read_frames(path):
+        """
+        Yields `(frame, end_offset)` for each complete frame in the log, stopping at a torn write.
+        """
+        if not os.path.isfile(path):
+            return
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frame = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                    return
+                yield frame, f.tell()
@@ -0,0 +1,210 @@
+import json
+import os
+
+import numpy as np
+
+# Typed columns of a contact point table. `uid1`/`uid2` are codes into the `uid` dictionary and
+# `tile` into the `tile_hash` dictionary; everything else is stored as is.
+CONTACT_COLUMNS = (
+    ('uid1', np.int32),
+    ('uid2', np.int32),
+    ('tile', np.int32),
+    ('dist_apart', np.float64),
+    ('time_diff', np.float64),
+    ('lat1', np.float64),
+    ('lat2', np.float64),
+    ('lon1', np.float64),
+    ('lon2', np.float64),
+    ('t1', np.float64),
+    ('t2', np.float64),
+)
+
+# Dictionary each encoded column decodes through.
+CONTACT_DICTIONARIES = {'uid1': 'uid', 'uid2': 'uid', 'tile': 'tile_hash'}
+
+ROW_GROUP_SIZE = 1 << 16
+
+
+class ContactTable:
+    """
+    Typed, columnar table of contact points.
+
+    `#save` writes it to a directory holding one little-endian `<column>.bin` file per column plus
+    a `meta.json` with the row count, row groups, dictionaries and attributes (`ds`, `dt`).
+    `#open` memory-maps those files, so reading a table back copies and parses nothing.
+
+    `table[column]` returns a column with dictionary-encoded columns decoded (`uid1`, `uid2` and
+    `tile_hash`); `table.columns` holds the stored arrays.
+    """
+    META = 'meta.json'
+
+    def __init__(self, columns, dictionaries, attributes=None, row_groups=None):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.attributes = attributes if attributes is not None else {}
+        self.row_groups = row_groups if row_groups is not None else [len(self)] if len(columns['uid1']) else []
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, cls.META)) as f:
+            meta = json.load(f)
+        columns = {}
+        for name, dtype in CONTACT_COLUMNS:
+            if meta['rows']:
+                columns[name] = np.memmap(os.path.join(path, '{}.bin'.format(name)), dtype=np.dtype(dtype).newbyteorder('<'),
+                                          mode='r', shape=(meta['rows'],))
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        dictionaries = {name: np.array(values, dtype=str) for name, values in meta['dictionaries'].items()}
+        return cls(columns, dictionaries, meta['attributes'], meta['row_groups'])
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Imports a contact point table from the CSV layout the contact point ops used to write
+        (`contact_points_by_*.csv`, header row first).
+        """
+        import pandas as pd
+        frame = pd.read_csv(path, dtype={'uid1': str, 'uid2': str, 'tile_hash': str}, float_precision='round_trip')
+        tile, tile_hashes = pd.factorize(frame['tile_hash'])
+        block = {name: frame[name].to_numpy() for name, _ in CONTACT_COLUMNS if name != 'tile'}
+        block['tile'], block['tile_hashes'] = tile, list(tile_hashes)
+        attributes = {'ds': int(frame['ds'].iloc[0]), 'dt': int(frame['dt'].iloc[0])} if len(frame) else {}
+        writer = ContactTableWriter(attributes=attributes)
+        writer.write(block)
+        return writer.close()
+
+    def save(self, path):
+        with ContactTableWriter(path, self.attributes) as writer:
+            for start, stop in self.row_group_ranges():
+                writer.write_encoded({name: self.columns[name][start:stop] for name, _ in CONTACT_COLUMNS}, self.dictionaries)
+        return ContactTable.open(path)
+
+    def __len__(self):
+        return len(self.columns['uid1'])
+
+    def __getitem__(self, name):
+        if name == 'tile_hash':
+            return self.dictionaries['tile_hash'][self.columns['tile']]
+        if name in CONTACT_DICTIONARIES:
+            return self.dictionaries[CONTACT_DICTIONARIES[name]][self.columns[name]]
+        return self.columns[name]
+
+    def row_group_ranges(self):
+        ends = np.cumsum(self.row_groups, dtype=np.int64).tolist()
+        return zip([0] + ends[:-1], ends)
+
+    def to_frame(self):
+        """
+        Renders the table as a pandas DataFrame with categorical uid and tile hash columns.
+        """
+        import pandas as pd
+        frame = {}
+        for name, _ in CONTACT_COLUMNS:
+            column = np.asarray(self.columns[name])
+            if name in CONTACT_DICTIONARIES:
+                column = pd.Categorical.from_codes(column, categories=self.dictionaries[CONTACT_DICTIONARIES[name]])
+            frame['tile_hash' if name == 'tile' else name] = column
+        return pd.DataFrame(frame)
+
+
+class ContactTableWriter:
+    """
+    Appends contact blocks to a `ContactTable` as row groups. Blocks are dictionary-encoded as they
+    arrive; with a `path` every row group is appended to the column files straight away and
+    `#close` writes the metadata and returns the memory-mapped table, otherwise the table is
+    assembled in memory.
+    """
+    def __init__(self, path=None, attributes=None):
+        self.path = path
+        self.attributes = attributes if attributes is not None else {}
+        self.dictionaries = {'uid': [], 'tile_hash': []}
+        self.row_groups = []
+        self.__codes = {'uid': {}, 'tile_hash': {}}
+        self.__pending = {name: [] for name, _ in CONTACT_COLUMNS}
+        self.__files = None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            meta_path = os.path.join(path, ContactTable.META)
+            # The metadata is removed first and written last, so a partial table never opens.
+            if os.path.isfile(meta_path):
+                os.remove(meta_path)
+            self.__files = {name: open(os.path.join(path, '{}.bin'.format(name)), 'wb') for name, _ in CONTACT_COLUMNS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__close_files()
+
+    def write(self, block):
+        """
+        Appends a block of contacts: `uid1`/`uid2` as uids, `tile` as codes into the block's own
+        `tile_hashes` list and the remaining `CONTACT_COLUMNS` as values.
+        """
+        uids, uid_codes = np.unique(np.concatenate((block['uid1'], block['uid2'])).astype(str), return_inverse=True)
+        uid_codes = self.__encode('uid', uids)[uid_codes]
+        columns = {name: block[name] for name, _ in CONTACT_COLUMNS if name not in CONTACT_DICTIONARIES}
+        columns['uid1'], columns['uid2'] = uid_codes[:len(block['uid1'])], uid_codes[len(block['uid1']):]
+        columns['tile'] = self.__encode('tile_hash', block['tile_hashes'])[np.asarray(block['tile'], dtype=np.int64)]
+        self.__append(columns)
+
+    def write_encoded(self, columns, dictionaries):
+        """
+        Appends stored columns of another table, re-encoding them through its `dictionaries`.
+        """
+        columns = dict(columns)
+        for name, dictionary in CONTACT_DICTIONARIES.items():
+            columns[name] = self.__encode(dictionary, dictionaries[dictionary])[np.asarray(columns[name], dtype=np.int64)]
+        self.__append(columns)
+
+    def close(self):
+        dictionaries = {name: np.array(values, dtype=str) for name, values in self.dictionaries.items()}
+        if self.path is None:
+            columns = {name: np.concatenate(self.__pending[name]).astype(dtype) if self.__pending[name] else np.zeros(0, dtype=dtype)
+                       for name, dtype in CONTACT_COLUMNS}
+            return ContactTable(columns, dictionaries, self.attributes, self.row_groups)
+
+        self.__close_files()
+        meta = {
+            'rows': int(sum(self.row_groups)),
+            'row_groups': self.row_groups,
+            'columns': [[name, np.dtype(dtype).newbyteorder('<').str] for name, dtype in CONTACT_COLUMNS],
+            'dictionaries': self.dictionaries,
+            'attributes': self.attributes,
+        }
+        meta_path = os.path.join(self.path, ContactTable.META)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        return ContactTable.open(self.path)
+
+    def __encode(self, dictionary, values):
+        codes, known = self.__codes[dictionary], self.dictionaries[dictionary]
+        for value in values:
+            value = str(value)
+            if value not in codes:
+                codes[value] = len(known)
+                known.append(value)
+        return np.array([codes[str(value)] for value in values], dtype=np.int64)
+
+    def __append(self, columns):
+        rows = len(columns['uid1'])
+        if rows == 0:
+            return
+        self.row_groups.append(int(rows))
+        for name, dtype in CONTACT_COLUMNS:
+            column = np.ascontiguousarray(columns[name], dtype=np.dtype(dtype).newbyteorder('<'))
+            if self.__files is not None:
+                column.tofile(self.__files[name])
+            else:
+                self.__pending[name].append(column)
+
+    def __close_files(self):
+        if self.__files is not None:
+            for f in self.__files.values():
+                f.close()
+            self.__files = None
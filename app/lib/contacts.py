@@ -0,0 +1,373 @@
+import itertools
+
+import numpy as np
+
+from app.lib import metrics
+from app.lib.cells import CellCodec
+from app.lib.geodesy import EARTH_RADIUS_METERS, box_distance_lower_bound, haversine, within
+from app.lib.interval_tree import IntervalTree
+from app.lib.parallel import worker_data
+from app.lib.points import TrajectoryPoint, ContactPoint, ole_days_to_unix
+
+# Upper bound on the number of time-window candidates materialized at once.
+MAX_CANDIDATES = 1 << 22
+
+# The cell itself and all 26 neighbors.
+NEIGHBORHOOD = [(dx, dy, dz) for dz in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+# Number of contact points built at once by `user_contact_points`.
+POINT_BATCH = 4096
+
+# The cell itself plus the 13 neighbor offsets that precede their mirror image, so each pair of
+# neighboring cells is visited once.
+HALF_NEIGHBORHOOD = [(0, 0, 0)] + [
+    (dx, dy, dz)
+    for dz in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+    if (dz, dy, dx) > (0, 0, 0)
+]
+
+
+def sweep_contacts(points1, points2, delta, max_candidates=MAX_CANDIDATES):
+    """
+    Sort-and-sweep contact detection between two point sets.
+
+    `points1` and `points2` are `(lat, lon, t)` column tuples, each sorted by `t`. For every point
+    of `points1` the matching window `[t - dt, t + dt]` of `points2` is located with a binary search
+    (the vectorized form of a two-pointer sweep), so only pairs within `dt` seconds are ever built.
+    Those candidates are then filtered by haversine distance (screened with `geodesy.within`).
+
+    Returns `(idx1, idx2, distance)` arrays of every pair with `|t1 - t2| <= dt` and
+    `distance <= ds`, ordered by `idx1` then `idx2`.
+    """
+    ds, dt = delta
+    lat1, lon1, t1 = (np.asarray(c, dtype=float) for c in points1)
+    lat2, lon2, t2 = (np.asarray(c, dtype=float) for c in points2)
+
+    # Pad the window by a hair so float rounding in `t +/- dt` can't drop a boundary pair; the
+    # exact `|t1 - t2| <= dt` test below has the final say.
+    pad = 1e-3
+    lo = np.searchsorted(t2, t1 - dt - pad, side='left')
+    hi = np.searchsorted(t2, t1 + dt + pad, side='right')
+    counts = hi - lo
+
+    results = []
+    for start, stop in candidate_blocks(counts, max_candidates):
+        idx1, idx2 = expand_ranges(lo[start:stop], counts[start:stop])
+        idx1 += start
+        candidates = len(idx1)
+        keep = np.abs(t1[idx1] - t2[idx2]) <= dt
+        idx1, idx2 = idx1[keep], idx2[keep]
+        in_time = len(idx1)
+        keep = within(lat1[idx1], lon1[idx1], lat2[idx2], lon2[idx2], ds)
+        idx1, idx2 = idx1[keep], idx2[keep]
+        count_candidates(candidates, in_time, len(idx1))
+        results.append((idx1, idx2, haversine(lat1[idx1], lon1[idx1], lat2[idx2], lon2[idx2])))
+
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return tuple(np.concatenate(columns) for columns in zip(*results))
+
+
+def grid_join_contacts(owner, lat, lon, t, delta, max_candidates=MAX_CANDIDATES):
+    """
+    Exact contact detection between points of different owners through a spatio-temporal grid join
+    (see `grid_join_blocks`).
+
+    Returns `(idx1, idx2, distance)` arrays with `owner[idx1] < owner[idx2]`, sorted by
+    `(idx1, idx2)`.
+    """
+    results = list(grid_join_blocks(owner, lat, lon, t, delta, max_candidates))
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    idx1, idx2, distance = (np.concatenate(columns) for columns in zip(*results))
+    order = np.lexsort((idx2, idx1))
+    return idx1[order], idx2[order], distance[order]
+
+
+def grid_join_blocks(owner, lat, lon, t, delta, max_candidates=MAX_CANDIDATES):
+    """
+    Spatio-temporal grid join between points of different owners, yielding its contacts in blocks
+    of at most `max_candidates` candidates, so callers can aggregate them without ever holding
+    them all.
+
+    Points are bucketed into cells at least `ds` wide (in degrees of latitude and longitude) and
+    `dt` long, so every pair with haversine distance `<= ds` and `|t1 - t2| <= dt` lies in the same
+    or a neighboring cell. Each point is only paired with the points of other owners in its 3x3x3
+    neighborhood, visiting every pair of cells once, and candidates are then filtered by the exact
+    time and distance tests. Cost is linear in the number of points for a bounded point density.
+
+    Points with out-of-range coordinates are skipped; longitudes are not wrapped at +/-180.
+
+    Yields unordered `(idx1, idx2, distance)` arrays with `owner[idx1] < owner[idx2]`.
+    """
+    ds, dt = delta
+    owner = np.asarray(owner, dtype=np.int64)
+    lat, lon, t = (np.asarray(c, dtype=float) for c in (lat, lon, t))
+    valid = np.flatnonzero((np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+    if len(valid) == 0:
+        return
+
+    cell_lat, cell_lon = grid_cell_degrees(ds, np.max(np.abs(lat[valid])))
+    ix = np.floor(lon[valid] / cell_lon).astype(np.int64)
+    iy = np.floor(lat[valid] / cell_lat).astype(np.int64)
+    it = np.floor(t[valid] / dt).astype(np.int64)
+
+    # Rank-compress each axis (including the +/-1 neighbors) so sparse outliers can't blow up
+    # the packed cell ids.
+    axes = [np.unique(np.concatenate((c - 1, c, c + 1))) for c in (ix, iy, it)]
+    codec = CellCodec((0, 0, 0), [len(a) - 1 for a in axes])
+    n_owners = int(owner.max()) + 1
+    if int(np.prod(codec.size)) * n_owners >= 2 ** 63:
+        raise OverflowError('Too many cells and owners to pack into int64 keys')
+
+    # Rank of every point's cell and its -1/+1 neighbors on each axis.
+    ranks = [{d: np.searchsorted(a, c + d) for d in (-1, 0, 1)} for a, c in zip(axes, (ix, iy, it))]
+
+    def cell_ids(dx, dy, dz):
+        return codec.encode(*[r[d] for r, d in zip(ranks, (dx, dy, dz))])
+
+    point_owner = owner[valid]
+    keys = cell_ids(0, 0, 0) * n_owners + point_owner
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    # Position of every point in the (cell, owner) sorted order back to its original index.
+    index = valid[order]
+
+    for dx, dy, dz in HALF_NEIGHBORHOOD:
+        base = cell_ids(dx, dy, dz) * n_owners
+        lo = np.searchsorted(keys, base)
+        hi = np.searchsorted(keys, base + n_owners)
+        own_lo = np.searchsorted(keys, base + point_owner)
+        own_hi = np.searchsorted(keys, base + point_owner + 1)
+        if (dx, dy, dz) == (0, 0, 0):
+            # Inside a point's own cell only owners greater than its own are paired, so every
+            # pair is built once.
+            starts, counts = own_hi, hi - own_hi
+            rows = np.arange(len(valid))
+        else:
+            starts = np.concatenate((lo, own_hi))
+            counts = np.concatenate((own_lo - lo, hi - own_hi))
+            rows = np.tile(np.arange(len(valid)), 2)
+
+        for start, stop in candidate_blocks(counts, max_candidates):
+            row, candidate = expand_ranges(starts[start:stop], counts[start:stop])
+            idx1, idx2 = valid[rows[start:stop][row]], index[candidate]
+            candidates = len(idx1)
+            keep = np.abs(t[idx1] - t[idx2]) <= dt
+            idx1, idx2 = idx1[keep], idx2[keep]
+            in_time = len(idx1)
+            keep = within(lat[idx1], lon[idx1], lat[idx2], lon[idx2], ds)
+            idx1, idx2 = idx1[keep], idx2[keep]
+            count_candidates(candidates, in_time, len(idx1))
+            swap = owner[idx1] > owner[idx2]
+            idx1, idx2 = np.where(swap, idx2, idx1), np.where(swap, idx1, idx2)
+            yield idx1, idx2, haversine(lat[idx1], lon[idx1], lat[idx2], lon[idx2])
+
+
+def grid_probe_contacts(probe, index, delta, limit=None, max_candidates=MAX_CANDIDATES):
+    """
+    Contacts between the points of `probe` and those of `index` through a spatio-temporal grid lookup.
+
+    `probe` and `index` are `(owner, lat, lon, t)` column tuples. `index` is bucketed into the cells
+    of `grid_join_blocks`, sorted by cell and owner, and each probe point is matched against the
+    index points of other owners in its 3x3x3 cell neighborhood, then filtered by the exact time
+    and distance tests. With `limit`, probe point `p` only pairs with index points `< limit[p]`.
+
+    Points with out-of-range coordinates are skipped. Returns unordered
+    `(probe_idx, index_idx, distance)` arrays.
+    """
+    ds, dt = delta
+    owner1, lat1, lon1, t1 = (np.asarray(c) for c in probe)
+    owner2, lat2, lon2, t2 = (np.asarray(c) for c in index)
+    valid1 = np.flatnonzero((np.abs(lat1) <= 90) & (np.abs(lon1) <= 180))
+    valid2 = np.flatnonzero((np.abs(lat2) <= 90) & (np.abs(lon2) <= 180))
+    if len(valid1) == 0 or len(valid2) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    max_abs_lat = max(np.max(np.abs(lat1[valid1])), np.max(np.abs(lat2[valid2])))
+    cell_lat, cell_lon = grid_cell_degrees(ds, max_abs_lat)
+
+    def cells(lat, lon, t):
+        return np.floor(lon / cell_lon).astype(np.int64), np.floor(lat / cell_lat).astype(np.int64), \
+            np.floor(t / dt).astype(np.int64)
+
+    cells1 = cells(lat1[valid1], lon1[valid1], t1[valid1])
+    # Probes in cell order keep the needles of every neighbor search below sorted.
+    order = np.lexsort(cells1)
+    valid1, cells1 = valid1[order], [c[order] for c in cells1]
+    cells2 = cells(lat2[valid2], lon2[valid2], t2[valid2])
+    # Rank-compressed axes over both sets and the probes' neighbors.
+    axes = [np.unique(np.concatenate((c1 - 1, c1, c1 + 1, c2))) for c1, c2 in zip(cells1, cells2)]
+    codec = CellCodec((0, 0, 0), [len(a) - 1 for a in axes])
+    n_owners = int(max(owner1.max(), owner2.max())) + 1
+    if int(np.prod(codec.size)) * n_owners >= 2 ** 63:
+        raise OverflowError('Too many cells and owners to pack into int64 keys')
+
+    keys = codec.encode(*[np.searchsorted(a, c) for a, c in zip(axes, cells2)]) * n_owners + owner2[valid2]
+    order = np.argsort(keys, kind='stable')
+    keys, index_of = keys[order], valid2[order]
+    # Rank of every probe's cell and its -1/+1 neighbors on each axis.
+    ranks = [{d: np.searchsorted(a, c + d) for d in (-1, 0, 1)} for a, c in zip(axes, cells1)]
+
+    probe_owner = owner1[valid1].astype(np.int64)
+    rows = np.tile(valid1, 2)
+    results = []
+    for offset in NEIGHBORHOOD:
+        base = codec.encode(*[r[d] for r, d in zip(ranks, offset)]) * n_owners
+        lo = np.searchsorted(keys, base)
+        hi = np.searchsorted(keys, base + n_owners)
+        own_lo = np.searchsorted(keys, base + probe_owner)
+        own_hi = np.searchsorted(keys, base + probe_owner + 1)
+        starts = np.concatenate((lo, own_hi))
+        counts = np.concatenate((own_lo - lo, hi - own_hi))
+        for start, stop in candidate_blocks(counts, max_candidates):
+            row, candidate = expand_ranges(starts[start:stop], counts[start:stop])
+            idx1, idx2 = rows[start:stop][row], index_of[candidate]
+            candidates = len(idx1)
+            keep = np.abs(t1[idx1] - t2[idx2]) <= dt
+            if limit is not None:
+                keep &= idx2 < limit[idx1]
+            idx1, idx2 = idx1[keep], idx2[keep]
+            in_time = len(idx1)
+            keep = within(lat1[idx1], lon1[idx1], lat2[idx2], lon2[idx2], ds)
+            idx1, idx2 = idx1[keep], idx2[keep]
+            count_candidates(candidates, in_time, len(idx1))
+            results.append((idx1, idx2, haversine(lat1[idx1], lon1[idx1], lat2[idx2], lon2[idx2])))
+
+    return tuple(np.concatenate(columns) for columns in zip(*results))
+
+
+def grid_cell_degrees(ds, max_abs_lat):
+    """
+    Returns the `(lat, lon)` size in degrees of grid cells such that two points within `ds`
+    meters (haversine) never lie more than one cell apart, for latitudes up to `max_abs_lat`.
+    """
+    angle = ds / EARTH_RADIUS_METERS
+    cell_lat = np.degrees(angle)
+    # haversine: sin^2(d / 2R) >= cos(lat1) cos(lat2) sin^2(dlon / 2)
+    max_abs_lat = min(float(max_abs_lat), 89.9)
+    spread = np.sin(angle / 2) / np.cos(np.radians(max_abs_lat))
+    cell_lon = 360. if spread >= 1 else np.degrees(2 * np.arcsin(spread))
+    # A hair wider to absorb float rounding at the cell boundary.
+    return cell_lat * (1 + 1e-9), cell_lon * (1 + 1e-9)
+
+
+def candidate_blocks(counts, max_candidates=MAX_CANDIDATES):
+    """
+    Splits a run of per-row candidate counts into `(start, stop)` row blocks holding at most
+    `max_candidates` candidates each (a single row larger than the budget gets its own block).
+    """
+    total = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = total[start - 1] if start > 0 else 0
+        stop = int(np.searchsorted(total, base + max_candidates, side='right'))
+        stop = max(stop, start + 1)
+        yield start, stop
+        start = stop
+
+
+def expand_ranges(lo, counts):
+    """
+    Expands the half-open ranges `[lo[k], lo[k] + counts[k])` into flat `(row, index)` arrays.
+    """
+    rows = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    firsts = np.cumsum(counts) - counts
+    index = lo[rows] + (np.arange(len(rows), dtype=np.int64) - firsts[rows])
+    return rows, index
+
+
+def count_candidates(candidates, in_time, found):
+    """
+    Reports a block of point pair candidates to the metrics: how many were examined, dropped by
+    the exact time test and by the distance test, and how many contacts were left.
+    """
+    metrics.count('point_pairs_examined', candidates)
+    metrics.count('point_pairs_pruned_by_time', candidates - in_time)
+    metrics.count('point_pairs_pruned_by_distance', in_time - found)
+    metrics.count('contacts_found', found)
+
+
+def time_sorted_points(user, index=None):
+    """
+    Returns `(order, (lat, lon, t))` for a `UserTrajectories` (or only its points at `index`),
+    where `order` maps each position of the time-sorted columns back to the user's point index.
+    """
+    if index is None:
+        index = np.arange(len(user))
+    t = ole_days_to_unix(np.asarray(user.days)[index])
+    by_time = np.argsort(t, kind='stable')
+    order = index[by_time]
+    return order, (np.asarray(user.lat)[order], np.asarray(user.lon)[order], t[by_time])
+
+
+def candidate_trajectories(user_i, user_j, delta):
+    """
+    Returns the `(traj_i, traj_j)` index pairs of trajectories of two `UserTrajectories` that may
+    hold a contact: their time spans come within `dt` of each other (found with an `IntervalTree`
+    over the spans of `user_j`) and their bounding boxes within `ds`.
+    """
+    ds, dt = delta
+    si, sj = user_i.summary, user_j.summary
+    traj_i, traj_j = IntervalTree(sj['t_start'], sj['t_end']).overlaps(si['t_start'] - dt, si['t_end'] + dt)
+    box_i = [si[field][traj_i] for field in ('lat_min', 'lat_max', 'lon_min', 'lon_max')]
+    box_j = [sj[field][traj_j] for field in ('lat_min', 'lat_max', 'lon_min', 'lon_max')]
+    # A hair of slack so rounding in the bound can't drop a pair right at `ds`.
+    near = box_distance_lower_bound(box_i, box_j) <= ds * (1 + 1e-9) + 1e-6
+    return traj_i[near], traj_j[near]
+
+
+def trajectory_rows(user, trajectories):
+    """
+    Point indices of the given trajectories of a `UserTrajectories`, in trajectory order.
+    """
+    trajectories = np.unique(trajectories)
+    counts = np.diff(user.offsets)[trajectories]
+    return expand_ranges(user.offsets[trajectories], counts)[1]
+
+
+def trajectory_ids(user):
+    """
+    Returns the trajectory index of every point of a `UserTrajectories`.
+    """
+    return np.repeat(np.arange(user.trajectory_count()), np.diff(user.offsets))
+
+
+def user_contact_points(user_i, user_j, data, delta):
+    """
+    Yields a `ContactPoint` for every pair of points of users i and j that are within `delta`,
+    in the same order as a nested (trajectory i, trajectory j, point i, point j) scan.
+    """
+    points_i, points_j = data.user_points(user_i), data.user_points(user_j)
+    # Only points of trajectories close enough in time and space to some trajectory of the other
+    # user are swept; users recorded far apart are done here.
+    cand_i, cand_j = candidate_trajectories(points_i, points_j, delta)
+    metrics.count('user_pairs_examined')
+    metrics.count('trajectory_pairs_pruned', points_i.trajectory_count() * points_j.trajectory_count() - len(cand_i))
+    if len(cand_i) == 0:
+        return
+    order_i, sorted_i = time_sorted_points(points_i, trajectory_rows(points_i, cand_i))
+    order_j, sorted_j = time_sorted_points(points_j, trajectory_rows(points_j, cand_j))
+    idx_i, idx_j, _ = sweep_contacts(sorted_i, sorted_j, delta)
+    idx_i, idx_j = order_i[idx_i], order_j[idx_j]
+
+    traj_i, traj_j = trajectory_ids(points_i)[idx_i], trajectory_ids(points_j)[idx_j]
+    scan_order = np.lexsort((idx_j, idx_i, traj_j, traj_i))
+    for start in range(0, len(scan_order), POINT_BATCH):
+        k = scan_order[start:start + POINT_BATCH]
+        pnts_i = TrajectoryPoint.from_columns(*_point_columns(points_i, idx_i[k]), uid=user_i)
+        pnts_j = TrajectoryPoint.from_columns(*_point_columns(points_j, idx_j[k]), uid=user_j)
+        for pnt_i, pnt_j, ti, tj in zip(pnts_i, pnts_j, traj_i[k], traj_j[k]):
+            yield ContactPoint(pnt_i, pnt_j, points_i.plts[ti], points_j.plts[tj])
+
+
+def pair_contact_points(pair, delta, limit=None):
+    """
+    Pool worker entry point: the contact points of one `(user_i, user_j)` pair as a list, or only
+    the first `limit` of them.
+    """
+    return list(itertools.islice(user_contact_points(pair[0], pair[1], worker_data(), delta), limit))
+
+
+def _point_columns(user, index):
+    return user.lat[index], user.lon[index], user.alt[index], user.days[index]
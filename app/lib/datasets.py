@@ -1,22 +1,72 @@
-import glob
 import os
-import re
 
 import numpy as np
 
+from app.lib import metrics
 from app.lib.pipeline_ops import PipelineOp
+from app.lib.points import ole_days_to_unix
+from app.lib.simplify import simplify_user
+from app.lib.trajectory_store import TrajectoryStore
+
+# Row layout of `GeolifeData#stream` chunks; `traj_id` indexes the user's trajectories, `point_id`
+# the point within its trajectory file and `t` is in Unix seconds.
+STREAM_DTYPE = np.dtype([
+    ('uid', 'U8'),
+    ('traj_id', np.int32),
+    ('point_id', np.int32),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('alt', np.float64),
+    ('t', np.float64),
+])
+
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+class UserTrajectoryPoints:
+    """
+    Re-iterable `(point, trajectory_plt)` rows of a user. Every iteration reads the rows from the
+    store again instead of holding them.
+    """
+    def __init__(self, data, uid):
+        self.data = data
+        self.uid = uid
+
+    def __iter__(self):
+        return self.data.load_user_trajectory_points(self.uid)
 
 
 class GeolifeData(PipelineOp):
-    def __init__(self):
+    """
+    The Geolife users and their trajectories, read through a `TrajectoryStore`.
+
+    With a `simplify` tolerance `(meters, seconds)` (see `simplify.contact_tolerance`) every user's
+    points are resampled on load (`simplify.simplify_user`): `#user_points`, `#stream`,
+    `#trajectories` and `#load_trajectory_plt_points` serve the reduced trajectories, and
+    `#reduction` reports how many points were dropped. The point-pair engines (the sweep, grid
+    join and grid probe of `contacts` and `ops.grid`) lose no user pair in contact when run at
+    `simplify.inflate_delta`. That guarantee doesn't extend to the tile method: simplification
+    changes which cells a user visits, and inflating `ds` changes the tile size, so
+    `GenerateTilesOp` reads the raw points from `store` unless asked for simplified ones.
+    """
+    def __init__(self, data_dir='app/data/geolife/Data', store=None, simplify=None):
         PipelineOp.__init__(self)
+        self.store = store if store is not None else TrajectoryStore(data_dir)
+        self.simplify = tuple(simplify) if simplify is not None else None
         self.__users = []
         self.__trajectories = {}
+        self.__simplified = {}
+        self.__reduction = {}
 
     def perform(self):
         self.__load_trajectories()
         return self._apply_output({'users': self.users(), 'trajectories': self.trajectories()})
 
+    def fingerprint(self):
+        if self.simplify is None:
+            return self.store.fingerprint()
+        return '{}:simplify{}'.format(self.store.fingerprint(), self.simplify)
+
     def users(self):
         self.__load_trajectories()
         return self.__users
@@ -31,23 +81,153 @@ class GeolifeData(PipelineOp):
     def __load_trajectories(self):
         trajectories = self.__trajectories
         if len(trajectories) <= 0:
-            self.__users = np.sort(np.array([
-                uid for uid in os.listdir('app/data/geolife/Data') if re.findall(r'\d{3}', uid)
-            ]))
+            self.__users = self.store.users()
             for uid in self.__users:
-                trajectories[uid] = trajectories.get(uid, self.load_user_trajectory_points(uid))
+                trajectories[uid] = trajectories.get(uid, UserTrajectoryPoints(self, uid))
             self.__trajectories = trajectories
         return trajectories
 
+    def stream(self, users=None, chunk_size=STREAM_CHUNK_SIZE, time_ordered=False):
+        """
+        Yields the points of the given users (all by default) as `STREAM_DTYPE` arrays of
+        `chunk_size` rows (the last one may be shorter), reading them from the store as it goes.
+
+        By default points come user by user in trajectory order. With `time_ordered`, they are
+        merged across all users by time (ties broken by uid, trajectory and file order): every
+        trajectory is a sorted run that only joins the merge frontier once the stream reaches its
+        first timestamp, so memory is bounded by the trajectories overlapping in time.
+        """
+        if users is None:
+            users = self.users()
+        if time_ordered:
+            points = self.__time_ordered_points(users, chunk_size)
+        else:
+            points = (self.__trajectory_points(uid, i) for uid in users for i in range(self.user_points(uid).trajectory_count()))
+        return _rechunk(points, chunk_size)
+
+    def __trajectory_points(self, uid, i):
+        user = self.user_points(uid)
+        lo, hi = user.offsets[i], user.offsets[i + 1]
+        points = np.empty(hi - lo, dtype=STREAM_DTYPE)
+        points['uid'] = uid
+        points['traj_id'] = i
+        points['point_id'] = np.arange(hi - lo)
+        points['lat'] = user.lat[lo:hi]
+        points['lon'] = user.lon[lo:hi]
+        points['alt'] = user.alt[lo:hi]
+        points['t'] = ole_days_to_unix(user.days[lo:hi])
+        return points
+
+    def __time_ordered_points(self, users, chunk_size):
+        # Runs (one per trajectory) in order of their first timestamp.
+        starts, runs = [], []
+        for uid in users:
+            user = self.user_points(uid)
+            counts = np.diff(user.offsets)
+            if len(user) == 0:
+                continue
+            t = ole_days_to_unix(user.days)
+            firsts = np.flatnonzero(counts)
+            starts.append(np.minimum.reduceat(t, user.offsets[firsts]))
+            runs.extend((uid, int(i)) for i in firsts)
+        if not runs:
+            return
+        starts = np.concatenate(starts)
+        order = np.argsort(starts, kind='stable')
+
+        frontier = np.empty(0, dtype=STREAM_DTYPE)
+        k = 0
+        while k < len(order) or len(frontier):
+            # Open every run starting at the next start time, then more until a chunk is buffered.
+            opened, buffered = [], len(frontier)
+            while k < len(order) and (not opened or buffered < chunk_size or starts[order[k]] == starts[order[k - 1]]):
+                run = self.__trajectory_points(*runs[order[k]])
+                opened.append(run[np.argsort(run['t'], kind='stable')])
+                buffered += len(run)
+                k += 1
+            if opened:
+                # Only the newly opened runs are sorted; they are then merged into the already
+                # sorted remainder of the frontier.
+                opened = np.concatenate(opened)
+                opened = opened[np.lexsort((opened['traj_id'], opened['uid'], opened['t']))]
+                frontier = _merge_sorted(frontier, opened)
+            # Points before the next unopened run's start can't be preceded by anything else.
+            bound = starts[order[k]] if k < len(order) else np.inf
+            ready = int(np.searchsorted(frontier['t'], bound, side='left'))
+            yield frontier[:ready]
+            frontier = frontier[ready:]
+
+    def user_points(self, uid):
+        """
+        Returns the memory-mapped columns (`UserTrajectories`) of every trajectory of `uid`, or
+        their simplified copy.
+        """
+        if self.simplify is None:
+            return self.store.user(uid)
+        uid = '{}'.format(uid)
+        user = self.__simplified.get(uid, None)
+        if user is None:
+            raw = self.store.user(uid)
+            user = simplify_user(raw, self.simplify)
+            self.__simplified[uid] = user
+            self.__reduction[uid] = (len(raw), len(user))
+            metrics.count('points_read', len(raw))
+            metrics.count('points_simplified_away', len(raw) - len(user))
+        return user
+
+    def reduction(self):
+        """
+        Points before and after simplification over the users loaded so far, and their ratio.
+        """
+        before = sum(counts[0] for counts in self.__reduction.values())
+        after = sum(counts[1] for counts in self.__reduction.values())
+        return {'points': before, 'simplified': after, 'ratio': before / float(after) if after else 1.}
+
     def load_user_trajectory_points(self, uid):
-        for trajectory_plt in self.load_user_trajectory_plts(uid):
-            for point in self.load_trajectory_plt_points(trajectory_plt):
+        user = self.user_points(uid)
+        for i, trajectory_plt in enumerate(user.plts):
+            for point in user.points(i):
                 yield (point, trajectory_plt)
 
-    @staticmethod
-    def load_user_trajectory_plts(uid):
-        return np.sort(glob.glob('app/data/geolife/Data/{}/Trajectory/*.plt'.format(uid)))
+    def load_user_trajectory_plts(self, uid):
+        return np.array(self.user_points(uid).plts)
+
+    def load_trajectory_plt_points(self, trajectory_plt):
+        if self.simplify is None:
+            return self.store.points(trajectory_plt)
+        user = self.user_points(os.path.basename(os.path.dirname(os.path.dirname(trajectory_plt))))
+        i = user.trajectory_index(trajectory_plt)
+        # Files the store doesn't know are parsed as they are.
+        return self.store.points(trajectory_plt) if i is None else user.points(i)
+
+
+def _merge_sorted(a, b):
+    """
+    Merges two `STREAM_DTYPE` arrays sorted by `(t, uid, traj_id)` that share no trajectory, in
+    linear time plus the time ties.
+    """
+    lo = np.searchsorted(a['t'], b['t'], side='left')
+    ties = np.searchsorted(a['t'], b['t'], side='right') - lo
+    # Among rows of `a` with the same time, those of a lower `(uid, traj_id)` go first.
+    row = np.repeat(np.arange(len(b)), ties)
+    index = lo[row] + np.arange(len(row)) - np.repeat(np.cumsum(ties) - ties, ties)
+    before = (a['uid'][index] < b['uid'][row]) | ((a['uid'][index] == b['uid'][row]) & (a['traj_id'][index] < b['traj_id'][row]))
+    return np.insert(a, lo + np.bincount(row[before], minlength=len(b)), b)
+
 
-    @staticmethod
-    def load_trajectory_plt_points(trajectory_plt):
-        return np.genfromtxt(trajectory_plt, delimiter=',', dtype=float, skip_header=6, usecols=range(0, 5))
+def _rechunk(parts, chunk_size):
+    """
+    Regroups a stream of structured arrays into arrays of exactly `chunk_size` rows (but the last).
+    """
+    pending, count = [], 0
+    for part in parts:
+        pending.append(part)
+        count += len(part)
+        if count >= chunk_size:
+            rows = np.concatenate(pending)
+            full = len(rows) - len(rows) % chunk_size
+            for start in range(0, full, chunk_size):
+                yield rows[start:start + chunk_size]
+            pending, count = [rows[full:]], len(rows) - full
+    if count:
+        yield np.concatenate(pending)
@@ -0,0 +1,102 @@
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371 * 1000
+
+# Latitude and distance beyond which the equirectangular error bound is not trusted and haversine
+# is always used.
+EQUIRECTANGULAR_MAX_LAT = 85.
+EQUIRECTANGULAR_MAX_METERS = 100 * 1000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in meters between points given in decimal degrees.
+
+    Works pairwise on equally shaped arrays and broadcasts like any NumPy expression, so a single
+    point against arrays (one-to-many) or `a[:, None]` against `b[None, :]` (many-to-many) also work.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def equirectangular(lat1, lon1, lat2, lon2):
+    """
+    Fast flat-earth approximation of `haversine`, projecting around the mean latitude of each pair.
+    Only meant for short distances; see `equirectangular_error`.
+    """
+    return np.sqrt(_equirectangular_squared(lat1, lon1, lat2, lon2))
+
+
+def equirectangular_error(distance, lat1, lat2):
+    """
+    Upper bound in meters on `|equirectangular - haversine|` for pairs `distance` meters apart
+    (either measure) with latitudes `lat1` and `lat2`. Infinite past `EQUIRECTANGULAR_MAX_LAT` or
+    `EQUIRECTANGULAR_MAX_METERS`.
+
+    The relative error grows as `(d / R)^2 / cos^2(lat)`; the 1/8 factor holds a margin of ~3x over
+    the worst case measured up to 100 km and 85 degrees.
+    """
+    distance = np.asarray(distance, dtype=float)
+    max_lat = np.radians(np.maximum(np.abs(lat1), np.abs(lat2)))
+    angle = distance / EARTH_RADIUS_METERS
+    relative = angle ** 2 / (8 * np.cos(max_lat) ** 2) + 1e-12
+    bound = distance * relative + 1e-9
+    trusted = (np.degrees(max_lat) <= EQUIRECTANGULAR_MAX_LAT) & (distance <= EQUIRECTANGULAR_MAX_METERS)
+    return np.where(trusted, bound, np.inf)
+
+
+def within(lat1, lon1, lat2, lon2, ds):
+    """
+    Boolean mask of the pairs whose haversine distance is `<= ds`, identical to
+    `haversine(...) <= ds`. Pairs are screened with the equirectangular fast path and haversine
+    is only evaluated for the few whose distance is too close to `ds` to decide.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(c, dtype=float) for c in (lat1, lon1, lat2, lon2)))
+    if lat1.size == 0:
+        return np.zeros(lat1.shape, dtype=bool)
+    # One worst-case bound for the whole batch keeps the screen cheaper than haversine itself.
+    max_lat = max(np.max(np.abs(lat1)), np.max(np.abs(lat2)))
+    error = float(equirectangular_error(ds * 1.01, max_lat, max_lat))
+    if np.isinf(error):
+        return haversine(lat1, lon1, lat2, lon2) <= ds
+    # Compared squared, sparing the square root on every pair.
+    approx = _equirectangular_squared(lat1, lon1, lat2, lon2)
+    keep = approx <= max(ds - error, 0.) ** 2
+    unsure = ~keep & (approx <= (ds + error) ** 2)
+    if np.any(unsure):
+        keep[unsure] = haversine(lat1[unsure], lon1[unsure], lat2[unsure], lon2[unsure]) <= ds
+    return keep
+
+
+def box_distance_lower_bound(box1, box2):
+    """
+    Lower bound in meters on the haversine distance between any point of one lat/lon bounding box
+    and any point of another. Boxes are `(lat_min, lat_max, lon_min, lon_max)` tuples of arrays.
+
+    Both terms of the haversine formula are bounded separately: the latitude term by the latitude
+    gap between the boxes and the longitude term by the (wrap-aware) longitude gap, scaled by the
+    smallest `cos(lat)` either box reaches.
+    """
+    lat_min1, lat_max1, lon_min1, lon_max1 = (np.asarray(c, dtype=float) for c in box1)
+    lat_min2, lat_max2, lon_min2, lon_max2 = (np.asarray(c, dtype=float) for c in box2)
+    lat_gap = np.maximum(0., np.maximum(lat_min2 - lat_max1, lat_min1 - lat_max2))
+    lon_gap = np.maximum(0., np.maximum(lon_min2 - lon_max1, lon_min1 - lon_max2))
+    lon_span = np.maximum(lon_max1, lon_max2) - np.minimum(lon_min1, lon_min2)
+    lon_gap = np.minimum(lon_gap, np.maximum(0., 360. - lon_span))
+    max_abs_lat = np.maximum.reduce([np.abs(lat_min1), np.abs(lat_max1), np.abs(lat_min2), np.abs(lat_max2)])
+    cos_lat = np.maximum(0., np.cos(np.radians(np.minimum(max_abs_lat, 90.))))
+    a = np.sin(np.radians(lat_gap) / 2) ** 2 + cos_lat ** 2 * np.sin(np.radians(lon_gap) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def _equirectangular_squared(lat1, lon1, lat2, lon2):
+    dlon = np.subtract(lon2, lon1)
+    # Wrap the longitude difference so pairs straddling +/-180 stay close.
+    dlon -= 360. * np.rint(dlon / 360.)
+    x = dlon * np.cos(np.radians(np.add(lat1, lat2) / 2))
+    y = np.subtract(lat2, lat1)
+    scale = np.radians(1.) * EARTH_RADIUS_METERS
+    return (x * x + y * y) * (scale * scale)
@@ -1,37 +1,33 @@
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from app.lib.contact_graph import ContactGraph
+
 
 def grapher(combos):
     if not combos:
         print("NO NODES")
         return
-    graph = nx.Graph()
-    for c in combos:
-        graph.add_edge(c[0], c[1], weight=1)
+    graph = ContactGraph.from_contacts([c[0] for c in combos], [c[1] for c in combos])
     # print("Number of Nodes: " + str(G.number_of_nodes()))
     # print("Number of edges: " + str(G.number_of_edges()))
     # print("Node degrees: " + str(G.degree()))
     largest_comp = find_largest_component(graph)
     avg_degree = find_average_degree(graph)
-    nx.draw_spectral(graph, with_labels=True)  # spectral circular random
+    nx.draw_spectral(graph.to_networkx(), with_labels=True)  # spectral circular random
     plt.savefig('app/viz/con_components.png', bbox_inches='tight')
     plt.close()
     return largest_comp, avg_degree
 
 
 def find_largest_component(graph):
-    component_size = [len(c) for c in sorted(nx.connected_components(graph), key=len, reverse=True)]
-    return str(max(component_size))
+    return str(graph.largest_component())
     # print("Largest Component Size: " + str(max(component_size)))
     # print("Component List: " + str(max(nx.connected_components(Graph), key=len)))
 
 
 def find_average_degree(graph):
-    degree_list = []
-    for n in graph.nodes():
-        degree_list.append(graph.degree(n))
-    return str(sum(degree_list) / graph.number_of_nodes())
+    return str(graph.average_degree())
     # print("Average degree of Nodes " + str(sum(listr)/Graph.number_of_nodes()))
 
 
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class IntervalTree:
+    """
+    Static interval tree over closed intervals `[starts[k], ends[k]]`.
+
+    Intervals are sorted by start and stored as the leaves of a complete binary tree whose every
+    node holds the smallest start and largest end below it. A query descends only into nodes whose
+    span overlaps it, so it touches O(log n + matches) nodes. Queries are answered in batches, one
+    tree level at a time for all of them.
+    """
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        self.order = np.argsort(starts, kind='stable')
+        self.size = 1
+        while self.size < len(starts):
+            self.size *= 2
+        self.min_start = np.full(2 * self.size, np.inf)
+        self.max_end = np.full(2 * self.size, -np.inf)
+        self.min_start[self.size:self.size + len(starts)] = starts[self.order]
+        self.max_end[self.size:self.size + len(ends)] = ends[self.order]
+        level = self.size // 2
+        while level >= 1:
+            # Nodes `[level, 2 * level)` have children `[2 * level, 4 * level)`.
+            children = slice(2 * level, 4 * level)
+            self.min_start[level:2 * level] = self.min_start[children].reshape(-1, 2).min(axis=1)
+            self.max_end[level:2 * level] = self.max_end[children].reshape(-1, 2).max(axis=1)
+            level //= 2
+
+    def __len__(self):
+        return len(self.order)
+
+    def overlaps(self, lo, hi):
+        """
+        Returns `(query, interval)` index arrays of every interval overlapping each query range
+        `[lo[q], hi[q]]`, ordered by query and then by interval start.
+        """
+        lo = np.atleast_1d(np.asarray(lo, dtype=float))
+        hi = np.atleast_1d(np.asarray(hi, dtype=float))
+        query = np.arange(len(lo), dtype=np.int64)
+        node = np.ones(len(lo), dtype=np.int64)
+        while True:
+            keep = (self.min_start[node] <= hi[query]) & (self.max_end[node] >= lo[query])
+            query, node = query[keep], node[keep]
+            if len(node) == 0 or node[0] >= self.size:
+                break
+            query = np.repeat(query, 2)
+            node = np.stack((2 * node, 2 * node + 1), axis=1).ravel()
+        return query, self.order[node - self.size]
+
+    def query(self, lo, hi):
+        """
+        Indices of the intervals overlapping `[lo, hi]`.
+        """
+        return self.overlaps(lo, hi)[1]
@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Metrics:
+    """
+    Counters, per-stage timers and peak memory of a run, with rate-limited progress reports.
+
+    Hot loops report into the module-level instance through `count`, `timer` and `progress`; while
+    it is disabled (the default) each of those returns after a single flag check. `#snapshot`
+    returns everything as a JSON-ready dict and `#dump` writes it to a file. Metrics are kept per
+    process, so work done in pool workers is not counted.
+    """
+    def __init__(self, enabled=False, progress_interval=5., stream=None):
+        self.enabled = enabled
+        self.progress_interval = progress_interval
+        self.stream = stream
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.timers = {}
+        self.__started = time.perf_counter()
+        self.__progress = {}
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.__lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Adds the wall time of the `with` block to timer `name`, along with the peak memory of the
+        process when it ends.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.__lock:
+                stats = self.timers.setdefault(name, {'calls': 0, 'seconds': 0., 'peak_memory': None})
+                stats['calls'] += 1
+                stats['seconds'] += seconds
+                stats['peak_memory'] = peak_memory()
+
+    def progress(self, name, done, total=None):
+        """
+        Reports `done` (of `total`) units of work on `name`, at most once every `progress_interval`
+        seconds per name, plus once when `done` reaches `total`.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        started, reported = self.__progress.get(name, (now, None))
+        finished = total is not None and done >= total
+        if reported is not None and now - reported < self.progress_interval and not finished:
+            return
+        if finished:
+            # The next report of this name starts a new run.
+            self.__progress.pop(name, None)
+        else:
+            self.__progress[name] = (started, now)
+        line = '{}: {}'.format(name, done)
+        if total is not None:
+            line += '/{} ({:.0%})'.format(total, done / float(total) if total else 1.)
+        if now > started:
+            line += ', {:.1f}/s'.format(done / (now - started))
+        print(line, file=self.stream if self.stream is not None else sys.stderr)
+
+    def snapshot(self):
+        with self.__lock:
+            return {
+                'elapsed': time.perf_counter() - self.__started,
+                'peak_memory': peak_memory(),
+                'counters': dict(self.counters),
+                'timers': {name: dict(stats) for name, stats in self.timers.items()},
+            }
+
+    def dump(self, path):
+        """
+        Writes `#snapshot` to `path` as JSON.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
+
+
+def peak_memory():
+    """
+    Peak resident memory of the process in bytes, or None where it can't be read.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_metrics = Metrics()
+
+
+def metrics():
+    """
+    The `Metrics` instance everything reports into.
+    """
+    return _metrics
+
+
+def enable(progress_interval=5., stream=None):
+    """
+    Starts collecting metrics from scratch and returns the instance.
+    """
+    _metrics.progress_interval = progress_interval
+    _metrics.stream = stream
+    _metrics.reset()
+    _metrics.enabled = True
+    return _metrics
+
+
+def disable():
+    _metrics.enabled = False
+
+
+def count(name, n=1):
+    _metrics.count(name, n)
+
+
+def timer(name):
+    return _metrics.timer(name)
+
+
+def progress(name, done, total=None):
+    _metrics.progress(name, done, total)
@@ -0,0 +1,80 @@
+import os
+import pickle
+
+
+class OpCache:
+    """
+    Size-bounded on-disk cache of `PipelineOp` outputs, keyed on the op fingerprint.
+
+    Each output is pickled to `cache_dir/<fingerprint>.pickle`. Whenever the cache grows past
+    `max_bytes`, the least recently used entries (by file mtime, refreshed on every hit) are
+    evicted. Opt an op in with `op.persist(cache)`.
+    """
+    SUFFIX = '.pickle'
+
+    def __init__(self, cache_dir='app/data/cache', max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def load(self, key):
+        """
+        Returns `(True, output)` for a cached key, `(False, None)` otherwise.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            self.misses += 1
+            return False, None
+        os.utime(path)
+        self.hits += 1
+        return True, value
+
+    def store(self, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        total = sum(size for path, mtime, size in entries)
+        for path, mtime, size in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.SUFFIX):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((os.path.join(self.cache_dir, name), st.st_mtime_ns, st.st_size))
+        return entries
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for path, mtime, size in entries),
+        }
@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+
+from app.lib.contact_graph import ContactGraph
+from app.lib.contacts import grid_join_blocks, grid_join_contacts
+from app.lib.datasets import GeolifeData
+from app.lib.pipeline_ops import PipelineOp
+from app.lib.points import ole_days_to_unix
+
+
+class GridJoinContactsOp(PipelineOp):
+    """
+    Exact contact points between users, found with a neighbor-cell grid join.
+
+    Unlike `GenerateTilesOp` + `GraphContactPointsOp`, which pair users sharing the exact same tile
+    (missing neighbors across a tile edge and counting users up to a tile diagonal apart), every
+    point is compared with the points of other users in its 3x3x3 cell neighborhood and only pairs
+    with `dist_apart <= ds` and `|t1 - t2| <= dt` are kept: the same contacts as
+    `detect_contact_points`, at the cost of the tile method.
+    """
+    def __init__(self, users, ds, dt, weight='count_weight', data_op=None):
+        PipelineOp.__init__(self)
+        self.users = np.array(users)
+        self.ds = ds
+        self.dt = dt
+        self.weight = weight
+        self.data_op = data_op if data_op is not None else GeolifeData()
+        assert(weight in ['dist_weight', 'count_weight'])
+
+    def perform(self):
+        owner, lat, lon, t = self.user_columns()
+        idx1, idx2, distance = grid_join_contacts(owner, lat, lon, t, (self.ds, self.dt))
+        contacts = {
+            'uid1': self.users[owner[idx1]],
+            'uid2': self.users[owner[idx2]],
+            'dist_apart': distance,
+            'time_diff': np.abs(t[idx1] - t[idx2]),
+            'lat1': lat[idx1],
+            'lat2': lat[idx2],
+            'lon1': lon[idx1],
+            'lon2': lon[idx2],
+            't1': t[idx1],
+            't2': t[idx2],
+        }
+
+        graph = self.contact_graph(owner[idx1], owner[idx2], distance)
+        gml_filepath = self.graph_filepath(self.ds, self.dt, self.weight)
+        os.makedirs(os.path.dirname(gml_filepath), exist_ok=True)
+        graph.write_gml(gml_filepath)
+        return self._apply_output({"contacts": contacts, "graph_filepath": gml_filepath, "graph_generated": True})
+
+    def user_columns(self):
+        """
+        Concatenates the points of every user into `(owner, lat, lon, t)` columns, where `owner`
+        is the user's index in `self.users`.
+        """
+        columns = [self.data_op.user_points(uid) for uid in self.users]
+        if not columns:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0)
+        owner = np.concatenate([np.full(len(user), k, dtype=np.int64) for k, user in enumerate(columns)])
+        lat = np.concatenate([np.asarray(user.lat) for user in columns])
+        lon = np.concatenate([np.asarray(user.lon) for user in columns])
+        t = np.concatenate([ole_days_to_unix(user.days) for user in columns])
+        return owner, lat, lon, t
+
+    def contact_graph(self, owner1, owner2, distance):
+        """
+        Aggregates contacts per user pair into a weighted graph. `count_weight` counts the contacts
+        of a pair; `dist_weight` keeps the lowest `dt - distance`, like `weight_by_distance`.
+        """
+        ones = np.ones(len(owner1), dtype=np.int64)
+        stats = reduce_pair_stats(owner1 * len(self.users) + owner2, ones, distance, distance)
+        return self.pair_graph(*stats, dt=self.dt)
+
+    def pair_graph(self, pairs, counts, near, far, dt):
+        """
+        Builds the `ContactGraph` of reduced pair statistics (see `reduce_pair_stats`) at time delta `dt`.
+        """
+        n = len(self.users)
+        return ContactGraph(self.users[pairs // n], self.users[pairs % n], counts, near, far, weight=self.weight, dt=dt)
+
+    @staticmethod
+    def graph_filepath(ds, dt, weight):
+        return 'app/data/graphs/{}.gml'.format(str(ds) + 'ds_' + str(dt) + 'dt_' + str(weight) + '_grid')
+
+
+class ContactSweepOp(GridJoinContactsOp):
+    """
+    Contact graphs for several `(ds, dt)` settings in a single pass.
+
+    The data is loaded and grid-joined once at the loosest setting (the largest `ds` with the
+    largest `dt`); every setting's contacts are a subset of those, picked out by filtering each
+    block of candidates on distance and time. Only per-pair statistics are kept for each setting,
+    so the superset of contacts is never held in memory at once.
+    """
+    def __init__(self, users, deltas, weight='count_weight', data_op=None):
+        self.deltas = [tuple(delta) for delta in deltas]
+        assert(len(self.deltas) > 0)
+        ds = max(delta[0] for delta in self.deltas)
+        dt = max(delta[1] for delta in self.deltas)
+        GridJoinContactsOp.__init__(self, users, ds, dt, weight, data_op)
+
+    def perform(self):
+        owner, lat, lon, t = self.user_columns()
+        n = len(self.users)
+        stats = [None] * len(self.deltas)
+        for idx1, idx2, distance in grid_join_blocks(owner, lat, lon, t, (self.ds, self.dt)):
+            time_diff = np.abs(t[idx1] - t[idx2])
+            pairs = owner[idx1] * n + owner[idx2]
+            for k, (ds, dt) in enumerate(self.deltas):
+                keep = (distance <= ds) & (time_diff <= dt)
+                block = (pairs[keep], np.ones(np.count_nonzero(keep), dtype=np.int64), distance[keep], distance[keep])
+                stats[k] = reduce_pair_stats(*block) if stats[k] is None else \
+                    reduce_pair_stats(*[np.concatenate(c) for c in zip(stats[k], block)])
+
+        results = []
+        for (ds, dt), pair_stats in zip(self.deltas, stats):
+            if pair_stats is None:
+                empty = np.zeros(0, dtype=np.int64)
+                pair_stats = reduce_pair_stats(empty, empty, np.zeros(0), np.zeros(0))
+            graph = self.pair_graph(*pair_stats, dt=dt)
+            gml_filepath = self.graph_filepath(ds, dt, self.weight)
+            os.makedirs(os.path.dirname(gml_filepath), exist_ok=True)
+            graph.write_gml(gml_filepath)
+            contacts = int(np.sum(pair_stats[1]))
+            largest_component = graph.largest_component()
+            average_degree = graph.average_degree()
+            results.append({
+                'ds': ds,
+                'dt': dt,
+                'contacts': contacts,
+                'graph_filepath': gml_filepath,
+                'largest_component': largest_component,
+                'average_degree': average_degree,
+            })
+        return self._apply_output({"deltas": results, "graph_generated": True})
+
+
+def reduce_pair_stats(pairs, counts, near, far):
+    """
+    Groups contact statistics by packed user pair, summing `counts` and keeping the lowest `near`
+    and highest `far` distance of each pair. Returns `(pairs, counts, near, far)` sorted by pair.
+    """
+    pairs, inverse = np.unique(pairs, return_inverse=True)
+    total = np.zeros(len(pairs), dtype=np.int64)
+    np.add.at(total, inverse, counts)
+    min_distance = np.full(len(pairs), np.inf)
+    np.minimum.at(min_distance, inverse, near)
+    max_distance = np.full(len(pairs), -np.inf)
+    np.maximum.at(max_distance, inverse, far)
+    return pairs, total, min_distance, max_distance
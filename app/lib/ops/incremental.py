@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import pickle
+
+import networkx as nx
+import numpy as np
+
+from app.lib.contact_graph import ContactGraph
+from app.lib.datasets import GeolifeData
+from app.lib.geodesy import haversine
+from app.lib.ops.tiles import GenerateTilesOp, TileIndex
+from app.lib.pipeline_ops import PipelineOp
+
+# Bumped whenever the layout of the persisted state changes, so older states are rebuilt.
+STATE_VERSION = 2
+
+
+class IncrementalContactsOp(PipelineOp):
+    """
+    Tile-method contact network (`GenerateTilesOp` + `GraphContactPointsOp`) that is kept up to
+    date as new trajectory files arrive, instead of being rebuilt from scratch.
+
+    The tile index, the per-pair contact count, distance extremes and last time difference and the
+    `source_stat` of every PLT file already tiled are persisted in `state_dir`, in one file per
+    tiling (`ds`, `dt`, `relative_null_point`, `weight` and data directory; see `#state_params`),
+    which records those parameters and is only loaded by a run with the same ones. Like
+    `GenerateTilesOp`, it tiles the raw points of the store. Each run only tiles the points of
+    trajectory files that are new since the last run, pairs every newly occupied tile row with the
+    rows already in that tile and updates the pair totals in place, so tiling and pairing cost is
+    proportional to the new data. The state itself is loaded and rewritten whole on every run, which
+    is proportional to its size.
+
+    New files normally sort after a user's existing ones (Geolife names them by start time), which
+    keeps the user's first point in each tile unchanged. When one of a user's files changes, is
+    removed or a new file sorts before the files already tiled, the user is retracted from all of
+    its tiles (dropping its edges, which only come from the tiles it shares) and tiled again.
+    Users in the state but no longer in `users` are retracted.
+
+    The output `graph` is the `ContactGraph` of those pairs, so its GML has the same edge
+    attributes as the graph `GraphContactPointsOp` writes for the same tiling.
+    """
+    def __init__(self, users, ds, dt, relative_null_point=(39.75872, 116.04142), weight='count_weight', data_op=None,
+                 state_dir='app/data/incremental'):
+        PipelineOp.__init__(self)
+        self.users = np.array(users)
+        self.ds = ds
+        self.dt = dt
+        self.relative_null_point = relative_null_point
+        self.weight = weight
+        self.data_op = data_op if data_op is not None else GeolifeData()
+        self.state_dir = state_dir
+        assert(weight in ['dist_weight', 'count_weight'])
+
+    def perform(self):
+        state = self.load_state()
+        tiler = GenerateTilesOp([], self.ds, self.dt, self.relative_null_point, data_op=self.data_op)
+        updated, retiled, new_rows = [], [], 0
+        removed = sorted(set(state['sources']) - set(self.users.tolist()))
+        for uid in removed:
+            self.retract_user(state, uid)
+        for uid in self.users.tolist():
+            user = tiler.user_points(uid)
+            sources = [self.data_op.store.source_stat(plt) for plt in user.plts]
+            known = state['sources'].get(uid, [])
+            if sources == known:
+                continue
+
+            if sources[:len(known)] == known:
+                # Only appended files: tile the points after the ones already tiled.
+                start = int(user.offsets[len(known)])
+            else:
+                self.retract_user(state, uid)
+                retiled.append(uid)
+                start = 0
+            keys, rows = tiler.user_tile_rows(uid, start)
+            new_rows += self.insert_rows(state, uid, keys, rows)
+            state['sources'][uid] = sources
+            updated.append(uid)
+
+        self.save_state(state)
+        gml_filepath = self.graph_filepath()
+        os.makedirs(os.path.dirname(gml_filepath), exist_ok=True)
+        graph = self.contact_graph(state['graph'])
+        graph.write_gml(gml_filepath)
+        return self._apply_output({
+            'tiles': state['tiles'],
+            'graph': graph,
+            'updated_users': updated,
+            'retiled_users': retiled,
+            'removed_users': removed,
+            'new_rows': new_rows,
+            'graph_filepath': gml_filepath,
+            'graph_generated': True,
+        })
+
+    def insert_rows(self, state, uid, keys, rows):
+        """
+        Adds the user's row to every tile it doesn't occupy yet and records its pairs with the
+        tile's existing occupants. Returns the number of rows added.
+        """
+        tiles, graph, user_keys = state['tiles'], state['graph'], state['user_keys'].setdefault(uid, set())
+        added = 0
+        for key, row in zip(keys, rows):
+            tile = tiles.tile(key)
+            if uid in tile.uids:
+                continue
+            if len(tile):
+                lat = np.array([other[1] for other in tile], dtype=float)
+                lon = np.array([other[2] for other in tile], dtype=float)
+                for other, distance in zip(tile, haversine(lat, lon, row[1], row[2]).tolist()):
+                    add_contact(graph, other[0], uid, distance, abs(other[3] - row[3]))
+            tile.add(row)
+            user_keys.add(key)
+            added += 1
+        return added
+
+    @staticmethod
+    def retract_user(state, uid):
+        """
+        Removes every tile row of `uid` along with its edges.
+        """
+        tiles = state['tiles']
+        for key in state['user_keys'].pop(uid, ()):
+            tile = tiles[key]
+            tile.discard(uid)
+            if not len(tile):
+                del tiles[key]
+        if state['graph'].has_node(uid):
+            state['graph'].remove_node(uid)
+        state['sources'].pop(uid, None)
+
+    def contact_graph(self, pairs):
+        """
+        The `ContactGraph` of the state's pair graph, weighted by `weight`.
+        """
+        edges = list(pairs.edges(data=True))
+        columns = [[e[2][c] for e in edges] for c in ('count', 'min_distance', 'max_distance', 'time_diff')]
+        return ContactGraph([e[0] for e in edges], [e[1] for e in edges], *columns, weight=self.weight, dt=self.dt)
+
+    def load_state(self):
+        path = self.state_filepath()
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            # A state of another tiling would silently mix two grids; start over instead.
+            if state.get('params') == self.state_params():
+                return state
+        return {
+            'params': self.state_params(),
+            'tiles': TileIndex(self.ds, self.dt, self.relative_null_point),
+            'graph': nx.Graph(),
+            'sources': {},
+            'user_keys': {},
+        }
+
+    def save_state(self, state):
+        path = self.state_filepath()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def state_params(self):
+        """
+        Everything the persisted tiles and graph depend on besides the PLT files themselves.
+        """
+        return {
+            'version': STATE_VERSION,
+            'ds': self.ds,
+            'dt': self.dt,
+            'relative_null_point': [float(c) for c in self.relative_null_point],
+            'weight': self.weight,
+            'data_dir': os.path.abspath(self.data_op.store.data_dir),
+        }
+
+    def state_filepath(self):
+        digest = hashlib.sha1(json.dumps(self.state_params(), sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.state_dir, '{}ds_{}dt_{}_{}.pickle'.format(self.ds, self.dt, self.weight, digest))
+
+    def graph_filepath(self):
+        return 'app/data/graphs/{}ds_{}dt_{}_incremental.gml'.format(self.ds, self.dt, self.weight)
+
+
+def add_contact(graph, uid1, uid2, distance, time_diff):
+    """
+    Records one contact of a user pair in the state's pair graph.
+    """
+    if not graph.has_edge(uid1, uid2):
+        graph.add_edge(uid1, uid2, count=1, min_distance=distance, max_distance=distance, time_diff=time_diff)
+        return
+    edge = graph[uid1][uid2]
+    edge['count'] += 1
+    edge['min_distance'] = min(edge['min_distance'], distance)
+    edge['max_distance'] = max(edge['max_distance'], distance)
+    edge['time_diff'] = time_diff
@@ -0,0 +1,92 @@
+import numpy as np
+
+from app.lib import metrics
+from app.lib.contacts import POINT_BATCH, grid_probe_contacts
+from app.lib.datasets import GeolifeData, STREAM_CHUNK_SIZE, STREAM_DTYPE
+from app.lib.pipeline_ops import PipelineOp
+from app.lib.points import TrajectoryPoint, ContactPoint
+
+
+class StreamContactsOp(PipelineOp):
+    """
+    Contact points found in a single pass over the time-ordered stream of every user's points.
+
+    Points enter a sliding window in time order, one chunk at a time. Each chunk is probed against
+    a spatial grid of the points still within `dt` of it (and the earlier points of the chunk
+    itself), so memory scales with the points active in a `dt` window rather than with the
+    dataset. Contacts are `ContactPoint`s between the earlier and later user in `users` order, the
+    same contacts `detect_contact_points` finds pair by pair (except for points with out-of-range
+    coordinates, which are skipped).
+    """
+    def __init__(self, users, ds, dt, data_op=None, chunk_size=STREAM_CHUNK_SIZE):
+        PipelineOp.__init__(self)
+        self.users = np.array(users)
+        self.ds = ds
+        self.dt = dt
+        self.data_op = data_op if data_op is not None else GeolifeData()
+        self.chunk_size = chunk_size
+
+    def perform(self):
+        return self._apply_output(list(self.contacts()))
+
+    def contacts(self):
+        """
+        Yields contact points incrementally, as the points of each chunk enter the window.
+        """
+        window = np.empty(0, dtype=STREAM_DTYPE)
+        window_owner = np.zeros(0, dtype=np.int64)
+        streamed = 0
+        for chunk in self.data_op.stream(self.users, self.chunk_size, time_ordered=True):
+            streamed += len(chunk)
+            metrics.progress('points streamed', streamed)
+            owner = self.owners(chunk['uid'])
+            active = window['t'] >= chunk['t'][0] - self.dt
+            window = np.concatenate((window[active], chunk))
+            window_owner = np.concatenate((window_owner[active], owner))
+            # Each chunk point only pairs with the window points that entered before it.
+            limit = len(window) - len(chunk) + np.arange(len(chunk))
+            probe = (owner, chunk['lat'], chunk['lon'], chunk['t'])
+            index = (window_owner, window['lat'], window['lon'], window['t'])
+            idx_p, idx_w, _ = grid_probe_contacts(probe, index, (self.ds, self.dt), limit)
+            order = np.lexsort((idx_w, idx_p))
+            idx_p, idx_w = idx_p[order], idx_w[order]
+
+            for start in range(0, len(idx_p), POINT_BATCH):
+                p, w = idx_p[start:start + POINT_BATCH], idx_w[start:start + POINT_BATCH]
+                first = owner[p] < window_owner[w]
+                points_i = np.where(first, chunk[p], window[w])
+                points_j = np.where(first, window[w], chunk[p])
+                for contact in self.contact_points(points_i, points_j):
+                    yield contact
+
+    def owners(self, uids):
+        """
+        Index in `self.users` of every uid.
+        """
+        unique, inverse = np.unique(uids, return_inverse=True)
+        rank = {uid: k for k, uid in enumerate(self.users.tolist())}
+        return np.array([rank[uid] for uid in unique.tolist()], dtype=np.int64)[inverse]
+
+    def contact_points(self, points_i, points_j):
+        pnts_i, plts_i = self.trajectory_points(points_i)
+        pnts_j, plts_j = self.trajectory_points(points_j)
+        for pnt_i, pnt_j, plt_i, plt_j in zip(pnts_i, pnts_j, plts_i, plts_j):
+            yield ContactPoint(pnt_i, pnt_j, plt_i, plt_j)
+
+    def trajectory_points(self, points):
+        """
+        `TrajectoryPoint`s and trajectory files of stream rows, with `days` read back from the store.
+        """
+        days = np.empty(len(points))
+        plts = [None] * len(points)
+        for uid in np.unique(points['uid']).tolist():
+            user = self.data_op.user_points(uid)
+            rows = np.flatnonzero(points['uid'] == uid)
+            traj_ids = points['traj_id'][rows]
+            days[rows] = user.days[user.offsets[traj_ids] + points['point_id'][rows]]
+            for row, traj_id in zip(rows.tolist(), traj_ids.tolist()):
+                plts[row] = user.plts[traj_id]
+        pnts = TrajectoryPoint.from_columns(points['lat'], points['lon'], points['alt'], days)
+        for pnt, uid in zip(pnts, points['uid'].tolist()):
+            pnt.uid = uid
+        return pnts, plts
@@ -1,193 +1,573 @@
-from math import radians, cos, sin, asin, pi, sqrt
-import itertools
-import networkx as nx
+import os
+import tempfile
+from functools import partial
+from math import cos, pi
 import numpy as np
+from scipy import sparse
 
 
+from app.lib import metrics
+from app.lib.cells import CellCodec, cell_key, cell_from_key
+from app.lib.contact_graph import ContactGraph
+from app.lib.contact_table import ROW_GROUP_SIZE, ContactTableWriter
+from app.lib.contacts import candidate_blocks, expand_ranges
 from app.lib.datasets import GeolifeData
+from app.lib.geodesy import haversine
+from app.lib.parallel import data_pool, shard_size, worker_data
 from app.lib.pipeline_ops import PipelineOp
-from app.lib.points import TrajectoryPoint
+from app.lib.points import TrajectoryPoint, ole_days_to_unix
+from app.lib.tile_partitions import ROW_MEMORY, TILE_ROW_DTYPE, TilePartitions, TilePartitionWriter
 
+# Contact pairs gathered before `tile_contact_graph` folds them into its graph.
+FOLD_PAIRS = 16 * ROW_GROUP_SIZE
 
-class GenerateTilesOp(PipelineOp):
+
+class LocalGrid:
+    """
+    Flat-earth projection of lat/lon onto meters around a relative null point.
+    Implementations set `relative_null_lat` and `relative_null_lon`.
+    """
     EARTH_CIRCUMFERENCE_AT_EQUATOR_METERS = 40075160
     EARTH_CIRCUMFERENCE_THROUGH_POLES_METERS = 40008000
 
+    def meters_for_lat_lon(self, lat, lon):
+        """
+        Calculates X and Y distances in meters.
+
+        https://stackoverflow.com/a/3024728
+        """
+        delta_latitude = lat - self.relative_null_lat
+        delta_longitude = lon - self.relative_null_lon
+        latitude_circumference = self.EARTH_CIRCUMFERENCE_AT_EQUATOR_METERS * cos(self.deg_to_rad(self.relative_null_lat))
+        result_x = delta_longitude * latitude_circumference / 360
+        result_y = delta_latitude * self.EARTH_CIRCUMFERENCE_THROUGH_POLES_METERS / 360
+        return result_x, result_y
+
+    def get_lat_lng_from_meters(self, lat, lon):
+        latitude_circumference = self.EARTH_CIRCUMFERENCE_AT_EQUATOR_METERS * cos(self.deg_to_rad(self.relative_null_lat))
+        delta_latitude = lon * 360 / self.EARTH_CIRCUMFERENCE_THROUGH_POLES_METERS
+        delta_longitude = lat * 360 / latitude_circumference
+
+        result_lat = delta_latitude + self.relative_null_lat
+        result_lng = delta_longitude + self.relative_null_lon
+
+        return result_lat, result_lng
+
+    @staticmethod
+    def deg_to_rad(degrees):
+        return degrees * pi / 180
+
+
+class Tile(list):
+    """
+    Rows `(uid, lat, lon, t, ds, dt)` of the first point of each user inside a tile, with the
+    set of those users for constant-time membership checks.
     """
-    Generates a dictionary of tiles where the key is a hash
-    of lat/lon/time and the value is a set of unique user
+    __slots__ = ('uids',)
+
+    def __init__(self, rows=()):
+        list.__init__(self)
+        self.uids = set()
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        if row[0] not in self.uids:
+            self.uids.add(row[0])
+            self.append(row)
+
+    def discard(self, uid):
+        """
+        Removes the row of `uid`, if the tile holds one.
+        """
+        if uid in self.uids:
+            self.uids.remove(uid)
+            self[:] = [row for row in self if row[0] != uid]
+
+
+class TileIndex(dict, LocalGrid):
+    """
+    Tiles keyed by the packed integer key (see `cell_key`) of their `(ix, iy, it)` grid cell.
+    The human-readable `lat{}_lon{}_t{}` hash of a tile is only rendered on request.
+    """
+    def __init__(self, ds, dt, relative_null_point):
+        dict.__init__(self)
+        self.ds = ds
+        self.dt = dt
+        self.relative_null_lat = relative_null_point[0]
+        self.relative_null_lon = relative_null_point[1]
+
+    def tile(self, key):
+        """
+        Returns an existing tile for the cell key if already generated.
+        Otherwise, generates and returns a new tile for it.
+        """
+        tile = self.get(key, None)
+        if tile is None:
+            tile = Tile()
+            self[key] = tile
+        return tile
+
+    def tile_hash(self, key):
+        return self.cell_hash(*cell_from_key(key))
+
+    def cell_hash(self, ix, iy, it):
+        local_lat, local_lon = self.get_lat_lng_from_meters(ix * self.ds, iy * self.ds)
+        return "lat{}_lon{}_t{}".format(local_lat, local_lon, it * self.dt)
+
+    def hashed_items(self):
+        for key, tile in self.items():
+            yield self.tile_hash(key), tile
+
+
+class GenerateTilesOp(PipelineOp, LocalGrid):
+    """
+    Generates a `TileIndex` of tiles where the key identifies a
+    lat/lon/time grid cell and the value holds the unique user
     ids that have points within that encoded
     spaciotemporal tile (cube).
+
+    With a `memory_budget` (bytes) the tiles are spilled to disk instead: the tile rows are
+    hash-partitioned by cell (see `TilePartitionWriter`), with as many partitions as it takes for
+    one of them to be sorted within the budget, and the output is the resulting `TilePartitions`,
+    which the graph ops pair one partition at a time. Every run writes to a new directory under
+    `spill_dir`, so partitions still in use are never overwritten; `TilePartitions#remove`
+    deletes them once they are no longer needed.
+
+    Tiles are built from the raw points of `data_op`'s store even when it simplifies trajectories;
+    pass `simplified` to tile the simplified points, which visit fewer (and other) cells, so the
+    resulting graph is only an approximation.
     """
-    def __init__(self, users, ds, dt, relative_null_point=(39.75872, 116.04142)):
+    def __init__(self, users, ds, dt, relative_null_point=(39.75872, 116.04142), data_op=None, batch=True, workers=1,
+                 memory_budget=None, spill_dir='app/data/partitions', simplified=False):
         PipelineOp.__init__(self)
-        self.tiles = {}
-        self.data_op = GeolifeData()
+        self.tiles = TileIndex(ds, dt, relative_null_point)
+        self.data_op = data_op if data_op is not None else GeolifeData()
         self.users = np.array(users)
         self.ds = ds
         self.dt = dt
         self.relative_null_lat = relative_null_point[0]
         self.relative_null_lon = relative_null_point[1]
+        self.batch = batch
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.simplified = simplified
 
     def perform(self):
+        if self.memory_budget is not None:
+            return self._apply_output(self.spill_tiles())
+
+        if self.batch and self.workers > 1:
+            # Users are tiled in shards across worker processes; their rows are merged in user
+            # order so tiles come out exactly as in the serial path.
+            relative_null_point = (self.relative_null_lat, self.relative_null_lon)
+            tile_rows = partial(_user_tile_rows, ds=self.ds, dt=self.dt, relative_null_point=relative_null_point,
+                                simplified=self.simplified)
+            with data_pool(self.data_op, self.workers, list(self.users)) as pool:
+                for keys, rows in pool.map(tile_rows, self.users, chunksize=shard_size(len(self.users), self.workers)):
+                    self.add_tile_rows(keys, rows)
+            return self._apply_output(self.tiles)
+
+        if self.batch:
+            for k, uid in enumerate(self.users):
+                self.tile_user(uid)
+                metrics.progress('users tiled', k + 1, len(self.users))
+            return self._apply_output(self.tiles)
+
         for uid in self.users:
-            for pt, plot in self.data_op.trajectories(uid):
+            user = self.user_points(uid)
+            for pt in (pt for i in range(user.trajectory_count()) for pt in user.points(i)):
                 traj_pt = TrajectoryPoint(pt, uid)
 
                 lat, lon = self.meters_for_lat_lon(traj_pt.lat, traj_pt.lon)
                 t = traj_pt.t
 
-                local_lat_meters = int(lat / self.ds) * self.ds
-                local_lon_meters = int(lon / self.ds) * self.ds
-
-                local_lat, local_lon = self.get_lat_lng_from_meters(local_lat_meters, local_lon_meters)
-                local_t = int(t / self.dt) * self.dt
-
-                tile_hash = "lat{}_lon{}_t{}".format(local_lat, local_lon, local_t)
-                tile = self.hash_tile(tile_hash)
-                # extract first column (uid)
-                users = [sub_list[0] for sub_list in tile]
-                if traj_pt.uid not in users:
-                    tile.append([traj_pt.uid, traj_pt.lat, traj_pt.lon, t, self.ds, self.dt])
+                key = cell_key(int(lat / self.ds), int(lon / self.ds), int(t / self.dt))
+                self.hash_tile(key).add((traj_pt.uid, traj_pt.lat, traj_pt.lon, t, self.ds, self.dt))
         return self._apply_output(self.tiles)
 
-    def hash_tile(self, tile_hash):
+    def tile_user(self, uid):
         """
-        Returns an existing tile based on tile hash if already generated.
-        Otherwise, generates and returns a new list for the given tile_hash.
+        Batch counterpart of the per-point loop in `#perform`: snaps every point of `uid` to the grid
+        at once and adds the user's first point in each cell to that cell's tile.
         """
-        tile = self.tiles.get(tile_hash, None)
-        if tile is None:
-            tile = []
-            self.tiles[tile_hash] = tile
-        return tile
+        self.add_tile_rows(*self.user_tile_rows(uid))
 
-    def meters_for_lat_lon(self, lat, lon):
+    def user_tile_rows(self, uid, start=0):
         """
-        Calculates X and Y distances in meters.
-
-        https://stackoverflow.com/a/3024728
+        Returns the cell keys visited by `uid`, in order of first visit, along with the tile row of
+        the user's first point in each of them. Only the user's points from row `start` on are read.
         """
-        delta_latitude = lat - self.relative_null_lat
-        delta_longitude = lon - self.relative_null_lon
-        latitude_circumference = self.EARTH_CIRCUMFERENCE_AT_EQUATOR_METERS * cos(self.deg_to_rad(self.relative_null_lat))
-        result_x = delta_longitude * latitude_circumference / 360
-        result_y = delta_latitude * self.EARTH_CIRCUMFERENCE_THROUGH_POLES_METERS / 360
-        return result_x, result_y
-
-    def get_lat_lng_from_meters(self, lat, lon):
-        latitude_circumference = self.EARTH_CIRCUMFERENCE_AT_EQUATOR_METERS * cos(self.deg_to_rad(self.relative_null_lat))
-        delta_latitude = lon * 360 / self.EARTH_CIRCUMFERENCE_THROUGH_POLES_METERS
-        delta_longitude = lat * 360 / latitude_circumference
+        lat, lon, t, ix, iy, it = self.user_cells(uid, start)
+        codec = CellCodec.fit(ix, iy, it)
+        # Index of the user's first point in every cell it visits, in order of first visit.
+        first = np.sort(np.unique(codec.encode(ix, iy, it), return_index=True)[1])
+        keys = [cell_key(ix[k], iy[k], it[k]) for k in first]
+        rows = [(uid, float(lat[k]), float(lon[k]), float(t[k]), self.ds, self.dt) for k in first]
+        return keys, rows
+
+    def spill_tiles(self):
+        """
+        Writes the tile rows of every user to `TilePartitions` in a new directory under
+        `spill_dir`. Rows are buffered up to the memory budget; the partition count is sized from
+        the number of points, an upper bound of the number of rows. Users are tiled serially
+        whatever `workers` is, since pool results would pile up outside the budget.
+        """
+        points = sum(len(self.user_points(uid)) for uid in self.users)
+        partitions = max(1, int(np.ceil(points * ROW_MEMORY / float(self.memory_budget))))
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = tempfile.mkdtemp(prefix='{}ds_{}dt_'.format(self.ds, self.dt), dir=self.spill_dir)
+        writer = TilePartitionWriter(path, partitions, self.ds, self.dt,
+                                     (self.relative_null_lat, self.relative_null_lon), self.users,
+                                     buffer_rows=max(1, self.memory_budget // ROW_MEMORY))
+        for k, uid in enumerate(self.users):
+            rows = self.user_spill_rows(uid)
+            rows['uid'] = k
+            metrics.count('tile_rows', len(rows))
+            writer.write(rows)
+            metrics.progress('users tiled', k + 1, len(self.users))
+        return writer.close()
+
+    def user_spill_rows(self, uid):
+        """
+        `TILE_ROW_DTYPE` counterpart of `#user_tile_rows` (with the uid left for the caller to
+        set): the cell and point of the user's first point in every cell it visits.
+        """
+        lat, lon, t, ix, iy, it = self.user_cells(uid)
+        codec = CellCodec.fit(ix, iy, it)
+        first = np.sort(np.unique(codec.encode(ix, iy, it), return_index=True)[1])
+        rows = np.zeros(len(first), dtype=TILE_ROW_DTYPE)
+        for name, column in zip(('ix', 'iy', 'it', 'lat', 'lon', 't'), (ix, iy, it, lat, lon, t)):
+            rows[name] = column[first]
+        return rows
+
+    def add_tile_rows(self, keys, rows):
+        metrics.count('tile_rows', len(rows))
+        for key, row in zip(keys, rows):
+            self.hash_tile(key).add(row)
+
+    def user_points(self, uid):
+        """
+        The points of `uid` this op tiles: raw, or simplified with `simplified`.
+        """
+        return self.data_op.user_points(uid) if self.simplified else self.data_op.store.user(uid)
 
-        result_lat = delta_latitude + self.relative_null_lat
-        result_lng = delta_longitude + self.relative_null_lon
+    def user_cells(self, uid, start=0):
+        """
+        Returns the lat, lon and time columns of every point of `uid` (from row `start` on) along
+        with the integer grid cell `(ix, iy, it)` each point falls in.
+        """
+        user = self.user_points(uid)
+        lat, lon = np.asarray(user.lat[start:]), np.asarray(user.lon[start:])
+        t = ole_days_to_unix(user.days[start:])
+        x, y = self.meters_for_lat_lon(lat, lon)
+        # `int()` in the per-point path truncates toward zero; `np.trunc` keeps the same cells.
+        ix = np.trunc(x / self.ds).astype(np.int64)
+        iy = np.trunc(y / self.ds).astype(np.int64)
+        it = np.trunc(t / self.dt).astype(np.int64)
+        return lat, lon, t, ix, iy, it
+
+    def hash_tile(self, key):
+        """
+        Returns an existing tile based on its cell key if already generated.
+        Otherwise, generates and returns a new tile for the given key.
+        """
+        return self.tiles.tile(key)
 
-        return result_lat, result_lng
 
-    @staticmethod
-    def deg_to_rad(degrees):
-        return degrees * pi / 180
+def _user_tile_rows(uid, ds, dt, relative_null_point, simplified=False):
+    """
+    Pool worker entry point for `GenerateTilesOp`: the tile rows of a single user.
+    """
+    op = GenerateTilesOp([], ds, dt, relative_null_point, data_op=worker_data(), simplified=simplified)
+    return op.user_tile_rows(uid)
 
 
 class GraphContactPointsOp(PipelineOp):
-    def __init__(self, hashed_tiles, weight):
+    """
+    Weighted graph of the users sharing a tile. Per-pair rows are only built on request: with
+    `contact_points` (or a `contact_points_path`) every pair also lands in the `contact_points`
+    `ContactTable`, streamed to `contact_points_path` in row groups as pairs are produced and
+    returned memory-mapped. Without them a `count_weight` graph comes straight from the sparse
+    tile incidence matrix (see `tile_incidence_graph`). `hashed_tiles` may also be the
+    `TilePartitions` of an out-of-core tiling, paired one partition at a time.
+    """
+    def __init__(self, hashed_tiles, weight, contact_points=False, contact_points_path=None):
         PipelineOp.__init__(self)
         self.hashed_tiles = hashed_tiles
         self.weight = weight
+        self.contact_points = contact_points or contact_points_path is not None
+        self.contact_points_path = contact_points_path
         assert(weight in ['dist_weight', 'count_weight'])
 
     def perform(self):
-        contact_points = [['uid1', 'uid2', 'ds', 'dt', 'tile_hash', 'dist_apart', 'time_diff', 'lat1', 'lat2', 'lon1', 'lon2', 't1', 't2']]
-        tiles = self.hashed_tiles.items()
-        tile_count = len(tiles)
-        op_count = 0
-        graph = nx.Graph()
-        delta = (None, None)
-        for tile_hash, uids in tiles:
-            if not tile_hash:
-                graph_filepath = 'app/data/graphs/no_tiles_from_data.png'
-                return self._apply_output({"graph_filepath": graph_filepath, "graph_generated": False})
-            if not delta:
-                delta = (uids[0][4], uids[0][5])
-            if len(uids) > 1:
-                contact_pairs = itertools.combinations(uids, 2)
-                for user_pair in contact_pairs:
-                    user1, user2 = user_pair
-                    u1_uid, u1_lat, u1_lon, u1_t, u1_ds, u1_dt = user1
-                    u2_uid, u2_lat, u2_lon, u2_t, u2_ds, u2_dt = user2
-                    u1_lat_lon = (u1_lat, u1_lon)
-                    u2_lat_lon = (u2_lat, u2_lon)
-                    distance = dist_apart(u1_lat_lon, u2_lat_lon)
-                    time_difference = abs(u1_t - u2_t)
-                    contact_points.append([u1_uid, u2_uid, u1_ds, u1_dt, tile_hash, distance, time_difference, u1_lat, u2_lat, u1_lon, u2_lon, u1_t, u2_t])
-
-                    if self.weight == 'dist_weight':
-                        graph = weight_by_distance(graph, user1, user2)
-                    elif self.weight == 'count_weight':
-                        graph = weight_by_count(graph, user1, user1)
-
-            op_count += 1
-            print("Remaining Tiles: {}".format(tile_count - op_count))
+        if not isinstance(self.hashed_tiles, TilePartitions) and any(tile_key is None or tile_key == '' for tile_key in self.hashed_tiles):
+            graph_filepath = 'app/data/graphs/no_tiles_from_data.png'
+            return self._apply_output({"graph_filepath": graph_filepath, "graph_generated": False})
+
+        ds, dt = tile_delta(self.hashed_tiles)
+        writer = ContactTableWriter(self.contact_points_path, {'ds': ds, 'dt': dt}) if self.contact_points else None
+        graph, contact_points = tile_contact_graph(self.hashed_tiles, self.weight, dt, writer=writer)
 
         # graph_filepath = 'app/data/graphs/{}.png'.format(str(delta[0]) + 'ds_' + str(delta[1]) + 'dt')
         # nx.draw_circular(graph, with_labels=True)  # spectral circular random
         # plt.savefig(graph_filepath, bbox_inches='tight')
-        ds, dt = delta
         gml_filepath = 'app/data/graphs/{}.gml'.format(str(ds) + 'ds_' + str(dt) + 'dt_' + str(self.weight))
-        nx.write_gml(graph, gml_filepath)
+        graph.write_gml(gml_filepath)
 
-        # largest_comp = find_largest_component(graph)
-        # avg_degree = find_average_degree(graph)
-        # graph_results(largest_comp, avg_degree, deltas)
-        return self._apply_output({"contact_points": np.asarray(contact_points), "graph_filepath": gml_filepath, "graph_generated": True})
+        result = {"graph": graph, "graph_filepath": gml_filepath, "graph_generated": True}
+        if contact_points is not None:
+            result["contact_points"] = contact_points
+        return self._apply_output(result)
 
 
 class GraphHottestPointsOp(PipelineOp):
-    def __init__(self, hashed_tiles, weight):
+    def __init__(self, hashed_tiles, weight, contact_points=False, contact_points_path=None):
         PipelineOp.__init__(self)
         self.hashed_tiles = hashed_tiles
         self.weight = weight
+        self.contact_points = contact_points or contact_points_path is not None
+        self.contact_points_path = contact_points_path
 
     def perform(self):
-        contact_points = [['uid1', 'uid2', 'ds', 'dt', 'tile_hash', 'dist_apart', 'time_diff', 'lat1', 'lat2', 'lon1', 'lon2', 't1', 't2']]
-        user_count_in_tiles = [len(uids) for tile_hash, uids in self.hashed_tiles.items()]
-        hot_zone_count = max(user_count_in_tiles)
-        graph = nx.Graph()
-        delta = (None, None)
-        for tile_hash, uids in self.hashed_tiles.items():
-            if not delta:
-                delta = (uids[0][4], uids[0][5])
-            if len(uids) == hot_zone_count:
-                contact_pairs = itertools.combinations(uids, 2)
-                for user_pair in contact_pairs:
-                    user1, user2 = user_pair
-                    u1_uid, u1_lat, u1_lon, u1_t, u1_ds, u1_dt = user1
-                    u2_uid, u2_lat, u2_lon, u2_t, u2_ds, u2_dt = user2
-                    u1_lat_lon = (u1_lat, u1_lon)
-                    u2_lat_lon = (u2_lat, u2_lon)
-                    distance = dist_apart(u1_lat_lon, u2_lat_lon)
-                    time_difference = abs(u1_t - u2_t)
-                    contact_points.append([u1_uid, u2_uid, u1_ds, u1_dt, tile_hash, distance, time_difference, u1_lat, u2_lat, u1_lon, u2_lon, u1_t, u2_t])
-
-                    if self.weight == 'dist_weight':
-                        graph = weight_by_distance(graph, user_pair[0], user_pair[1])
-                    elif self.weight == 'count_weight':
-                        graph = weight_by_count(graph, user_pair[0], user_pair[1])
-
-        ds, dt = delta
+        hot_zone_count = max_tile_size(self.hashed_tiles)
+        ds, dt = tile_delta(self.hashed_tiles)
+        writer = ContactTableWriter(self.contact_points_path, {'ds': ds, 'dt': dt}) if self.contact_points else None
+        graph, contact_points = tile_contact_graph(self.hashed_tiles, self.weight, dt, size=hot_zone_count, writer=writer)
+
         gml_filepath = 'app/data/graphs/{}.gml'.format(str(ds) + 'ds_' + str(dt) + 'dt_hot_zones')
-        nx.write_gml(graph, gml_filepath)
+        graph.write_gml(gml_filepath)
 
-        return self._apply_output({"contact_points": np.asarray(contact_points), "gml_filepath": gml_filepath, "graph_generated": True})
+        result = {"graph": graph, "gml_filepath": gml_filepath, "graph_generated": True}
+        if contact_points is not None:
+            result["contact_points"] = contact_points
+        return self._apply_output(result)
 
 
-def weight_by_count(graph, user1, user2):
+def tile_contact_graph(tiles, weight, dt, size=None, writer=None):
+    """
+    Builds the `ContactGraph` of every pair of rows sharing a tile (see `tile_contact_blocks`),
+    writing the pairs to `writer` (a `ContactTableWriter`) as they are produced. Returns the graph
+    and the closed writer's table, if any.
+
+    Without a writer, `count_weight` graphs only need the number of tiles each pair shares and are
+    built from the tile incidence matrix instead (see `tile_incidence_graph`).
+    """
+    if weight == 'count_weight' and writer is None:
+        return tile_incidence_graph(tiles, dt, size), None
+
+    graphs, uid1, uid2, distance, time_diff, pairs = [], [], [], [], [], 0
+    for block in tile_contact_blocks(tiles, size):
+        if writer is not None:
+            writer.write(block)
+        uid1.append(block['uid1'])
+        uid2.append(block['uid2'])
+        distance.append(block['dist_apart'])
+        time_diff.append(block['time_diff'])
+        pairs += len(block['uid1'])
+        if pairs >= FOLD_PAIRS:
+            # Pairs are folded into the graph as they come, so they never pile up in memory.
+            graphs = [ContactGraph.combine(graphs + [_pairs_graph(uid1, uid2, distance, time_diff, weight, dt)], weight, dt)]
+            uid1, uid2, distance, time_diff, pairs = [], [], [], [], 0
+    graph = _pairs_graph(uid1, uid2, distance, time_diff, weight, dt)
+    if graphs:
+        graph = ContactGraph.combine(graphs + [graph], weight, dt)
+    return graph, writer.close() if writer is not None else None
+
+
+def _pairs_graph(uid1, uid2, distance, time_diff, weight, dt):
+    columns = [np.concatenate(c) if c else np.zeros(0) for c in (uid1, uid2, distance, time_diff)]
+    return ContactGraph.from_contacts(*columns, weight=weight, dt=dt)
+
+
+def tile_incidence(tiles, size=None):
+    """
+    Returns `(users, B)`: the sorted uids of every row in a tile shared by two or more users (or
+    only tiles of exactly `size` rows) and the sparse `users x tiles` incidence matrix `B` with a 1
+    wherever a user has a row in a tile.
+    """
+    uids, counts = [], []
+    for tile in tiles.values():
+        if len(tile) > 1 and (size is None or len(tile) == size):
+            uids.extend(row[0] for row in tile)
+            counts.append(len(tile))
+    metrics.count('tiles_processed', len(tiles))
+    users, user_codes = np.unique(np.array(uids, dtype=str), return_inverse=True)
+    tile_codes = np.repeat(np.arange(len(counts)), counts)
+    incidence = sparse.csr_matrix((np.ones(len(uids), dtype=np.int64), (user_codes, tile_codes)),
+                                  shape=(len(users), len(counts)))
+    return users, incidence
+
+
+def tile_incidence_graph(tiles, dt, size=None):
+    """
+    `count_weight` `ContactGraph` of the users sharing a tile from a single sparse product: with
+    `B` the user x tile incidence matrix (see `tile_incidence`), `B @ B.T` holds the number of
+    tiles every pair of users shares, its edge count. No per-pair rows are built, so the graph
+    carries no distances or time differences.
+    """
+    if isinstance(tiles, TilePartitions):
+        return partition_incidence_graph(tiles, dt, size)
+    users, incidence = tile_incidence(tiles, size)
+    shared = sparse.triu(incidence @ incidence.T, k=1).tocoo()
+    order = np.lexsort((shared.col, shared.row))
+    row, col, count = shared.row[order], shared.col[order], shared.data[order]
+    metrics.count('tile_pairs', int(count.sum()))
+    return ContactGraph(users[row], users[col], count, None, None, weight='count_weight', dt=dt)
+
+
+def partition_incidence_graph(partitions, dt, size=None):
+    """
+    `tile_incidence_graph` of `TilePartitions`: the shared tile counts are summed up over the
+    incidence product of every partition, so only one partition's incidence matrix is ever built.
+    """
+    n = len(partitions.uids)
+    shared = sparse.csr_matrix((n, n), dtype=np.int64)
+    for k in range(partitions.partition_count()):
+        rows, starts, sizes = partitions.partition(k)
+        keep = (sizes > 1) & ((sizes == size) if size is not None else True)
+        tile_codes, index = expand_ranges(starts[keep], sizes[keep])
+        incidence = sparse.csr_matrix((np.ones(len(index), dtype=np.int64), (rows['uid'][index], tile_codes)),
+                                      shape=(n, int(keep.sum())))
+        shared = shared + sparse.triu(incidence @ incidence.T, k=1)
+        metrics.count('tiles_processed', len(sizes))
+    shared = shared.tocoo()
+    # Same edge order as `tile_incidence_graph`: by sorted uid of both ends.
+    rank = np.argsort(np.argsort(partitions.uids, kind='stable'), kind='stable')
+    lo, hi = np.minimum(rank[shared.row], rank[shared.col]), np.maximum(rank[shared.row], rank[shared.col])
+    order = np.lexsort((hi, lo))
+    row, col, count = shared.row[order], shared.col[order], shared.data[order]
+    metrics.count('tile_pairs', int(count.sum()))
+    return ContactGraph(partitions.uids[row], partitions.uids[col], count, None, None, weight='count_weight', dt=dt)
+
+
+def tile_contacts(tiles, size=None):
+    """
+    In-memory `ContactTable` of every pair of rows sharing a tile (see `tile_contact_blocks`).
+    """
+    writer = ContactTableWriter(attributes=dict(zip(('ds', 'dt'), tile_delta(tiles))))
+    for block in tile_contact_blocks(tiles, size):
+        writer.write(block)
+    return writer.close()
+
+
+def tile_contact_blocks(tiles, size=None, max_pairs=ROW_GROUP_SIZE):
+    """
+    Yields the contact columns (see `ContactTableWriter#write`) of every pair of rows sharing a
+    tile, or only tiles of exactly `size` rows, in tile and `itertools.combinations` order. Whole
+    tiles are grouped into blocks of about `max_pairs` pairs.
+    """
+    if isinstance(tiles, TilePartitions):
+        yield from partition_contact_blocks(tiles, size, max_pairs)
+        return
+    rows, idx1, idx2, tile_hashes, pair_tiles, pairs = [], [], [], [], [], 0
+    for done, (tile_key, tile) in enumerate(tiles.items(), 1):
+        if len(tile) > 1 and (size is None or len(tile) == size):
+            i, j = np.triu_indices(len(tile), 1)
+            idx1.append(i + len(rows))
+            idx2.append(j + len(rows))
+            pair_tiles.append(np.full(len(i), len(tile_hashes)))
+            tile_hashes.append(render_tile_hash(tiles, tile_key))
+            rows.extend(tile)
+            pairs += len(i)
+            if pairs >= max_pairs:
+                metrics.progress('tiles processed', done, len(tiles))
+                yield _contact_block(rows, idx1, idx2, tile_hashes, pair_tiles)
+                rows, idx1, idx2, tile_hashes, pair_tiles, pairs = [], [], [], [], [], 0
+    metrics.count('tiles_processed', len(tiles))
+    metrics.progress('tiles processed', len(tiles), len(tiles))
+    if pairs:
+        yield _contact_block(rows, idx1, idx2, tile_hashes, pair_tiles)
+
+
+def partition_contact_blocks(partitions, size=None, max_pairs=ROW_GROUP_SIZE):
+    """
+    `tile_contact_blocks` of `TilePartitions`, one partition at a time: tiles come in partition
+    and cell order, and the pairs of a tile in `itertools.combinations` order of its rows.
+    """
+    grid = TileIndex(partitions.ds, partitions.dt, partitions.relative_null_point)
+    total, done = len(partitions), 0
+    for k in range(partitions.partition_count()):
+        rows, starts, sizes = partitions.partition(k)
+        done += len(sizes)
+        keep = (sizes > 1) & ((sizes == size) if size is not None else True)
+        starts, sizes = starts[keep], sizes[keep]
+        for lo, hi in candidate_blocks(sizes * (sizes - 1) // 2, max_pairs):
+            # Every row of a tile pairs up with the rows of the tile after it.
+            tile_of_row, index = expand_ranges(starts[lo:hi], sizes[lo:hi])
+            pair_row, idx2 = expand_ranges(index + 1, (starts + sizes)[lo:hi][tile_of_row] - index - 1)
+            idx1, pair_tiles = index[pair_row], tile_of_row[pair_row]
+            cells = rows[starts[lo:hi]]
+            tile_hashes = [grid.cell_hash(*cell) for cell in zip(*(cells[c].tolist() for c in ('ix', 'iy', 'it')))]
+            row1, row2 = rows[idx1], rows[idx2]
+            yield _pair_columns(partitions.uids[row1['uid']], partitions.uids[row2['uid']],
+                                (row1['lat'], row1['lon'], row1['t']), (row2['lat'], row2['lon'], row2['t']),
+                                tile_hashes, pair_tiles)
+        metrics.progress('tiles processed', done, total)
+    metrics.count('tiles_processed', total)
+
+
+def _contact_block(rows, idx1, idx2, tile_hashes, pair_tiles):
+    uid = np.array([row[0] for row in rows], dtype=str)
+    lat, lon, t = (np.array([row[k] for row in rows], dtype=float) for k in (1, 2, 3))
+    idx1, idx2, pair_tiles = (np.concatenate(c) for c in (idx1, idx2, pair_tiles))
+    return _pair_columns(uid[idx1], uid[idx2], (lat[idx1], lon[idx1], t[idx1]), (lat[idx2], lon[idx2], t[idx2]),
+                         tile_hashes, pair_tiles)
+
+
+def _pair_columns(uid1, uid2, point1, point2, tile_hashes, pair_tiles):
+    (lat1, lon1, t1), (lat2, lon2, t2) = point1, point2
+    metrics.count('tile_pairs', len(uid1))
+    return {
+        'uid1': uid1,
+        'uid2': uid2,
+        'tile': pair_tiles,
+        'tile_hashes': tile_hashes,
+        'dist_apart': haversine(lat1, lon1, lat2, lon2),
+        'time_diff': np.abs(t1 - t2),
+        'lat1': lat1,
+        'lat2': lat2,
+        'lon1': lon1,
+        'lon2': lon2,
+        't1': t1,
+        't2': t2,
+    }
+
+
+def tile_delta(tiles):
+    """
+    The `(ds, dt)` tiles were generated with.
+    """
+    if isinstance(tiles, (TileIndex, TilePartitions)):
+        return tiles.ds, tiles.dt
+    for rows in tiles.values():
+        if len(rows):
+            return rows[0][4], rows[0][5]
+    return None, None
+
+
+def max_tile_size(tiles):
+    """
+    The most rows any tile holds.
+    """
+    if isinstance(tiles, TilePartitions):
+        return tiles.max_tile_size
+    return max(len(uids) for uids in tiles.values())
+
+
+def render_tile_hash(tiles, key):
+    """
+    Renders the hash of a `TileIndex` tile. Plain dicts of tiles are already keyed by hash.
+    """
+    return tiles.tile_hash(key) if isinstance(tiles, TileIndex) else key
+
+
+def weight_by_count(graph, user1, user2, distance=None):
     u1_uid, u1_lat, u1_lon, u1_t, u1_ds, u1_dt = user1
     u2_uid, u2_lat, u2_lon, u2_t, u2_ds, u2_dt = user2
-    u1_lat_lon = (u1_lat, u1_lon)
-    u2_lat_lon = (u2_lat, u2_lon)
-    distance = dist_apart(u1_lat_lon, u2_lat_lon)
+    if distance is None:
+        distance = dist_apart((u1_lat, u1_lon), (u2_lat, u2_lon))
     time_difference = abs(u1_t - u2_t)
 
     if not graph.has_edge(u1_uid, u2_uid):
@@ -199,12 +579,11 @@ def weight_by_count(graph, user1, user2):
     return graph
 
 
-def weight_by_distance(graph, user1, user2):
+def weight_by_distance(graph, user1, user2, distance=None):
     u1_uid, u1_lat, u1_lon, u1_t, u1_ds, u1_dt = user1
     u2_uid, u2_lat, u2_lon, u2_t, u2_ds, u2_dt = user2
-    u1_lat_lon = (u1_lat, u1_lon)
-    u2_lat_lon = (u2_lat, u2_lon)
-    distance = dist_apart(u1_lat_lon, u2_lat_lon)
+    if distance is None:
+        distance = dist_apart((u1_lat, u1_lon), (u2_lat, u2_lon))
     time_difference = abs(u1_t - u2_t)
     delta = (u1_ds, u1_dt)
     ds, dt = delta
@@ -220,16 +599,10 @@ def weight_by_distance(graph, user1, user2):
 
 
 def dist_apart(p1, p2):
-    # convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [p1[1], p1[0], p2[1], p2[0]])
-    # haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    # Radius of earth in kilometers is 6371
-    km = 6371 * c
-    return km * 1000
+    """
+    Haversine distance in meters between two `(lat, lon)` points.
+    """
+    return float(haversine(p1[0], p1[1], p2[0], p2[1]))
 
 # def find_largest_component(graph):
 #     component_size = [len(c) for c in sorted(nx.connected_components(graph), key=len, reverse=True)]
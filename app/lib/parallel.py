@@ -0,0 +1,39 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+from app.lib.datasets import GeolifeData
+
+_worker_data = None
+
+
+def data_pool(data, workers, users=None):
+    """
+    Returns a `ProcessPoolExecutor` whose workers each open `data`'s trajectory store.
+
+    The store is built up front so workers only ever memory-map the same read-only column files:
+    trajectories are shared through the page cache instead of being pickled to every process.
+    Workers reopen the store through its `opener`, so any store providing one can be shared.
+    """
+    data.store.ingest(users)
+    factory, args = data.store.opener()
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(factory, args, data.simplify))
+
+
+def worker_data():
+    """
+    The `GeolifeData` of the current pool worker.
+    """
+    return _worker_data
+
+
+def shard_size(count, workers):
+    """
+    Chunk size splitting `count` tasks into a few shards per worker, so uneven shards still balance.
+    """
+    return max(1, int(math.ceil(count / float(workers * 4))))
+
+
+def _init_worker(factory, args, simplify=None):
+    global _worker_data
+    _worker_data = GeolifeData(store=factory(*args), simplify=simplify)
@@ -0,0 +1,180 @@
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from app.lib.pipeline_ops import fingerprint_of
+
+
+class PipelineNode:
+    """
+    A deferred `PipelineOp`: the op class and its constructor inputs, where any input may be another
+    node whose output is substituted once it has been computed.
+    """
+    def __init__(self, graph, op_class, args, kwargs):
+        self.graph = graph
+        self.op_class = op_class
+        self.args = args
+        self.kwargs = kwargs
+        self.upstream = _nodes_in((args, kwargs))
+        self.key = fingerprint_of(('{}.{}'.format(op_class.__module__, op_class.__qualname__), args, kwargs))
+        self.name = '{}#{}'.format(op_class.__name__, self.key[:8])
+
+    def fingerprint(self):
+        return self.key
+
+    def output(self):
+        return self.graph.run(self)[0]
+
+    def __repr__(self):
+        return self.name
+
+
+class PipelineGraph:
+    """
+    Lazily evaluated DAG of `PipelineOp`s.
+
+    `#op` declares a node without running anything; passing a node as an input of another op
+    declares the dependency. Nodes with the same op class and inputs are deduplicated, so shared
+    upstream work runs once. `#run` computes only what its targets need, running independent
+    branches concurrently on a thread pool (`executor='thread'`) or process pool
+    (`executor='process'`; ops and their inputs must then be picklable). Outputs are kept, so
+    later runs reuse them.
+
+    Every computed node records its wall time in `#stats`, and with `trace_memory` its peak traced
+    (`tracemalloc`) memory, at the cost of tracing every allocation while it runs. Nodes running
+    alone in their process measure their own peak; nodes overlapping on a thread pool share the
+    counter, so their peaks overlap and each is only an upper bound. Before Python 3.9 the peak
+    of a `tracemalloc` trace started outside the graph can't be reset, so it is an upper bound too.
+    """
+    def __init__(self, workers=1, executor='thread', cache=None, trace_memory=False):
+        assert(executor in ['thread', 'process'])
+        self.workers = workers
+        self.executor = executor
+        self.cache = cache
+        self.trace_memory = trace_memory
+        self.nodes = {}
+        self.__outputs = {}
+        self.__stats = {}
+
+    def op(self, op_class, *args, **kwargs):
+        """
+        Declares (or returns the existing identical) node for `op_class(*args, **kwargs)`.
+        """
+        node = PipelineNode(self, op_class, args, kwargs)
+        return self.nodes.setdefault(node.key, node)
+
+    def run(self, *targets):
+        """
+        Computes the given nodes and everything upstream of them that isn't computed yet, and
+        returns their outputs.
+        """
+        pending = self.__pending(targets)
+        if self.workers <= 1:
+            for node in pending:
+                self.__finish(node, _perform(*self.__task(node)))
+        elif pending:
+            pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+            with pool_class(max_workers=self.workers) as pool:
+                running = {}
+                while pending or running:
+                    for node in [n for n in pending if all(up.key in self.__outputs for up in n.upstream)]:
+                        pending.remove(node)
+                        running[pool.submit(_perform, *self.__task(node))] = node
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__finish(running.pop(future), future.result())
+        return [self.__outputs[node.key] for node in targets]
+
+    def stats(self):
+        """
+        Per computed node: op name, upstream node names, wall time (seconds) and peak memory (bytes,
+        None unless `trace_memory` is on).
+        """
+        return [dict(self.__stats[key], node=node.name, upstream=[up.name for up in node.upstream])
+                for key, node in self.nodes.items() if key in self.__stats]
+
+    def __pending(self, targets):
+        # Depth-first post-order: every node comes after its upstream nodes.
+        order, seen = [], set()
+
+        def visit(node):
+            if node.key in seen or node.key in self.__outputs:
+                return
+            seen.add(node.key)
+            for up in node.upstream:
+                visit(up)
+            order.append(node)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def __task(self, node):
+        args, kwargs = _resolve((node.args, node.kwargs), self.__outputs)
+        return node.op_class, args, kwargs, self.cache, self.trace_memory
+
+    def __finish(self, node, result):
+        output, wall_time, peak_memory = result
+        self.__outputs[node.key] = output
+        self.__stats[node.key] = {'op': node.op_class.__name__, 'wall_time': wall_time, 'peak_memory': peak_memory}
+
+
+_tracing_lock = threading.Lock()
+_tracing_nodes = 0
+_tracing_started = False
+
+
+def _perform(op_class, args, kwargs, cache, trace_memory):
+    """
+    Builds and performs one op. Returns `(output, wall_time, peak_memory)`.
+    """
+    global _tracing_nodes, _tracing_started
+    if trace_memory:
+        with _tracing_lock:
+            if _tracing_nodes == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing_started = True
+            elif _tracing_nodes == 0 and hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            _tracing_nodes += 1
+            start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.time()
+    try:
+        op = op_class(*args, **kwargs)
+        if cache is not None:
+            op.persist(cache)
+        output = op.output()
+    finally:
+        wall_time = time.time() - start
+        peak_memory = None
+        if trace_memory:
+            with _tracing_lock:
+                peak_memory = max(0, tracemalloc.get_traced_memory()[1] - start_memory)
+                _tracing_nodes -= 1
+                if _tracing_nodes == 0 and _tracing_started:
+                    tracemalloc.stop()
+                    _tracing_started = False
+    return output, wall_time, peak_memory
+
+
+def _nodes_in(value):
+    if isinstance(value, PipelineNode):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [node for v in value for node in _nodes_in(v)]
+    if isinstance(value, dict) and type(value) is dict:
+        return [node for v in value.values() for node in _nodes_in(v)]
+    return []
+
+
+def _resolve(value, outputs):
+    if isinstance(value, PipelineNode):
+        return outputs[value.key]
+    if isinstance(value, tuple):
+        return tuple(_resolve(v, outputs) for v in value)
+    if isinstance(value, list):
+        return [_resolve(v, outputs) for v in value]
+    if isinstance(value, dict) and type(value) is dict:
+        return {k: _resolve(v, outputs) for k, v in value.items()}
+    return value
@@ -1,3 +1,11 @@
+import hashlib
+import pickle
+
+import numpy as np
+
+from app.lib import metrics
+
+
 class PipelineOp:
 	"""
 	Pipeline Operations
@@ -11,19 +19,93 @@ class PipelineOp:
 		`#output` to local variables.
 
 		Declare op output by calling `#_apply_output` once you've performed your operation.
+
+	Outputs are only kept in memory by default; `#persist` opts an op into an on-disk `OpCache`
+	keyed on its `#fingerprint`.
 	"""
 
+	def __new__(cls, *args, **kwargs):
+		op = object.__new__(cls)
+		# Constructor inputs, recorded for `#fingerprint`.
+		op.__args = (args, kwargs)
+		op.__cache = None
+		return op
+
 	def __init__(self):
 		self.__output = None
 
+	def persist(self, cache):
+		"""
+		Loads the output of this op from `cache` when it holds a result for the same fingerprint;
+		otherwise performs the op and stores its output there.
+		"""
+		self.__cache = cache
+		return self
+
+	def fingerprint(self):
+		"""
+		Content address of this op's output: its class, constructor inputs and the fingerprint of
+		every attribute that has one (e.g. the `GeolifeData` it reads).
+		"""
+		args, kwargs = self.__args
+		sources = [(name, value.fingerprint()) for name, value in sorted(vars(self).items()) if _has_fingerprint(value)]
+		cls = type(self)
+		return fingerprint_of(('{}.{}'.format(cls.__module__, cls.__qualname__), args, kwargs, sources))
+
 	def perform(self):
 		raise NotImplementedError
 
 	def output(self):
 		if self.__output is None:
-			self.perform()
+			if self.__cache is None:
+				self.__perform()
+			else:
+				key = self.fingerprint()
+				found, value = self.__cache.load(key)
+				if found:
+					metrics.count('op_cache_hits')
+					self._apply_output(value)
+				else:
+					self.__perform()
+					self.__cache.store(key, self.__output)
 		return self.__output
 
+	def __perform(self):
+		# Every op's perform is timed under its class name when metrics are enabled.
+		with metrics.timer(type(self).__name__):
+			self.perform()
+
 	def _apply_output(self, value):
 		self.__output = value
 		return self
+
+
+def fingerprint_of(value):
+	"""
+	Stable hex digest of an op input. Arrays hash their bytes, objects with a `fingerprint` method
+	(ops, datasets) use it and anything else falls back to its pickle.
+	"""
+	return hashlib.sha1(_token(value).encode('utf-8')).hexdigest()
+
+
+def _token(value):
+	if value is None or isinstance(value, (bool, int, float, str, bytes)):
+		return repr(value)
+	if isinstance(value, np.generic):
+		return repr(value.item())
+	if isinstance(value, (list, tuple)):
+		return '[{}]'.format(','.join(_token(v) for v in value))
+	if isinstance(value, dict) and type(value) is dict:
+		return '{{{}}}'.format(','.join(sorted('{}:{}'.format(_token(k), _token(v)) for k, v in value.items())))
+	if isinstance(value, np.ndarray) and value.dtype.hasobject:
+		return 'ndarray({})'.format(_token(value.tolist()))
+	if isinstance(value, np.ndarray):
+		digest = hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+		return 'ndarray({},{},{})'.format(value.dtype.str, value.shape, digest)
+	if _has_fingerprint(value):
+		return 'fingerprint({})'.format(value.fingerprint())
+	return 'pickle({})'.format(hashlib.sha1(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)).hexdigest())
+
+
+def _has_fingerprint(value):
+	return not isinstance(value, type) and callable(getattr(value, 'fingerprint', None))
@@ -1,51 +1,95 @@
 import datetime
-from math import radians, cos, sin, asin, sqrt
+import math
 
 import numpy as np
 import pytz
 
+from app.lib.geodesy import haversine
+
+# Unix epoch (1970-01-01) expressed as an OLE Automation date (days since 1899-12-30).
+OLE_UNIX_EPOCH_DAYS = 25569
+
+
+def ole_days_to_unix(days):
+    """
+    Vectorized conversion of OLE Automation dates (the `days` column of a PLT file) to Unix seconds.
+
+    Rounds to whole microseconds exactly like `datetime.timedelta(days=...)`, so the result is
+    bit-for-bit equal to `TrajectoryPoint.t`.
+    """
+    days = np.asarray(days, dtype=float)
+    whole = np.trunc(days)
+    microseconds = (whole - OLE_UNIX_EPOCH_DAYS) * 86400e6 + np.rint((days - whole) * 86400e6)
+    return microseconds / 1e6
+
+
+def ole_day_to_unix(days):
+    """
+    Scalar counterpart of `ole_days_to_unix`, with the same arithmetic so both agree bit for bit.
+    """
+    whole = math.trunc(days)
+    microseconds = (whole - OLE_UNIX_EPOCH_DAYS) * 86400e6 + round((days - whole) * 86400e6)
+    return microseconds / 1e6
+
 
 class TrajectoryPoint:
-    def __init__(self, pnt, uid=None):
+    __slots__ = ('pnt', 'uid', 'lat', 'lon', 'alt', 'days', 't', 't2')
+
+    def __init__(self, pnt, uid=None, t=None):
         self.pnt = pnt
         self.uid = uid
         self.lat = pnt[0]
         self.lon = pnt[1]
         self.alt = pnt[3]
         self.days = pnt[4]
-        self.datetime = (datetime.datetime(1899, 12, 30, tzinfo=pytz.utc) + datetime.timedelta(days=self.days))
-        self.t = self.datetime.timestamp()
+        self.t = ole_day_to_unix(self.days) if t is None else t
         self.t2 = (self.days * 24 * 60 * 60)
 
+    @classmethod
+    def from_columns(cls, lat, lon, alt, days, uid=None):
+        """
+        Builds a point for every row of the given columns, converting the whole `days` column to
+        Unix seconds at once.
+        """
+        t = ole_days_to_unix(days).tolist()
+        lat, lon, alt, days = (np.asarray(c, dtype=float).tolist() for c in (lat, lon, alt, days))
+        return [cls([la, lo, 0., al, d], uid, ti) for la, lo, al, d, ti in zip(lat, lon, alt, days, t)]
+
+    @property
+    def datetime(self):
+        return datetime.datetime(1899, 12, 30, tzinfo=pytz.utc) + datetime.timedelta(days=self.days)
+
+    def __setstate__(self, state):
+        # Slotted points pickle as `(None, slots)`. Pickles from before `__slots__` hold a plain
+        # `__dict__`, including the `datetime` that is now derived from `days`.
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            if name != 'datetime':
+                setattr(self, name, value)
+
     def __str__(self):
         return '[lat: {}  lon: {}  alt: {}  time: {}]'.format(self.lat, self.lon, self.alt, self.t)
 
 
 class ContactPoint(TrajectoryPoint):
+    __slots__ = ('p1', 'p2', 'traj_plt_p1', 'traj_plt_p2', '__dist_apart')
+
     def __init__(self, p1, p2, traj_plt_p1, traj_plt_p2):
         TrajectoryPoint.__init__(self, [0, 0, 0, 0, 0])
         self.p1 = p1
         self.p2 = p2
         self.traj_plt_p1 = traj_plt_p1
         self.traj_plt_p2 = traj_plt_p2
-        self.lat = np.mean([p1.lat, p2.lat])
-        self.lon = np.mean([p1.lon, p2.lon])
-        self.alt = np.mean([p1.alt, p2.alt])
-        self.t = np.mean([p1.t, p2.t])
+        self.lat = (p1.lat + p2.lat) / 2
+        self.lon = (p1.lon + p2.lon) / 2
+        self.alt = (p1.alt + p2.alt) / 2
+        self.t = (p1.t + p2.t) / 2
         self.__dist_apart = None
 
     def dist_apart(self):
         if self.__dist_apart is None:
-            # convert decimal degrees to radians
-            lon1, lat1, lon2, lat2 = map(radians, [self.p1.lon, self.p1.lat, self.p2.lon, self.p2.lat])
-            # haversine formula
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
-            a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-            c = 2 * asin(sqrt(a))
-            # Radius of earth in kilometers is 6371
-            km = 6371 * c
-            self.__dist_apart = km * 1000
+            self.__dist_apart = float(haversine(self.p1.lat, self.p1.lon, self.p2.lat, self.p2.lon))
         return self.__dist_apart
 
     def tuplize(self):
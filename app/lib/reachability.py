@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class TemporalReachability:
+    """
+    Time-respecting reachability over a contact list: which users could have been reached from a
+    source user, starting at some time, through chains of contacts that happen one after another.
+
+    A contact between `uid1` (seen at `t1`) and `uid2` (seen at `t2`) happens at `max(t1, t2)`,
+    once both users were there, and works both ways. Contacts are sorted by time once; each query
+    is then a single pass over the contacts from its start time on. Contacts at the same time chain
+    in list order. Results are cached per `(source, start)`.
+    """
+    def __init__(self, uid1, uid2, t1, t2):
+        uid1, uid2 = np.asarray(uid1).astype(str), np.asarray(uid2).astype(str)
+        t = np.maximum(np.asarray(t1, dtype=float), np.asarray(t2, dtype=float))
+        self.users, inverse = np.unique(np.concatenate((uid1, uid2)), return_inverse=True)
+        order = np.argsort(t, kind='stable')
+        self.t = t[order]
+        self.node1 = inverse[:len(uid1)][order]
+        self.node2 = inverse[len(uid1):][order]
+        self.__index = {uid: k for k, uid in enumerate(self.users.tolist())}
+        self.__arrivals = {}
+        self.__reached = {}
+
+    @classmethod
+    def from_columns(cls, contacts):
+        """
+        From contact columns with `uid1`, `uid2`, `t1` and `t2` keys, like the `contact_points`
+        `ContactTable` of `GraphContactPointsOp` or the `contacts` of `GridJoinContactsOp`.
+        """
+        return cls(contacts['uid1'], contacts['uid2'], contacts['t1'], contacts['t2'])
+
+    def arrival_times(self, source, start=-np.inf):
+        """
+        Earliest time every user reachable from `source` (from time `start` on) is reached, as a
+        `{uid: time}` dict. The source itself is reached at `start`.
+        """
+        key = (str(source), float(start))
+        if key not in self.__arrivals:
+            arrival = {str(source): float(start)}
+            k = self.__index.get(str(source))
+            if k is not None:
+                reached = [np.inf] * len(self.users)
+                reached[k] = float(start)
+                first = int(np.searchsorted(self.t, start, side='left'))
+                for n1, n2, t in zip(self.node1[first:].tolist(), self.node2[first:].tolist(), self.t[first:].tolist()):
+                    if reached[n1] <= t < reached[n2]:
+                        reached[n2] = t
+                    elif reached[n2] <= t < reached[n1]:
+                        reached[n1] = t
+                arrival = {uid: time for uid, time in zip(self.users.tolist(), reached) if time < np.inf}
+            self.__arrivals[key] = arrival
+            self.__reached[key] = frozenset(arrival)
+        return self.__arrivals[key]
+
+    def reachable(self, source, start=-np.inf):
+        """
+        Set of users reachable from `source` from time `start` on (including the source).
+        """
+        key = (str(source), float(start))
+        if key not in self.__reached:
+            self.reachable_from([source], start)
+        return self.__reached[key]
+
+    def reachable_from(self, sources, start=-np.inf):
+        """
+        Reachable sets of many sources in one pass, as a `{source: set}` dict. `start` is a single
+        start time or one per source.
+
+        Every user carries a bitset of the sources that reached it; a contact merges the bitsets of
+        its two users, and a source's bit is only set once the pass gets to its start time.
+        """
+        sources = [str(source) for source in sources]
+        starts = np.broadcast_to(np.asarray(start, dtype=float), (len(sources),))
+        keys = [(source, float(s)) for source, s in zip(sources, starts)]
+        todo = [k for k in dict.fromkeys(keys) if k not in self.__reached and k[0] in self.__index]
+        for key in keys:
+            if key[0] not in self.__index:
+                self.__reached[key] = frozenset([key[0]])
+
+        if todo:
+            todo.sort(key=lambda k: k[1])
+            bits = [0] * len(self.users)
+            first = int(np.searchsorted(self.t, todo[0][1], side='left'))
+            pending = 0
+            for n1, n2, t in zip(self.node1[first:].tolist(), self.node2[first:].tolist(), self.t[first:].tolist()):
+                while pending < len(todo) and todo[pending][1] <= t:
+                    bits[self.__index[todo[pending][0]]] |= 1 << pending
+                    pending += 1
+                merged = bits[n1] | bits[n2]
+                bits[n1] = bits[n2] = merged
+            while pending < len(todo):
+                bits[self.__index[todo[pending][0]]] |= 1 << pending
+                pending += 1
+
+            members = [[] for _ in todo]
+            for node, mask in enumerate(bits):
+                while mask:
+                    low = mask & -mask
+                    members[low.bit_length() - 1].append(str(self.users[node]))
+                    mask ^= low
+            for key, reached in zip(todo, members):
+                self.__reached[key] = frozenset(reached)
+
+        return {source: set(self.__reached[key]) for source, key in zip(sources, keys)}
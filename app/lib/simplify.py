@@ -0,0 +1,81 @@
+import numpy as np
+
+from app.lib.geodesy import EARTH_RADIUS_METERS, haversine
+from app.lib.points import ole_days_to_unix
+from app.lib.trajectory_store import UserTrajectories
+
+# Share of `(ds, dt)` a simplified point may be moved by, in space and in time.
+TOLERANCE_FRACTION = 0.25
+
+
+def contact_tolerance(ds, dt, fraction=TOLERANCE_FRACTION):
+    """
+    The `(meters, seconds)` error bound of a simplification meant for contact detection at
+    `(ds, dt)`.
+    """
+    return ds * fraction, dt * fraction
+
+
+def inflate_delta(delta, tolerance):
+    """
+    The `(ds, dt)` to detect contacts at on simplified trajectories so none of the contacts at
+    `delta` between the original points is lost.
+
+    Every dropped point lies within `tolerance` of the point kept for it, so two original points
+    within `(ds, dt)` have kept points within `(ds + 2 * meters, dt + 2 * seconds)`. The inflated
+    delta may find pairs the original points never had; those are false positives only, and no
+    user pair in contact is ever dropped.
+    """
+    ds, dt = delta
+    meters, seconds = tolerance
+    return ds + 2 * meters, dt + 2 * seconds
+
+
+def simplify_user(user, tolerance):
+    """
+    Time-bucketed resampling of a `UserTrajectories`: every trajectory is cut into `seconds` long
+    time buckets, and the points of a bucket are clustered around leaders, its earliest points,
+    so that every point is within `meters` (haversine) of its leader. Only the leaders are kept,
+    so every dropped point is within `tolerance` of a kept point of the same trajectory.
+    Trajectory order and `plts` are kept; only `offsets` and the columns shrink.
+    """
+    meters, seconds = tolerance
+    if len(user) == 0 or meters <= 0 or seconds <= 0:
+        return user
+    lat, lon = np.asarray(user.lat), np.asarray(user.lon)
+    t = ole_days_to_unix(user.days)
+    counts = np.diff(user.offsets)
+    traj = np.repeat(np.arange(len(counts)), counts)
+    first = np.repeat(np.asarray(user.offsets[:-1]), counts)
+
+    # Clusters start out as grid cells `2 * meters` wide (equirectangular, about the user's mean
+    # latitude); the exact distance test below is what bounds the error.
+    side = 2. * meters
+    scale = np.radians(1.) * EARTH_RADIUS_METERS
+    keys = (np.floor(lat * scale / side).astype(np.int64),
+            np.floor(lon * scale * np.cos(np.radians(np.mean(lat))) / side).astype(np.int64),
+            np.floor((t - t[first]) / seconds).astype(np.int64),
+            traj)
+    order = np.lexsort(keys)
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = np.any([key[order][1:] != key[order][:-1] for key in keys], axis=0)
+    group = np.empty(len(order), dtype=np.int64)
+    group[order] = np.cumsum(new_group) - 1
+
+    # Points too far from their cluster's leader split off into a new cluster of their own, led
+    # by the earliest of them, until every point is close enough to its leader.
+    while True:
+        order = np.argsort(group, kind='stable')
+        starts = np.flatnonzero(np.concatenate(([True], group[order][1:] != group[order][:-1])))
+        leader = np.empty(len(order), dtype=np.int64)
+        leader[order] = np.repeat(order[starts], np.diff(np.append(starts, len(order))))
+        far = haversine(lat, lon, lat[leader], lon[leader]) > meters
+        if not far.any():
+            break
+        group[far] += group.max() + 1
+    keep = np.flatnonzero(leader == np.arange(len(leader)))
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(traj[keep], minlength=len(counts)))
+    columns = {c: np.asarray(getattr(user, c))[keep] for c in ('lat', 'lon', 'alt', 'days')}
+    return UserTrajectories(user.uid, user.plts, offsets, columns)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from app.lib.geodesy import EARTH_RADIUS_METERS
+from app.lib.trajectory_store import TrajectoryStore, UserTrajectories
+
+PLT_HEADER = 'Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n'
+
+
+class SyntheticGeolife:
+    """
+    Deterministic synthetic trajectories shaped like the Geolife dataset.
+
+    Every user has `trajectories` walks of `points` fixes taken every `interval` seconds. Walks start
+    near one of `clusters` hot spots (shared by all users, within `spread` meters of `origin`, so
+    users meet there) on a random day of `days`, and move at about `speed` m/s. The same
+    parameters always generate the same points; each user is drawn from its own seeded stream, so
+    users don't depend on each other.
+    """
+    def __init__(self, users=10, trajectories=5, points=500, clusters=3, seed=0, origin=(39.98, 116.31),
+                 spread=10000., cluster_radius=500., speed=1.5, interval=5., start_days=39744., days=7):
+        self.users = users
+        self.trajectories = trajectories
+        self.points = points
+        self.clusters = clusters
+        self.seed = seed
+        self.origin = tuple(origin)
+        self.spread = spread
+        self.cluster_radius = cluster_radius
+        self.speed = speed
+        self.interval = interval
+        self.start_days = start_days
+        self.days = days
+        rng = np.random.RandomState(seed)
+        self.cluster_offsets = rng.uniform(-spread, spread, (clusters, 2))
+
+    def uids(self):
+        return ['{:03d}'.format(k) for k in range(self.users)]
+
+    def user_trajectories(self, uid):
+        """
+        Returns the trajectories of `uid` as `(points, 4)` arrays of lat, lon, alt, days.
+        """
+        rng = np.random.RandomState([self.seed, int(uid)])
+        trajectories = []
+        for _ in range(self.trajectories):
+            center = self.cluster_offsets[rng.randint(len(self.cluster_offsets))]
+            start = center + rng.normal(0, self.cluster_radius, 2)
+            heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.3, self.points))
+            steps = self.speed * self.interval * np.column_stack((np.cos(heading), np.sin(heading)))
+            xy = start + np.cumsum(steps, axis=0) - steps[0]
+            lat, lon = self.lat_lon(xy[:, 0], xy[:, 1])
+            alt = 150 + np.cumsum(rng.normal(0, 1, self.points))
+            t0 = rng.randint(self.days) + rng.uniform(6, 20) / 24
+            days = self.start_days + t0 + np.arange(self.points) * self.interval / 86400
+            trajectories.append(np.column_stack((lat, lon, alt, days)))
+        trajectories.sort(key=lambda rows: rows[0, 3])
+        return trajectories
+
+    def lat_lon(self, x, y):
+        """
+        Degrees of east/north offsets in meters from `origin`.
+        """
+        lat = self.origin[0] + np.degrees(y / EARTH_RADIUS_METERS)
+        lon = self.origin[1] + np.degrees(x / (EARTH_RADIUS_METERS * np.cos(np.radians(self.origin[0]))))
+        return lat, lon
+
+    def write(self, data_dir):
+        """
+        Writes the dataset as a Geolife `Data` tree (`<data_dir>/<uid>/Trajectory/<start>.plt`).
+        """
+        for uid in self.uids():
+            trajectory_dir = os.path.join(data_dir, uid, 'Trajectory')
+            os.makedirs(trajectory_dir, exist_ok=True)
+            trajectories = self.user_trajectories(uid)
+            for rows, name in zip(trajectories, plt_names(trajectories)):
+                stamps = plt_timestamps(rows[:, 3])
+                with open(os.path.join(trajectory_dir, name), 'w') as f:
+                    f.write(PLT_HEADER)
+                    for (lat, lon, alt, days), stamp in zip(rows.tolist(), stamps):
+                        f.write('{:.6f},{:.6f},0,{:.0f},{!r},{},{}\n'.format(lat, lon, alt, days, stamp[:10], stamp[11:]))
+        return data_dir
+
+    def store(self):
+        """
+        In-memory stand-in for a `TrajectoryStore` of the dataset, for `GeolifeData(store=...)`.
+        """
+        return SyntheticStore(self)
+
+    def point_count(self):
+        return self.users * self.trajectories * self.points
+
+    def params(self):
+        """
+        The generation parameters; equal parameters generate equal datasets.
+        """
+        return {'users': self.users, 'trajectories': self.trajectories, 'points': self.points,
+                'clusters': self.clusters, 'seed': self.seed, 'origin': list(self.origin),
+                'spread': self.spread, 'cluster_radius': self.cluster_radius, 'speed': self.speed,
+                'interval': self.interval, 'start_days': self.start_days, 'days': self.days}
+
+
+class SyntheticStore:
+    """
+    Serves the users of a `SyntheticGeolife` as `UserTrajectories` generated in memory, under the
+    PLT paths `#write` would give them, so no files are written or parsed.
+    """
+    def __init__(self, synthetic, data_dir='synthetic'):
+        self.synthetic = synthetic
+        self.data_dir = data_dir
+        self.__users = {}
+
+    def users(self):
+        return np.array(self.synthetic.uids())
+
+    def plts(self, uid):
+        return self.user(uid).plts
+
+    def user(self, uid):
+        uid = '{}'.format(uid)
+        user = self.__users.get(uid, None)
+        if user is None:
+            trajectories = self.synthetic.user_trajectories(uid)
+            plts = [os.path.join(self.data_dir, uid, 'Trajectory', name) for name in plt_names(trajectories)]
+            offsets = np.zeros(len(trajectories) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(rows) for rows in trajectories])
+            data = np.concatenate(trajectories) if trajectories else np.zeros((0, len(TrajectoryStore.COLUMNS)))
+            columns = {c: np.ascontiguousarray(data[:, k]) for k, c in enumerate(TrajectoryStore.COLUMNS)}
+            user = UserTrajectories(uid, plts, offsets, columns)
+            self.__users[uid] = user
+        return user
+
+    def ingest(self, users=None):
+        if users is None:
+            users = self.users()
+        return [self.user(uid) for uid in users]
+
+    def fingerprint(self, users=None):
+        return hashlib.sha1(json.dumps(self.synthetic.params(), sort_keys=True).encode('utf-8')).hexdigest()
+
+    def opener(self):
+        """
+        `(factory, args)` regenerating the same store in another process (see `data_pool`).
+        """
+        return open_synthetic_store, (self.synthetic.params(), self.data_dir)
+
+    def source_stat(self, trajectory_plt):
+        """
+        Stand-in for `TrajectoryStore.source_stat`: generated trajectories never change, so their
+        name and point count identify them.
+        """
+        uid = os.path.basename(os.path.dirname(os.path.dirname(trajectory_plt)))
+        user = self.user(uid)
+        return [os.path.basename(trajectory_plt), 0, int(user.summary['count'][user.trajectory_index(trajectory_plt)])]
+
+    def points(self, trajectory_plt):
+        uid = os.path.basename(os.path.dirname(os.path.dirname(trajectory_plt)))
+        user = self.user(uid)
+        return user.points(user.trajectory_index(trajectory_plt))
+
+
+def open_synthetic_store(params, data_dir='synthetic'):
+    return SyntheticStore(SyntheticGeolife(**params), data_dir)
+
+
+def plt_names(trajectories):
+    """
+    Geolife file names (`YYYYMMDDHHMMSS.plt`, by start time) of a user's trajectories; a start
+    second already taken is bumped to the next free one.
+    """
+    names, taken = [], set()
+    for rows in trajectories:
+        second = int(np.round((rows[0, 3] - 25569) * 86400))
+        while second in taken:
+            second += 1
+        taken.add(second)
+        stamp = plt_timestamps([second / 86400. + 25569])[0]
+        names.append('{}.plt'.format(stamp.replace('-', '').replace('T', '').replace(':', '')))
+    return names
+
+
+def plt_timestamps(days):
+    """
+    ISO `YYYY-MM-DDTHH:MM:SS` timestamps of OLE Automation dates.
+    """
+    seconds = np.round((np.asarray(days) - 25569) * 86400).astype(np.int64)
+    return np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s').tolist()
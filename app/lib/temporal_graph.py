@@ -0,0 +1,123 @@
+import numpy as np
+
+from app.lib.contact_graph import ContactGraph
+from app.lib.ops.tiles import tile_contacts, tile_delta
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+class TemporalContactGraph:
+    """
+    Contact graph resolved in time: the contacts are bucketed into windows of `window` seconds
+    (by Unix time) and aggregated per window and user pair once, into columns sorted by window.
+
+    Any window's graph (`#snapshot`), the graph of a range of windows (`#between`) and per-window
+    metrics (`#metrics`) are then sliced out of those columns instead of being recomputed from the
+    contacts. Edge statistics and weights follow `ContactGraph`, except that `time_diff` is that of
+    each pair's latest contact.
+    """
+    def __init__(self, uid1, uid2, t, distance=None, time_diff=None, window=DAY, weight='count_weight', dt=None):
+        assert(weight in ['dist_weight', 'count_weight'])
+        self.window = window
+        self.weight = weight
+        self.dt = dt
+        uid1, uid2 = np.asarray(uid1).astype(str), np.asarray(uid2).astype(str)
+        t = np.asarray(t, dtype=float)
+        distance = np.zeros(len(t)) if distance is None else np.asarray(distance, dtype=float)
+        time_diff = np.zeros(len(t)) if time_diff is None else np.asarray(time_diff, dtype=float)
+
+        self.nodes, inverse = np.unique(np.concatenate((uid1, uid2)), return_inverse=True)
+        node1, node2 = inverse[:len(uid1)], inverse[len(uid1):]
+        row, col = np.minimum(node1, node2), np.maximum(node1, node2)
+        bucket = np.floor(t / window).astype(np.int64)
+        # Contacts of a window and pair are grouped in time order, so the last one comes last.
+        order = np.lexsort((t, col, row, bucket))
+        bucket, row, col = bucket[order], row[order], col[order]
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (bucket[1:] != bucket[:-1]) | (row[1:] != row[:-1]) | (col[1:] != col[:-1])
+        starts = np.flatnonzero(new_group)
+        ends = np.append(starts[1:], len(order)).astype(np.int64)
+
+        self.bucket = bucket[starts]
+        self.row = row[starts]
+        self.col = col[starts]
+        self.count = ends - starts
+        self.min_distance = np.minimum.reduceat(distance[order], starts) if len(starts) else np.zeros(0)
+        self.max_distance = np.maximum.reduceat(distance[order], starts) if len(starts) else np.zeros(0)
+        self.time_diff = time_diff[order][ends - 1]
+        self.buckets, first = np.unique(self.bucket, return_index=True)
+        self.offsets = np.append(first, len(self.bucket)).astype(np.int64)
+        self.__metrics = None
+
+    @classmethod
+    def from_tiles(cls, tiles, window=DAY, weight='count_weight'):
+        """
+        Temporal graph of the users sharing a tile, each pair timed at the mean `t` of its two rows.
+        """
+        contacts = tile_contacts(tiles)
+        dt = tile_delta(tiles)[1]
+        return cls(contacts['uid1'], contacts['uid2'], (contacts['t1'] + contacts['t2']) / 2, contacts['dist_apart'],
+                   contacts['time_diff'], window, weight, dt)
+
+    def windows(self):
+        """
+        Start time (Unix seconds) of every window holding at least one contact.
+        """
+        return self.buckets * self.window
+
+    def snapshot(self, t):
+        """
+        `ContactGraph` of the window containing time `t`.
+        """
+        k = int(np.searchsorted(self.buckets, int(np.floor(t / self.window))))
+        if k == len(self.buckets) or self.buckets[k] != int(np.floor(t / self.window)):
+            return self.__graph(slice(0, 0))
+        return self.__graph(slice(self.offsets[k], self.offsets[k + 1]))
+
+    def between(self, t0, t1):
+        """
+        `ContactGraph` of every window overlapping `[t0, t1)`; the range is widened to whole windows.
+        """
+        lo = np.searchsorted(self.buckets, int(np.floor(t0 / self.window)), side='left')
+        hi = np.searchsorted(self.buckets, int(np.ceil(t1 / self.window)), side='left')
+        edges = slice(self.offsets[lo], self.offsets[hi])
+        row, col = self.row[edges], self.col[edges]
+        if len(row) == 0:
+            return self.__graph(edges)
+        # The slice is sorted by window; a stable sort by pair keeps each pair's windows in order.
+        keys = row * len(self.nodes) + col
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        ends = np.append(starts[1:], len(keys))
+        return ContactGraph(
+            self.nodes[row[order][starts]],
+            self.nodes[col[order][starts]],
+            np.add.reduceat(self.count[edges][order], starts),
+            np.minimum.reduceat(self.min_distance[edges][order], starts),
+            np.maximum.reduceat(self.max_distance[edges][order], starts),
+            self.time_diff[edges][order][ends - 1],
+            self.weight,
+            self.dt,
+        )
+
+    def metrics(self):
+        """
+        Per window with contacts: its start time, contact count, largest component and average
+        degree, as columns. Computed once and kept.
+        """
+        if self.__metrics is None:
+            graphs = [self.__graph(slice(lo, hi)) for lo, hi in zip(self.offsets[:-1], self.offsets[1:])]
+            self.__metrics = {
+                'window': self.windows(),
+                'contacts': np.add.reduceat(self.count, self.offsets[:-1]) if len(self.count) else np.zeros(0, dtype=np.int64),
+                'largest_component': np.array([g.largest_component() for g in graphs], dtype=np.int64),
+                'average_degree': np.array([g.average_degree() for g in graphs], dtype=float),
+            }
+        return self.__metrics
+
+    def __graph(self, edges):
+        return ContactGraph(self.nodes[self.row[edges]], self.nodes[self.col[edges]], self.count[edges],
+                            self.min_distance[edges], self.max_distance[edges], self.time_diff[edges],
+                            self.weight, self.dt)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# One tile row: the grid cell, the user (a code into the partitions' `uids`) and its point.
+TILE_ROW_DTYPE = np.dtype([
+    ('ix', '<i8'),
+    ('iy', '<i8'),
+    ('it', '<i8'),
+    ('uid', '<i4'),
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('t', '<f8'),
+])
+
+# Bytes of memory per buffered or sorted row: the row itself, its copy while being split or
+# reordered and the sort index.
+ROW_MEMORY = 3 * TILE_ROW_DTYPE.itemsize + 8
+
+
+class TilePartitions:
+    """
+    Tile rows spilled to disk in hash partitions, for tilings that don't fit in memory.
+
+    Every partition is a `<k>.bin` file of `TILE_ROW_DTYPE` rows sorted by cell, holding whole
+    tiles (a cell always hashes to the same partition); rows of a tile keep the order they were
+    written in. `meta.json` records the tiling (`ds`, `dt`, `relative_null_point`), the uids the
+    rows refer to, the row and tile count and digest of each partition and a digest of all of it
+    (the `#fingerprint`). Partitions are memory-mapped on read, one at a time; files whose size or
+    digest no longer match the metadata are refused with a `ValueError`.
+    """
+    META = 'meta.json'
+
+    def __init__(self, path, ds, dt, relative_null_point, uids, rows, tiles, max_tile_size, digests, digest=None):
+        self.path = path
+        self.ds = ds
+        self.dt = dt
+        self.relative_null_point = tuple(relative_null_point)
+        self.uids = np.array(uids, dtype=str)
+        self.rows = list(rows)
+        self.tiles = list(tiles)
+        self.max_tile_size = max_tile_size
+        self.digests = list(digests)
+        self.digest = digest
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, cls.META)) as f:
+            meta = json.load(f)
+        partitions = cls(path, meta['ds'], meta['dt'], meta['relative_null_point'], meta['uids'], meta['rows'],
+                         meta['tiles'], meta['max_tile_size'], meta['digests'], meta['digest'])
+        for k in range(partitions.partition_count()):
+            partitions.check_size(k)
+        return partitions
+
+    def fingerprint(self):
+        return self.digest
+
+    def __len__(self):
+        """
+        The number of tiles.
+        """
+        return int(sum(self.tiles))
+
+    def partition_count(self):
+        return len(self.rows)
+
+    def partition(self, k):
+        """
+        Returns `(rows, starts, sizes)` of partition `k`: its memory-mapped rows and the first row
+        and row count of each of its tiles.
+        """
+        self.check_size(k)
+        if self.rows[k] == 0:
+            return np.zeros(0, dtype=TILE_ROW_DTYPE), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        rows = np.memmap(partition_path(self.path, k), dtype=TILE_ROW_DTYPE, mode='r', shape=(self.rows[k],))
+        if hashlib.sha1(rows).hexdigest() != self.digests[k]:
+            raise ValueError('Partition {} of {} no longer matches its metadata'.format(k, self.path))
+        starts, sizes = tile_bounds(rows)
+        return rows, starts, sizes
+
+    def check_size(self, k):
+        path = partition_path(self.path, k)
+        if not os.path.isfile(path) or os.path.getsize(path) != self.rows[k] * TILE_ROW_DTYPE.itemsize:
+            raise ValueError('Partition {} of {} no longer matches its metadata'.format(k, self.path))
+
+    def remove(self):
+        """
+        Deletes the partitions from disk.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TilePartitionWriter:
+    """
+    Spills tile rows into `partitions` hash partitions under `path`, which must not hold
+    partitions already (those may still be in use). Rows are buffered in memory and appended to
+    their partition files whenever more than `buffer_rows` are pending; `#close` sorts every
+    partition by cell, one at a time, and returns the `TilePartitions`.
+    """
+    def __init__(self, path, partitions, ds, dt, relative_null_point, uids, buffer_rows=1 << 20):
+        self.path = path
+        self.partitions = partitions
+        self.ds = ds
+        self.dt = dt
+        self.relative_null_point = relative_null_point
+        self.uids = [str(uid) for uid in uids]
+        self.buffer_rows = buffer_rows
+        self.__pending = []
+        self.__pending_rows = 0
+        os.makedirs(path, exist_ok=True)
+        if any(name == TilePartitions.META or name.endswith('.bin') for name in os.listdir(path)):
+            raise ValueError('{} already holds tile partitions'.format(path))
+        # The metadata is written last, so partial partitions never open.
+        for k in range(partitions):
+            open(partition_path(path, k), 'wb').close()
+
+    def write(self, rows):
+        """
+        Appends `TILE_ROW_DTYPE` rows.
+        """
+        self.__pending.append(rows)
+        self.__pending_rows += len(rows)
+        if self.__pending_rows > self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.__pending:
+            return
+        rows = np.concatenate(self.__pending)
+        self.__pending, self.__pending_rows = [], 0
+        partition = cell_partition(rows['ix'], rows['iy'], rows['it'], self.partitions)
+        order = np.argsort(partition, kind='stable')
+        bounds = np.searchsorted(partition[order], np.arange(self.partitions + 1))
+        for k in range(self.partitions):
+            if bounds[k + 1] > bounds[k]:
+                with open(partition_path(self.path, k), 'ab') as f:
+                    rows[order[bounds[k]:bounds[k + 1]]].tofile(f)
+
+    def close(self):
+        self.flush()
+        counts, tiles, digests, max_tile_size = [], [], [], 0
+        for k in range(self.partitions):
+            path = partition_path(self.path, k)
+            rows = np.fromfile(path, dtype=TILE_ROW_DTYPE)
+            # A stable sort keeps the rows of each tile in the order they were written.
+            rows = rows[np.lexsort((rows['ix'], rows['iy'], rows['it']), axis=0)] if len(rows) else rows
+            with open(path + '.tmp', 'wb') as f:
+                rows.tofile(f)
+            os.replace(path + '.tmp', path)
+            digests.append(hashlib.sha1(rows.tobytes()).hexdigest())
+            sizes = tile_bounds(rows)[1]
+            counts.append(int(len(rows)))
+            tiles.append(int(len(sizes)))
+            if len(sizes):
+                max_tile_size = max(max_tile_size, int(sizes.max()))
+            del rows
+
+        header = [self.ds, self.dt, list(self.relative_null_point), self.uids, digests]
+        meta = {
+            'ds': self.ds,
+            'dt': self.dt,
+            'relative_null_point': list(self.relative_null_point),
+            'uids': self.uids,
+            'rows': counts,
+            'tiles': tiles,
+            'max_tile_size': max_tile_size,
+            'digests': digests,
+            'digest': hashlib.sha1(json.dumps(header).encode('utf-8')).hexdigest(),
+        }
+        meta_path = os.path.join(self.path, TilePartitions.META)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        return TilePartitions.open(self.path)
+
+
+def partition_path(path, k):
+    return os.path.join(path, '{}.bin'.format(k))
+
+
+def cell_partition(ix, iy, it, partitions):
+    """
+    Hash partition of every `(ix, iy, it)` cell.
+    """
+    with np.errstate(over='ignore'):
+        h = (np.asarray(ix, dtype=np.int64).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             ^ np.asarray(iy, dtype=np.int64).astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+             ^ np.asarray(it, dtype=np.int64).astype(np.uint64) * np.uint64(0x165667B19E3779F9))
+        h ^= h >> np.uint64(29)
+    return (h % np.uint64(partitions)).astype(np.int64)
+
+
+def tile_bounds(rows):
+    """
+    First row and row count of every tile of cell-sorted rows.
+    """
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    ix, iy, it = (np.asarray(rows[c]) for c in ('ix', 'iy', 'it'))
+    new_tile = np.ones(len(rows), dtype=bool)
+    new_tile[1:] = (ix[1:] != ix[:-1]) | (iy[1:] != iy[:-1]) | (it[1:] != it[:-1])
+    starts = np.flatnonzero(new_tile)
+    return starts, np.diff(np.append(starts, len(rows)))
@@ -0,0 +1,265 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from app.lib.points import ole_days_to_unix
+
+# Per-trajectory summary written next to the columns: point count, time span (Unix seconds) and
+# lat/lon bounding box. Empty trajectories get an empty (inverted, NaN) span and box.
+SUMMARY_DTYPE = np.dtype([
+    ('count', np.int64),
+    ('t_start', np.float64),
+    ('t_end', np.float64),
+    ('lat_min', np.float64),
+    ('lat_max', np.float64),
+    ('lon_min', np.float64),
+    ('lon_max', np.float64),
+])
+
+
+class UserTrajectories:
+    """
+    Columnar view over every trajectory of a single user.
+
+    Each column (`lat`, `lon`, `alt`, `days`) is a float64 array holding the points of all
+    trajectories back to back. Points of trajectory `i` (read from `plts[i]`) live in the
+    half-open range `[offsets[i], offsets[i + 1])`. `summary` holds a `SUMMARY_DTYPE` row per
+    trajectory.
+    """
+    def __init__(self, uid, plts, offsets, columns, summary=None):
+        self.uid = uid
+        self.plts = list(plts)
+        self.offsets = offsets
+        self.summary = summary if summary is not None else summarize(offsets, columns)
+        self.lat = columns['lat']
+        self.lon = columns['lon']
+        self.alt = columns['alt']
+        self.days = columns['days']
+        self.__plt_index = {plt: i for i, plt in enumerate(self.plts)}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def trajectory_count(self):
+        return len(self.plts)
+
+    def trajectory_index(self, trajectory_plt):
+        return self.__plt_index.get(trajectory_plt, None)
+
+    def trajectory(self, i):
+        """
+        Returns the slice of the columns covered by trajectory `i`.
+        """
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def points(self, i):
+        """
+        Returns trajectory `i` in the row layout of the raw PLT file (lat, lon, 0, alt, days).
+        """
+        s = self.trajectory(i)
+        lat = self.lat[s]
+        return np.column_stack((lat, self.lon[s], np.zeros(len(lat)), self.alt[s], self.days[s]))
+
+
+class TrajectoryStore:
+    """
+    Binary columnar store of the Geolife PLT files.
+
+    Every user's trajectories are parsed once and written to `store_dir/<uid>/` as one `.npy`
+    file per column plus a trajectory offset index and summary (see `SUMMARY_DTYPE`). Columns are
+    memory-mapped on load. A user is re-ingested only when one of its PLT files is added, removed
+    or changes mtime or size; unchanged trajectories are copied over from the previous build
+    instead of being parsed again.
+
+    Without a `store_dir`, every `data_dir` gets its own directory under `app/data/store` (see
+    `default_store_dir`). The manifest also records the `data_dir` a user was built from, so a store
+    directory shared by two datasets is rebuilt rather than serving the other one's points.
+    """
+    COLUMNS = ('lat', 'lon', 'alt', 'days')
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, data_dir='app/data/geolife/Data', store_dir=None):
+        self.data_dir = data_dir
+        self.store_dir = store_dir if store_dir is not None else default_store_dir(data_dir)
+        self.__users = {}
+
+    def users(self):
+        return np.sort(np.array([
+            uid for uid in os.listdir(self.data_dir) if re.findall(r'\d{3}', uid)
+        ]))
+
+    def plts(self, uid):
+        return sorted(glob.glob(os.path.join(self.data_dir, '{}'.format(uid), 'Trajectory', '*.plt')))
+
+    def user(self, uid):
+        uid = '{}'.format(uid)
+        user = self.__users.get(uid, None)
+        if user is None:
+            user = self.__open(uid)
+            self.__users[uid] = user
+        return user
+
+    def ingest(self, users=None):
+        """
+        Builds (or refreshes) the store for the given users, defaulting to every user in `data_dir`.
+        """
+        if users is None:
+            users = self.users()
+        return [self.user(uid) for uid in users]
+
+    def fingerprint(self, users=None):
+        """
+        Digest of the name, mtime and size of every PLT file of the given users (all by default).
+        It changes whenever a user would be re-ingested.
+        """
+        if users is None:
+            users = self.users()
+        digest = hashlib.sha1()
+        for uid in users:
+            for plt in self.plts(uid):
+                digest.update(json.dumps(['{}'.format(uid)] + self.source_stat(plt)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def points(self, trajectory_plt):
+        """
+        Returns the points of a single PLT file in the raw row layout (lat, lon, 0, alt, days).
+        """
+        uid = os.path.basename(os.path.dirname(os.path.dirname(trajectory_plt)))
+        user = self.user(uid)
+        i = user.trajectory_index(trajectory_plt)
+        if i is None:
+            rows = self.parse_plt(trajectory_plt)
+            return np.column_stack((rows[:, 0], rows[:, 1], np.zeros(len(rows)), rows[:, 2], rows[:, 3]))
+        return user.points(i)
+
+    @staticmethod
+    def parse_plt(trajectory_plt):
+        """
+        Parses a PLT file into an (n, 4) array of lat, lon, alt, days.
+        """
+        rows = np.loadtxt(trajectory_plt, delimiter=',', skiprows=6, usecols=(0, 1, 3, 4), ndmin=2)
+        return rows.reshape(-1, len(TrajectoryStore.COLUMNS))
+
+    def opener(self):
+        """
+        `(factory, args)` reopening this store in another process (see `data_pool`).
+        """
+        return TrajectoryStore, (self.data_dir, self.store_dir)
+
+    @staticmethod
+    def source_stat(trajectory_plt):
+        st = os.stat(trajectory_plt)
+        return [os.path.basename(trajectory_plt), st.st_mtime_ns, st.st_size]
+
+    def __open(self, uid):
+        plts = self.plts(uid)
+        if len(plts) == 0:
+            return UserTrajectories(uid, [], np.zeros(1, dtype=np.int64),
+                                    {c: np.zeros(0) for c in self.COLUMNS})
+
+        user_dir = os.path.join(self.store_dir, uid)
+        sources = [self.source_stat(plt) for plt in plts]
+        manifest = self.__read_manifest(user_dir)
+        if manifest is not None and manifest.get('data_dir') != os.path.abspath(self.data_dir):
+            # Built from another dataset: nothing in it can be reused.
+            manifest = None
+        if manifest is None or manifest['sources'] != sources:
+            self.__build(user_dir, plts, sources, manifest)
+
+        offsets = np.load(os.path.join(user_dir, 'offsets.npy'))
+        columns = {c: np.load(os.path.join(user_dir, '{}.npy'.format(c)), mmap_mode='r') for c in self.COLUMNS}
+        summary_path = os.path.join(user_dir, 'summary.npy')
+        if os.path.isfile(summary_path):
+            summary = np.load(summary_path)
+        else:
+            # Stores built before summaries existed get theirs on first open.
+            summary = summarize(offsets, columns)
+            self.__write_npy(summary_path, summary)
+        return UserTrajectories(uid, plts, offsets, columns, summary)
+
+    def __build(self, user_dir, plts, sources, manifest):
+        previous = {}
+        if manifest is not None:
+            old_offsets = np.load(os.path.join(user_dir, 'offsets.npy'))
+            old_columns = [np.load(os.path.join(user_dir, '{}.npy'.format(c)), mmap_mode='r') for c in self.COLUMNS]
+            for i, source in enumerate(manifest['sources']):
+                s = slice(int(old_offsets[i]), int(old_offsets[i + 1]))
+                previous[tuple(source)] = np.column_stack([col[s] for col in old_columns])
+
+        chunks = []
+        for plt, source in zip(plts, sources):
+            rows = previous.get(tuple(source), None)
+            chunks.append(rows if rows is not None else self.parse_plt(plt))
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in chunks])
+        data = np.concatenate(chunks) if chunks else np.zeros((0, len(self.COLUMNS)))
+        # Release the previous memory maps before their files are replaced.
+        del previous, chunks
+
+        # The manifest is removed first and written last so an interrupted build is redone on the next open.
+        manifest_path = os.path.join(user_dir, self.MANIFEST)
+        if os.path.isfile(manifest_path):
+            os.remove(manifest_path)
+        os.makedirs(user_dir, exist_ok=True)
+        self.__write_npy(os.path.join(user_dir, 'offsets.npy'), offsets)
+        columns = {}
+        for c, column in enumerate(self.COLUMNS):
+            columns[column] = np.ascontiguousarray(data[:, c])
+            self.__write_npy(os.path.join(user_dir, '{}.npy'.format(column)), columns[column])
+        self.__write_npy(os.path.join(user_dir, 'summary.npy'), summarize(offsets, columns))
+
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump({'columns': list(self.COLUMNS), 'data_dir': os.path.abspath(self.data_dir), 'sources': sources}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def __read_manifest(self, user_dir):
+        manifest_path = os.path.join(user_dir, self.MANIFEST)
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('columns') != list(self.COLUMNS):
+            return None
+        return manifest
+
+    @staticmethod
+    def __write_npy(path, array):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+
+
+def default_store_dir(data_dir, root='app/data/store'):
+    """
+    Store directory of `data_dir` under `root`, keyed on a digest of its absolute path.
+    """
+    digest = hashlib.sha1(os.path.abspath(data_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(root, digest)
+
+
+def summarize(offsets, columns):
+    """
+    Builds the `SUMMARY_DTYPE` row of every trajectory from a user's offsets and columns.
+    """
+    counts = np.diff(offsets)
+    summary = np.zeros(len(counts), dtype=SUMMARY_DTYPE)
+    summary['count'] = counts
+    summary['t_start'], summary['t_end'] = np.inf, -np.inf
+    for field in ('lat_min', 'lat_max', 'lon_min', 'lon_max'):
+        summary[field] = np.nan
+    filled = np.flatnonzero(counts)
+    if len(filled):
+        starts = offsets[filled]
+        t = ole_days_to_unix(columns['days'])
+        lat, lon = np.asarray(columns['lat']), np.asarray(columns['lon'])
+        summary['t_start'][filled] = np.minimum.reduceat(t, starts)
+        summary['t_end'][filled] = np.maximum.reduceat(t, starts)
+        summary['lat_min'][filled] = np.minimum.reduceat(lat, starts)
+        summary['lat_max'][filled] = np.maximum.reduceat(lat, starts)
+        summary['lon_min'][filled] = np.minimum.reduceat(lon, starts)
+        summary['lon_max'][filled] = np.maximum.reduceat(lon, starts)
+    return summary
@@ -0,0 +1,221 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from itertools import combinations, islice
+
+import numpy as np
+
+from app.lib import metrics
+from app.lib.datasets import GeolifeData
+from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp
+from app.lib.synthetic import SyntheticGeolife
+from app.lib.trajectory_store import TrajectoryStore
+from proj import detect_contact_points
+
+# (users, trajectories per user, points per trajectory)
+SIZES = [(5, 5, 500), (10, 5, 1000), (20, 10, 1000)]
+DELTAS = [(100, 300), (500, 600), (1000, 1200)]
+WEIGHTS = ['count_weight', 'dist_weight']
+# User pairs timed by the contacts stage; every pair of the larger sizes takes minutes.
+PAIRS = 10
+
+# Timings this close to their baseline are never reported as regressions, whatever the tolerance.
+NOISE_SECONDS = 0.01
+
+RESULT_KEY = ('stage', 'users', 'trajectories', 'points', 'ds', 'dt', 'weight')
+
+
+def run_benchmarks(sizes=SIZES, deltas=DELTAS, weights=WEIGHTS, repeat=1, seed=0, pairs=PAIRS, workdir=None):
+    """
+    Times every pipeline stage on synthetic datasets of each size and returns the results as
+    JSON-ready records (`RESULT_KEY` fields plus `seconds`, the best of `repeat` runs, `output`,
+    the number of things the stage produced, and `us_per_point`).
+
+    Stages: `load_cold` (streaming every point through `GeolifeData.stream`, parsing the PLT files
+    into a fresh `TrajectoryStore`), `load_warm` (streaming them again from a reopened store), then
+    per delta `tiles` (`GenerateTilesOp`), `graph` (`GraphContactPointsOp`, per weight) and
+    `contacts` (`detect_contact_points` over the first `pairs` user pairs, all of them with `pairs=None`).
+    Datasets and graphs are written under `workdir` (a temporary directory by default).
+    """
+    cleanup = workdir is None
+    workdir = os.path.abspath(tempfile.mkdtemp(prefix='benchmark_') if workdir is None else workdir)
+    results = []
+    try:
+        with working_directory(workdir):
+            os.makedirs('app/data/graphs', exist_ok=True)
+            for users, trajectories, points in sizes:
+                synthetic = SyntheticGeolife(users, trajectories, points, seed=seed)
+                size = {'users': users, 'trajectories': trajectories, 'points': points}
+                total = synthetic.point_count()
+                data_dir = synthetic.write(os.path.join('data', '{}x{}x{}'.format(users, trajectories, points), 'Data'))
+
+                def record(stage, seconds, output, ds=None, dt=None, weight=None):
+                    result = dict(stage=stage, ds=ds, dt=dt, weight=weight, seconds=seconds, output=output,
+                                  us_per_point=1e6 * seconds / total, **size)
+                    print('{}: {:.3f}s ({})'.format(result_label(result), seconds, output))
+                    results.append(result)
+
+                store_dir = os.path.join(os.path.dirname(data_dir), 'store')
+                stores = []
+
+                def load_cold():
+                    stores.append(os.path.join(store_dir, str(len(stores))))
+                    return load_points(data_dir, stores[-1])
+
+                seconds, loaded = best_of(repeat, load_cold)
+                record('load_cold', seconds, loaded)
+                seconds, loaded = best_of(repeat, lambda: load_points(data_dir, stores[-1]))
+                record('load_warm', seconds, loaded)
+
+                data = GeolifeData(store=TrajectoryStore(data_dir, stores[-1]))
+                uids = data.users()
+                for ds, dt in deltas:
+                    seconds, tiles = best_of(repeat, lambda: GenerateTilesOp(uids, ds, dt, data_op=data).output())
+                    record('tiles', seconds, len(tiles), ds, dt)
+                    for weight in weights:
+                        seconds, graph = best_of(repeat, lambda: GraphContactPointsOp(tiles, weight).output())
+                        record('graph', seconds, len(graph['graph'].count) if graph['graph_generated'] else 0, ds, dt, weight)
+                    seconds, found = best_of(repeat, lambda: contact_pairs(data, uids, (ds, dt), pairs))
+                    record('contacts', seconds, found, ds, dt)
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def load_points(data_dir, store_dir):
+    """
+    Streams every point of `data_dir` through a new `GeolifeData`, returning the number of points.
+    """
+    data = GeolifeData(store=TrajectoryStore(data_dir, store_dir))
+    return sum(len(chunk) for chunk in data.stream())
+
+
+def contact_pairs(data, uids, delta, pairs=None):
+    """
+    Runs `detect_contact_points` on the first `pairs` user pairs, returning the number of contacts.
+    """
+    found = 0
+    for i, j in islice(combinations(uids, 2), pairs):
+        found += len(detect_contact_points(i, j, data, delta))
+    return found
+
+
+def best_of(repeat, fn):
+    """
+    Lowest wall time of `repeat` calls of `fn` along with the result of the last call.
+    """
+    best, result = np.inf, None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Results more than `tolerance` (a fraction) slower than the matching `baseline` result, as
+    `(result, baseline seconds)` pairs. Results without a baseline are skipped.
+    """
+    previous = {result_key(result): result['seconds'] for result in baseline}
+    regressions = []
+    for result in results:
+        seconds = previous.get(result_key(result), None)
+        if seconds is not None and result['seconds'] > seconds * (1 + tolerance) and result['seconds'] - seconds > NOISE_SECONDS:
+            regressions.append((result, seconds))
+    return regressions
+
+
+def result_key(result):
+    return tuple(result[field] for field in RESULT_KEY)
+
+
+def result_label(result):
+    label = '{stage} {users}x{trajectories}x{points}'.format(**result)
+    if result['ds'] is not None:
+        label += ' ({}m, {}s)'.format(result['ds'], result['dt'])
+    if result['weight'] is not None:
+        label += ' ' + result['weight']
+    return label
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    # The graph ops write to `app/data/graphs` relative to the working directory.
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
+
+
+def parse_size(text):
+    users, trajectories, points = (int(n) for n in text.split('x'))
+    return users, trajectories, points
+
+
+def parse_delta(text):
+    ds, dt = (int(n) for n in text.split(','))
+    return ds, dt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the contact network pipeline on synthetic Geolife data.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=SIZES, help='USERSxTRAJECTORIESxPOINTS, e.g. 10x5x1000')
+    parser.add_argument('--deltas', nargs='+', type=parse_delta, default=DELTAS, help='DS,DT, e.g. 100,300')
+    parser.add_argument('--weights', nargs='+', choices=WEIGHTS, default=WEIGHTS)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairs', type=int, default=PAIRS, help='user pairs timed by the contacts stage')
+    parser.add_argument('--all-pairs', dest='pairs', action='store_const', const=None, help='time the contacts stage on every user pair')
+    parser.add_argument('--output', default='app/data/benchmarks/results.json')
+    parser.add_argument('--baseline', default=None, help='results file to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--metrics', default=None, help='also collect pipeline metrics and write them to this file')
+    args = parser.parse_args(argv)
+
+    if args.metrics is not None:
+        metrics.enable()
+    try:
+        results = run_benchmarks(args.sizes, args.deltas, args.weights, args.repeat, args.seed, args.pairs)
+    finally:
+        if args.metrics is not None:
+            metrics.metrics().dump(args.metrics)
+            metrics.disable()
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'seed': args.seed, 'repeat': args.repeat, 'pairs': args.pairs, 'results': results}, f, indent=2)
+    print('Wrote {} results to {}'.format(len(results), args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for result, seconds in regressions:
+            print('REGRESSION: {}: {:.3f}s (baseline {:.3f}s)'.format(result_label(result), result['seconds'], seconds))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
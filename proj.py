@@ -1,174 +1,117 @@
-from itertools import combinations
+from functools import partial
+from itertools import combinations, islice
 
-from app.lib.data_serializer import DataSerializer
+from app.lib import metrics
+from app.lib.contacts import user_contact_points, pair_contact_points
+from app.lib.contact_sink import ContactSink
 from app.lib.datasets import GeolifeData
 from app.lib.graph import grapher, save_results
+from app.lib.ops.grid import ContactSweepOp, GridJoinContactsOp
+from app.lib.ops.incremental import IncrementalContactsOp
 from app.lib.ops.tiles import GraphContactPointsOp, GenerateTilesOp
-from app.lib.points import TrajectoryPoint, ContactPoint
-
-
-def detect_contact_points(user_i, user_j, data, delta):
-    ds, dt = delta
-    contact_points = load_contact_points(ds, dt)
-    if contact_points is None:
-        contact_points = []
-    total_count = 0
-    for traj_plt_i in data.load_user_trajectory_plts(user_i):
-        for traj_plt_j in data.load_user_trajectory_plts(user_j):
-            pnt_i_count = 0
-            next_j_plt = False
-            for pnt_i in data.load_trajectory_plt_points(traj_plt_i):
-                if next_j_plt:
-                    break
-
-                pnt_i = TrajectoryPoint(pnt_i, user_i)
-                pnt_i_count = pnt_i_count + 1
-                pnt_j_count = 0
-                for pnt_j in data.load_trajectory_plt_points(traj_plt_j):
-                    pnt_j = TrajectoryPoint(pnt_j, user_j)
-                    pnt_j_count = pnt_j_count + 1
-                    total_count = total_count + 1
-
-                    tdelta = abs(pnt_i.t - pnt_j.t)
-                    cp = ContactPoint(pnt_i, pnt_j, traj_plt_i, traj_plt_j)
-                    if tdelta <= dt and cp.dist_apart() <= ds:
-                        print(
-                            'CONTACT:  t: {}    dist: {}    ui: {}    uj: {}    tot: {}    plt_i: {}    plt_j: {}'.format(
-                                tdelta,
-                                cp.dist_apart(),
-                                user_i,
-                                user_j,
-                                total_count,
-                                traj_plt_i,
-                                traj_plt_j))
-                        contact_points.append(cp)
-                        save_contact_points(ds, dt, contact_points)
-                    else:
-                        if pnt_j_count == 1:
-                            # The first point in user j's trajectory is not within dt seconds so we
-                            # signal to move to the next trajectory for user j.
-                            next_j_plt = True
-                            break  # Move to the next PLT for user j
-    return contact_points
-
-
-def detect_contact(user_i, user_j, data, delta):
-    ds, dt = delta
-    contacts = load_contacts(ds, dt)
-    if contacts is None:
-        contacts = []
-    total_count = 0
-    for traj_plt_i in data.load_user_trajectory_plts(user_i):
-        for traj_plt_j in data.load_user_trajectory_plts(user_j):
-            pnt_i_count = 0
-            next_j_plt = False
-            for pnt_i in data.load_trajectory_plt_points(traj_plt_i):
-                if next_j_plt:
-                    break
-
-                pnt_i = TrajectoryPoint(pnt_i, user_i)
-                pnt_i_count = pnt_i_count + 1
-                pnt_j_count = 0
-                for pnt_j in data.load_trajectory_plt_points(traj_plt_j):
-                    pnt_j = TrajectoryPoint(pnt_j, user_j)
-                    pnt_j_count = pnt_j_count + 1
-                    total_count = total_count + 1
-
-                    tdelta = abs(pnt_i.t - pnt_j.t)
-                    cp = ContactPoint(pnt_i, pnt_j, traj_plt_i, traj_plt_j)
-                    if tdelta <= dt and cp.dist_apart() <= ds:
-                        print(
-                            'CONTACT:  t: {}    dist: {}    ui: {}    uj: {}    tot: {}    plt_i: {}    plt_j: {}'.format(
-                                tdelta,
-                                cp.dist_apart(),
-                                user_i,
-                                user_j,
-                                total_count,
-                                traj_plt_i,
-                                traj_plt_j))
-                        contacts.append(cp)
-
-                        save_contacts(ds, dt, contacts)
-                        return [cp]
-                    else:
-                        if pnt_j_count == 1:
-                            # The first point in user j's trajectory is not within dt seconds so we
-                            # signal to move to the next trajectory for user j.
-                            next_j_plt = True
-                            break  # Move to the next PLT for user j
-    return []
-
-
-def save_contacts(ds, dt, contacts):
-    DataSerializer.save_data({'ds': ds, 'dt': dt, 'total': len(contacts), 'contacts': contacts},
-                             'app/data/contacts/Contacts_ds{}_dt{}.pickle'.format(ds, dt))
-
-
-def save_contact_points(ds, dt, contact_points):
-    DataSerializer.save_data({'ds': ds, 'dt': dt, 'total': len(contact_points), 'contact_points': contact_points},
-                             'app/data/contacts/ContactPoints_ds{}_dt{}.pickle'.format(ds, dt))
+from app.lib.parallel import data_pool, shard_size
+from app.lib.pipeline_graph import PipelineGraph
+from app.lib.simplify import contact_tolerance, inflate_delta
+from app.lib.temporal_graph import DAY, TemporalContactGraph
 
 
-def load_contact_points(ds, dt):
-    return DataSerializer.reload_data('app/data/contacts/ContactPoints_ds{}_dt{}.pickle'.format(ds, dt))
+def detect_contact_points(user_i, user_j, data, delta, sink=None):
+    return record_contacts(user_i, user_j, user_contact_points(user_i, user_j, data, delta), sink)
 
 
-def load_contacts(ds, dt):
-    return DataSerializer.reload_data('app/data/contacts/Contacts_ds{}_dt{}.pickle'.format(ds, dt))
+def detect_contact(user_i, user_j, data, delta, sink=None):
+    return record_contacts(user_i, user_j, islice(user_contact_points(user_i, user_j, data, delta), 1), sink)
 
 
-def contact_point_combos(data, delta):
-    combos = set()
-    users = data.users()
-    user_combos = combinations(users, 2)
-    for i, j in user_combos:
-        contact_points = detect_contact_points(i, j, data, delta)
-        for c in contact_points:
-            combos.add(c)
-    return combos
+def record_contacts(user_i, user_j, contacts, sink=None):
+    recorded = []
+    for cp in contacts:
+        recorded.append(cp)
+        if sink is not None:
+            sink.append((str(user_i), str(user_j)), cp)
+    metrics.count('contacts_recorded', len(recorded))
+    return recorded
+
+
+def contacts_path(ds, dt):
+    return 'app/data/contacts/Contacts_ds{}_dt{}.log'.format(ds, dt)
+
+
+def contact_points_path(ds, dt):
+    return 'app/data/contacts/ContactPoints_ds{}_dt{}.log'.format(ds, dt)
+
+
+def contacts_sink(ds, dt, resume=True):
+    return ContactSink(contacts_path(ds, dt), resume=resume)
+
+
+def contact_points_sink(ds, dt, resume=True):
+    return ContactSink(contact_points_path(ds, dt), resume=resume)
+
+
+def load_contact_points(ds, dt):
+    return load_sink(contact_points_path(ds, dt), ds, dt)
 
 
-def contact_combos(data, delta):
-    combos = set()
-    users = data.users()
-    user_combos = combinations(users, 2)
-    for i, j in user_combos:
-        contacts = detect_contact(i, j, data, delta)
-        for c in contacts:
-            combos.add(c)
+def load_contacts(ds, dt):
+    return load_sink(contacts_path(ds, dt), ds, dt)
+
+
+def load_sink(path, ds, dt):
+    # Read-only: a detection run may still be appending to the log.
+    committed, contacts = ContactSink.read(path)
+    if not committed:
+        return None
+    return {'ds': ds, 'dt': dt, 'total': len(contacts), 'contacts': contacts}
+
+
+def contact_point_combos(data, delta, resume=True, workers=1):
+    with contact_points_sink(*delta, resume=resume) as sink:
+        return pair_combos(data, delta, sink, workers)
+
+
+def contact_combos(data, delta, resume=True, workers=1):
+    with contacts_sink(*delta, resume=resume) as sink:
+        return pair_combos(data, delta, sink, workers, limit=1)
+
+
+def pair_combos(data, delta, sink, workers=1, limit=None):
+    """
+    Detects the contacts of every user pair not yet committed to `sink`. With `workers > 1` the
+    pairs are sharded across a process pool; results are still recorded and committed in pair order.
+    """
+    combos = set(sink.contacts())
+    pairs = [(str(i), str(j)) for i, j in combinations(data.users(), 2) if not sink.is_committed((str(i), str(j)))]
+    if workers > 1:
+        with data_pool(data, workers) as pool:
+            found = pool.map(partial(pair_contact_points, delta=delta, limit=limit), pairs,
+                             chunksize=shard_size(len(pairs), workers))
+            for k, ((i, j), contacts) in enumerate(zip(pairs, found)):
+                combos.update(record_contacts(i, j, contacts, sink))
+                sink.commit((i, j))
+                metrics.progress('user pairs', k + 1, len(pairs))
+    else:
+        for k, (i, j) in enumerate(pairs):
+            contacts = islice(user_contact_points(i, j, data, delta), limit)
+            combos.update(record_contacts(i, j, contacts, sink))
+            sink.commit((i, j))
+            metrics.progress('user pairs', k + 1, len(pairs))
     return combos
 
 
 def generate_contacts(data, deltas):
     ignore_cache = False
     for d in deltas:
-        ds, dt = d
-        contact_data = load_contacts(ds, dt)
-        if ignore_cache or contact_data is None:
-            contacts = contact_combos(data, d)
-        else:
-            contacts = contact_data['contacts']
-            total = contact_data['total']
-            print('Loaded {} pickled contacts for ds={}, dt={}\n\n'.format(total, ds, dt))
-        for c in contacts:
-            print(c)
-        print('\n\n\n')
+        # Resumes from the last committed user pair unless the cache is ignored.
+        contacts = contact_combos(data, d, resume=not ignore_cache)
+        print('ds={} dt={}: {} contacts'.format(d[0], d[1], len(contacts)))
 
 
 def generate_contact_points(data, deltas):
     ignore_cache = False
     for d in deltas:
-        ds, dt = d
-        contact_point_data = load_contact_points(ds, dt)
-        if ignore_cache or contact_point_data is None:
-            contact_points = contact_point_combos(data, d)
-        else:
-            contact_points = contact_point_data['contacts']
-            total = contact_point_data['total']
-            print('Loaded {} pickled contact points for ds={}, dt={}\n\n'.format(total, ds, dt))
-        for cp in contact_points:
-            print(cp)
-        print('\n\n\n')
+        contact_points = contact_point_combos(data, d, resume=not ignore_cache)
+        print('ds={} dt={}: {} contact points'.format(d[0], d[1], len(contact_points)))
 
 
 def generate_graph(data, deltas):
@@ -197,6 +140,65 @@ def generate_graph(data, deltas):
     save_results(largest_comps, avg_degrees, results_delta)
 
 
+def generate_sweep(data, deltas, weight='count_weight'):
+    # One grid join at the loosest delta serves every setting.
+    results = ContactSweepOp(data.users(), deltas, weight=weight, data_op=data).output()['deltas']
+    for r in results:
+        print('ds={} dt={}: {} contacts, largest component {}, average degree {}'.format(
+            r['ds'], r['dt'], r['contacts'], r['largest_component'], r['average_degree']))
+    save_results([r['largest_component'] for r in results],
+                 [r['average_degree'] for r in results],
+                 ['{}m {}s'.format(r['ds'], r['dt']) for r in results])
+    return results
+
+
+def generate_simplified_graphs(deltas, weight='count_weight'):
+    # Each setting runs on trajectories simplified within its own error bound, at the inflated
+    # delta that keeps every user pair in contact.
+    results = []
+    for ds, dt in deltas:
+        data = GeolifeData(simplify=contact_tolerance(ds, dt))
+        result = GridJoinContactsOp(data.users(), *inflate_delta((ds, dt), data.simplify), weight=weight, data_op=data).output()
+        reduction = data.reduction()
+        print('ds={} dt={}: {} of {} points ({:.1f}x fewer)'.format(ds, dt, reduction['simplified'], reduction['points'], reduction['ratio']))
+        results.append(result)
+    return results
+
+
+def generate_weight_graphs(data, ds, dt, global_origin, workers=2):
+    # Both weightings share one tiling node and are built concurrently.
+    pipeline = PipelineGraph(workers=workers)
+    tiles = pipeline.op(GenerateTilesOp, data.users(), ds, dt, global_origin, data_op=data)
+    graphs = [pipeline.op(GraphContactPointsOp, tiles, weight=weight) for weight in ['count_weight', 'dist_weight']]
+    results = pipeline.run(*graphs)
+    for stats in pipeline.stats():
+        print('{}: {:.2f}s'.format(stats['node'], stats['wall_time']))
+    return results
+
+
+def generate_out_of_core_graph(data, ds, dt, global_origin, weight='count_weight', memory_budget=1 << 30):
+    # Tiles are spilled to hash partitions on disk and paired one partition at a time.
+    tiles = GenerateTilesOp(data.users(), ds, dt, global_origin, data_op=data, memory_budget=memory_budget).output()
+    print('{} tiles in {} partitions'.format(len(tiles), tiles.partition_count()))
+    return GraphContactPointsOp(tiles, weight=weight).output()
+
+
+def generate_daily_metrics(data, ds, dt, global_origin, window=DAY):
+    # One tiling, then every day's graph metrics from the bucketed edges.
+    tiles = GenerateTilesOp(data.users(), ds, dt, global_origin, data_op=data).output()
+    daily = TemporalContactGraph.from_tiles(tiles, window).metrics()
+    for start, contacts, largest, degree in zip(daily['window'], daily['contacts'], daily['largest_component'], daily['average_degree']):
+        print('{}: {} contacts, largest component {}, average degree {}'.format(start, contacts, largest, degree))
+    return daily
+
+
+def update_contact_network(ds, dt, global_origin, weight='count_weight'):
+    # Tiles only the trajectory files that arrived since the last update.
+    result = IncrementalContactsOp(GeolifeData().users(), ds, dt, global_origin, weight=weight).output()
+    print('Updated {} users, {} new tile rows'.format(len(result['updated_users']), result['new_rows']))
+    return result
+
+
 def generate_graph(ds, dt, global_origin):
     tiles = GenerateTilesOp(ds, dt, global_origin).output()
 
@@ -237,6 +239,8 @@ def main():
     ds = 100  # 1000
     dt = 300  # 1200
     global_origin = (39.75872, 116.04142)
+    # Counters, stage timers and progress reports; off by default.
+    # metrics.enable(progress_interval=5.)
     #
     # generate_count_by_weight(ds, dt, global_origin)
     generate_weight_by_distance(ds, dt, global_origin)
@@ -248,7 +252,11 @@ def main():
     #
     # # generate_contact_points(data, deltas)
     # # generate_contacts(data, deltas)
-    # generate_graph(data, deltas)
+    # # generate_graph(data, deltas)
+    # generate_sweep(data, deltas)
+    # update_contact_network(ds, dt, global_origin)
+    # generate_daily_metrics(data, ds, dt, global_origin)
+    # metrics.metrics().dump('app/data/metrics.json')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+PLT_HEADER = 'Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n'
+
+
+@pytest.fixture
+def write_plt():
+    """
+    Writes a Geolife-format PLT file of `(lat, lon, alt, days)` rows to `<data_dir>/<uid>/Trajectory/<name>`.
+    """
+    def write(data_dir, uid, name, rows):
+        trajectory_dir = os.path.join(str(data_dir), uid, 'Trajectory')
+        os.makedirs(trajectory_dir, exist_ok=True)
+        path = os.path.join(trajectory_dir, name)
+        with open(path, 'w') as f:
+            f.write(PLT_HEADER)
+            for lat, lon, alt, days in rows:
+                f.write('{},{},0,{},{},2008-10-23,02:53:04\n'.format(lat, lon, alt, days))
+        return path
+    return write
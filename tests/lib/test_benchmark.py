@@ -0,0 +1,36 @@
+import json
+
+from benchmark import compare, main, run_benchmarks
+
+
+def test_benchmark_times_every_stage(tmp_path):
+    results = run_benchmarks(sizes=[(3, 2, 50)], deltas=[(500, 600)], weights=['count_weight'], pairs=1, workdir=str(tmp_path))
+
+    assert [r['stage'] for r in results] == ['load_cold', 'load_warm', 'tiles', 'graph', 'contacts']
+    assert results[0]['output'] == results[1]['output'] == 300
+    assert all(r['seconds'] >= 0 and r['users'] == 3 for r in results)
+    json.dumps(results)
+
+
+def test_compare_reports_slower_results():
+    baseline = [{'stage': 'tiles', 'users': 3, 'trajectories': 2, 'points': 50, 'ds': 100, 'dt': 300, 'weight': None, 'seconds': 1.0}]
+    slower = [dict(baseline[0], seconds=1.5)]
+    faster = [dict(baseline[0], seconds=1.1)]
+    other = [dict(baseline[0], ds=500, seconds=9.0)]
+
+    assert compare(slower, baseline, 0.25) == [(slower[0], 1.0)]
+    assert compare(faster, baseline, 0.25) == []
+    assert compare(other, baseline, 0.25) == []
+
+
+def test_main_writes_results_and_fails_on_regression(tmp_path):
+    output, baseline = tmp_path / 'results.json', tmp_path / 'baseline.json'
+    args = ['--sizes', '2x1x30', '--deltas', '500,600', '--weights', 'count_weight', '--output', str(output)]
+    assert main(args) == 0
+    results = json.loads(output.read_text())
+    assert 'numpy' in results['environment'] and len(results['results']) == 5
+
+    for result in results['results']:
+        result['seconds'] = -1.
+    baseline.write_text(json.dumps(results))
+    assert main(args + ['--baseline', str(baseline)]) == 1
@@ -0,0 +1,54 @@
+import networkx as nx
+import numpy as np
+
+from app.lib.contact_graph import ContactGraph
+
+
+def test_contact_graph_matches_networkx():
+    rng = np.random.RandomState(8)
+    users = np.array(['{:03d}'.format(k) for k in range(40)])
+    uid1, uid2 = users[rng.randint(0, 40, 300)], users[rng.randint(0, 40, 300)]
+    keep = uid1 != uid2
+    uid1, uid2 = uid1[keep], uid2[keep]
+    distance, time_diff = rng.uniform(0, 100, len(uid1)), rng.uniform(0, 300, len(uid1))
+
+    expected = nx.Graph()
+    for u1, u2, d, td in zip(uid1, uid2, distance, time_diff):
+        if expected.has_edge(u1, u2):
+            edge = expected[u1][u2]
+            edge.update(count=edge['count'] + 1, distance=min(edge['distance'], d), far=max(edge['far'], d), time_diff=td)
+        else:
+            expected.add_edge(u1, u2, count=1, distance=d, far=d, time_diff=td)
+
+    graph = ContactGraph.from_contacts(uid1, uid2, distance, time_diff, weight='dist_weight', dt=300)
+    exported = graph.to_networkx()
+    assert sorted(exported.nodes()) == sorted(expected.nodes())
+    for u1, u2, edge in expected.edges(data=True):
+        assert exported[u1][u2] == {'weight': 300 - edge['far'], 'count': edge['count'],
+                                    'distance': edge['distance'], 'time_diff': edge['time_diff']}
+    assert graph.largest_component() == max(len(c) for c in nx.connected_components(expected))
+    assert graph.average_degree() == 2. * expected.number_of_edges() / expected.number_of_nodes()
+    assert np.isclose(graph.adjacency().sum(), 2 * sum(w for _, _, w in exported.edges(data='weight')))
+
+    empty = ContactGraph.from_contacts([], [])
+    assert (empty.largest_component(), empty.average_degree(), empty.number_of_edges()) == (0, 0., 0)
+
+
+def test_combine_matches_graph_of_all_contacts():
+    rng = np.random.RandomState(4)
+    users = np.array(['{:03d}'.format(k) for k in range(10)])
+    uid1, uid2 = users[rng.randint(0, 10, 200)], users[rng.randint(0, 10, 200)]
+    keep = uid1 != uid2
+    uid1, uid2 = uid1[keep], uid2[keep]
+    distance, time_diff = rng.uniform(0, 100, len(uid1)), rng.uniform(0, 300, len(uid1))
+
+    expected = ContactGraph.from_contacts(uid1, uid2, distance, time_diff, weight='dist_weight', dt=300)
+    parts = [ContactGraph.from_contacts(uid1[s], uid2[s], distance[s], time_diff[s], weight='dist_weight', dt=300)
+             for s in (slice(0, 50), slice(50, 50), slice(50, None))]
+    combined = ContactGraph.combine(parts, weight='dist_weight', dt=300)
+
+    def edges(graph):
+        return sorted(zip(graph.nodes[graph.row], graph.nodes[graph.col], graph.count, graph.min_distance,
+                          graph.max_distance, graph.time_diff))
+    assert edges(combined) == edges(expected)
+    assert ContactGraph.combine([], dt=300).number_of_edges() == 0
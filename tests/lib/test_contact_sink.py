@@ -0,0 +1,56 @@
+import os
+
+from app.lib.contact_sink import ContactSink
+
+
+def test_sink_batches_writes(tmp_path):
+    path = str(tmp_path / 'contacts.log')
+    with ContactSink(path, flush_every=3, flush_interval=3600) as sink:
+        sink.extend(('000', '001'), [1, 2])
+        assert os.path.getsize(path) == 0
+        sink.append(('000', '001'), 3)
+        assert os.path.getsize(path) > 0
+        sink.commit(('000', '001'))
+
+    assert list(ContactSink(path).contacts()) == [1, 2, 3]
+
+
+def test_sink_resumes_from_last_commit(tmp_path):
+    path = str(tmp_path / 'contacts.log')
+    sink = ContactSink(path, flush_every=1)
+    sink.extend(('000', '001'), ['a', 'b'])
+    sink.commit(('000', '001'))
+    sink.extend(('000', '002'), ['c'])
+    sink.flush()
+    # Simulate a crash in the middle of writing the next frame.
+    with open(path, 'ab') as f:
+        f.write(b'\x80\x05\x95')
+
+    resumed = ContactSink(path)
+    assert resumed.is_committed(('000', '001'))
+    assert not resumed.is_committed(('000', '002'))
+    resumed.extend(('000', '002'), ['c'])
+    resumed.commit(('000', '002'))
+    assert list(resumed.contacts()) == ['a', 'b', 'c']
+    resumed.close()
+
+    assert list(ContactSink(path, resume=False).contacts()) == []
+
+
+def test_read_leaves_the_log_alone(tmp_path):
+    path = str(tmp_path / 'contacts.log')
+    assert ContactSink.read(path) == (set(), [])
+    assert not os.path.exists(path)
+
+    sink = ContactSink(path, flush_every=1)
+    sink.extend(('000', '001'), ['a', 'b'])
+    sink.commit(('000', '001'))
+    sink.extend(('000', '002'), ['c'])
+    size = os.path.getsize(path)
+
+    # The writer's uncommitted tail is skipped, not truncated.
+    assert ContactSink.read(path) == ({('000', '001')}, ['a', 'b'])
+    assert os.path.getsize(path) == size
+    sink.commit(('000', '002'))
+    sink.close()
+    assert ContactSink.read(path) == ({('000', '001'), ('000', '002')}, ['a', 'b', 'c'])
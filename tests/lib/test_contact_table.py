@@ -0,0 +1,32 @@
+import numpy as np
+
+from app.lib.contact_table import ContactTable, ContactTableWriter
+from app.lib.ops.tiles import TileIndex, tile_contact_blocks, tile_contacts
+
+
+def test_streamed_table_reads_back_memory_mapped(tmp_path):
+    rng = np.random.RandomState(10)
+    tiles = TileIndex(100, 300, (39.98, 116.31))
+    for key in range(60):
+        for uid in rng.choice(12, rng.randint(1, 6), replace=False):
+            tiles.tile(key).add(('{:03d}'.format(uid), 39.98 + rng.uniform(0, 1e-3), 116.31, 1e9 + rng.uniform(0, 300), 100, 300))
+
+    expected = tile_contacts(tiles)
+    with ContactTableWriter(str(tmp_path / 'contacts'), {'ds': 100, 'dt': 300}) as writer:
+        for block in tile_contact_blocks(tiles, max_pairs=25):
+            writer.write(block)
+    table = ContactTable.open(str(tmp_path / 'contacts'))
+
+    assert isinstance(table.columns['t1'], np.memmap)
+    assert len(table.row_groups) > 1 and sum(table.row_groups) == len(table) == len(expected) > 0
+    assert table.attributes == {'ds': 100, 'dt': 300}
+    for name in ['uid1', 'uid2', 'tile_hash', 'dist_apart', 'time_diff', 'lat1', 'lon2', 't1', 't2']:
+        assert np.array_equal(table[name], expected[name])
+
+    frame = table.to_frame()
+    assert list(frame['uid1'].astype(str)) == list(expected['uid1'])
+    assert list(frame['tile_hash'].cat.categories) == list(table.dictionaries['tile_hash'])
+
+    frame.assign(ds=100, dt=300).to_csv(str(tmp_path / 'legacy.csv'), index=None)
+    imported = ContactTable.from_csv(str(tmp_path / 'legacy.csv'))
+    assert np.array_equal(imported['uid2'], expected['uid2']) and np.array_equal(imported['t2'], expected['t2'])
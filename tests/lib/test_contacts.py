@@ -0,0 +1,140 @@
+import numpy as np
+
+from app.lib.contacts import sweep_contacts, grid_join_contacts, user_contact_points
+from app.lib.datasets import GeolifeData
+from app.lib.geodesy import haversine
+from app.lib.trajectory_store import TrajectoryStore
+
+
+def brute_force_contacts(points1, points2, delta):
+    ds, dt = delta
+    pairs = []
+    for i in range(len(points1[0])):
+        for j in range(len(points2[0])):
+            if abs(points1[2][i] - points2[2][j]) <= dt and \
+                    haversine(points1[0][i], points1[1][i], points2[0][j], points2[1][j]) <= ds:
+                pairs.append((i, j))
+    return pairs
+
+
+def random_points(rng, n):
+    t = np.sort(rng.uniform(0, 3600, n))
+    return 39.98 + rng.uniform(0, 0.01, n), 116.31 + rng.uniform(0, 0.01, n), t
+
+
+def test_sweep_matches_brute_force():
+    rng = np.random.RandomState(7)
+    points1, points2 = random_points(rng, 150), random_points(rng, 120)
+    delta = (300, 120)
+
+    idx1, idx2, distance = sweep_contacts(points1, points2, delta, max_candidates=64)
+
+    assert list(zip(idx1, idx2)) == brute_force_contacts(points1, points2, delta)
+    assert np.all(distance <= delta[0])
+
+
+def test_sweep_keeps_exact_time_boundary():
+    points1 = ([40.0], [116.0], [1000.0])
+    points2 = ([40.0, 40.0, 40.0], [116.0, 116.0, 116.0], [699.0, 700.0, 1300.0])
+    idx1, idx2, _ = sweep_contacts(points1, points2, (1, 300))
+    assert list(idx2) == [1, 2]
+
+
+def test_user_contact_points_scan_order(tmp_path, write_plt):
+    data_dir = tmp_path / 'Data'
+    # 15:00, 15:01 and 15:02 on 2008-10-23 in OLE days.
+    minute = 1 / 1440.
+    write_plt(data_dir, '000', '1.plt', [(40.0, 116.0, 0, 39744.625 + minute), (40.0, 116.0, 0, 39744.625 + 2 * minute)])
+    write_plt(data_dir, '000', '2.plt', [(40.0, 116.0, 0, 39744.625)])
+    write_plt(data_dir, '001', '1.plt', [(40.0, 116.0001, 0, 39744.625), (41.0, 116.0, 0, 39744.625)])
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    contacts = list(user_contact_points('000', '001', data, (100, 90)))
+
+    assert [(c.traj_plt_p1[-5:], round(c.p1.t - c.p2.t)) for c in contacts] == [('1.plt', 60), ('2.plt', 0)]
+    assert all(c.dist_apart() <= 100 for c in contacts)
+
+
+def test_grid_join_matches_brute_force():
+    rng = np.random.RandomState(11)
+    n = 400
+    owner = rng.randint(0, 4, n)
+    lat, lon, t = 39.98 + rng.uniform(0, 0.02, n), 116.31 + rng.uniform(0, 0.02, n), rng.uniform(0, 7200, n)
+    delta = (250, 300)
+
+    idx1, idx2, distance = grid_join_contacts(owner, lat, lon, t, delta, max_candidates=100)
+
+    expected = []
+    for i in range(n):
+        for j in range(n):
+            if owner[i] < owner[j] and abs(t[i] - t[j]) <= delta[1] and \
+                    haversine(lat[i], lon[i], lat[j], lon[j]) <= delta[0]:
+                expected.append((i, j))
+    assert list(zip(idx1, idx2)) == sorted(expected)
+    assert np.allclose(distance, haversine(lat[idx1], lon[idx1], lat[idx2], lon[idx2]))
+
+
+def test_parallel_contact_point_combos_match_serial(tmp_path, monkeypatch, write_plt):
+    import proj
+    rng = np.random.RandomState(11)
+    for uid in ['000', '001', '002']:
+        rows = zip(40.0 + rng.uniform(0, 0.002, 50), 116.0 + rng.uniform(0, 0.002, 50),
+                   np.zeros(50), 39744.5 + np.sort(rng.uniform(0, 0.01, 50)))
+        write_plt(tmp_path / 'Data', uid, '1.plt', rows)
+    data = GeolifeData(store=TrajectoryStore(str(tmp_path / 'Data'), str(tmp_path / 'store')))
+    monkeypatch.chdir(tmp_path)
+    serial = proj.contact_point_combos(data, (100, 120), resume=False)
+    parallel = proj.contact_point_combos(data, (100, 120), resume=False, workers=2)
+
+    def rows(combos):
+        return sorted((c.p1.uid, c.p2.uid, c.p1.t, c.p2.t) for c in combos)
+    assert len(serial) > 0
+    assert rows(parallel) == rows(serial)
+
+
+def test_stream_contacts_match_pairwise_detection(tmp_path, write_plt):
+    from itertools import combinations
+    from app.lib.ops.stream import StreamContactsOp
+    rng = np.random.RandomState(13)
+    users = ['000', '001', '002', '003']
+    for uid in users:
+        for k in range(2):
+            rows = zip(40.0 + rng.uniform(0, 0.003, 40), 116.0 + rng.uniform(0, 0.003, 40),
+                       rng.randint(0, 100, 40), 39744.5 + np.sort(rng.uniform(0, 0.01, 40)))
+            write_plt(tmp_path / 'Data', uid, '{}.plt'.format(k), rows)
+    data = GeolifeData(store=TrajectoryStore(str(tmp_path / 'Data'), str(tmp_path / 'store')))
+
+    def rows(contacts):
+        return sorted((c.p1.uid, c.p2.uid, c.p1.t, c.p2.t, c.p1.lat, c.p2.lon, c.p1.alt, c.p2.days,
+                       c.traj_plt_p1, c.traj_plt_p2, c.dist_apart(), c.t) for c in contacts)
+
+    expected = [c for i, j in combinations(users, 2) for c in user_contact_points(i, j, data, (100, 60))]
+    streamed = StreamContactsOp(users, 100, 60, data_op=data, chunk_size=16).output()
+    assert len(expected) > 0
+    assert rows(streamed) == rows(expected)
+
+
+def test_candidate_trajectories_prune_far_apart_trajectories(tmp_path, write_plt):
+    from app.lib.contacts import candidate_trajectories
+    rng = np.random.RandomState(17)
+
+    def day(lat, days):
+        return zip(lat + rng.uniform(0, 0.002, 30), 116.0 + rng.uniform(0, 0.002, 30),
+                   np.zeros(30), days + np.sort(rng.uniform(0, 0.01, 30)))
+
+    data_dir = tmp_path / 'Data'
+    write_plt(data_dir, '000', '1.plt', day(40.0, 39744.5))
+    write_plt(data_dir, '000', '2.plt', day(40.0, 40744.5))  # Years later.
+    write_plt(data_dir, '000', '3.plt', day(41.0, 39744.5))  # Same time, 100km away.
+    write_plt(data_dir, '001', '1.plt', day(40.0, 39744.5))
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    traj_i, traj_j = candidate_trajectories(data.user_points('000'), data.user_points('001'), (100, 60))
+    assert list(zip(traj_i, traj_j)) == [(0, 0)]
+
+    contacts = list(user_contact_points('000', '001', data, (100, 60)))
+    points_i, points_j = data.user_points('000'), data.user_points('001')
+    t_i, t_j = (np.asarray(p.days) * 86400 for p in (points_i, points_j))
+    near = haversine(np.asarray(points_i.lat)[:, None], np.asarray(points_i.lon)[:, None], np.asarray(points_j.lat)[None, :],
+                     np.asarray(points_j.lon)[None, :]) <= 100
+    assert len(contacts) == np.count_nonzero(near & (np.abs(t_i[:, None] - t_j[None, :]) <= 60)) > 0
@@ -0,0 +1,48 @@
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+
+from app.lib.geodesy import box_distance_lower_bound, haversine, within
+from app.lib.points import ContactPoint, TrajectoryPoint
+
+
+def random_pairs(rng, n, max_meters):
+    lat = rng.uniform(-80, 80, n)
+    lon = rng.uniform(-180, 180, n)
+    meters, bearing = rng.uniform(0, max_meters, n), rng.uniform(0, 2 * np.pi, n)
+    lat2 = lat + np.degrees(meters * np.cos(bearing) / 6371000.)
+    lon2 = lon + np.degrees(meters * np.sin(bearing) / 6371000. / np.cos(np.radians(lat)))
+    return lat, lon, lat2, lon2
+
+
+def test_haversine_matches_scalar_formula():
+    lat1, lon1, lat2, lon2 = 39.98, 116.31, 39.99, 116.33
+    a = sin(radians(lat2 - lat1) / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(radians(lon2 - lon1) / 2) ** 2
+    expected = 6371 * 2 * asin(sqrt(a)) * 1000
+
+    assert np.isclose(haversine(lat1, lon1, lat2, lon2), expected, rtol=1e-12)
+    assert np.allclose(haversine(lat1, lon1, np.array([lat2, lat1]), np.array([lon2, lon1])), [expected, 0.])
+    pnt = ContactPoint(TrajectoryPoint([lat1, lon1, 0, 0, 39744.5]), TrajectoryPoint([lat2, lon2, 0, 0, 39744.5]), '', '')
+    assert np.isclose(pnt.dist_apart(), expected, rtol=1e-12)
+
+
+def test_within_matches_haversine_at_the_boundary():
+    rng = np.random.RandomState(7)
+    lat1, lon1, lat2, lon2 = random_pairs(rng, 20000, 2000)
+    exact = haversine(lat1, lon1, lat2, lon2)
+    for ds in np.concatenate((exact[:20], [1, 100, 500, 1000])):
+        assert np.array_equal(within(lat1, lon1, lat2, lon2, ds), exact <= ds)
+
+
+def test_box_distance_lower_bound_holds_for_points_in_the_boxes():
+    rng = np.random.RandomState(9)
+    lat = np.sort(rng.uniform(-80, 80, (2, 500, 2)), axis=2)
+    lon = np.sort(rng.uniform(-180, 180, (2, 500, 2)), axis=2) * rng.uniform(0, 0.1, (2, 500, 1))
+    bound = box_distance_lower_bound((lat[0, :, 0], lat[0, :, 1], lon[0, :, 0], lon[0, :, 1]),
+                                     (lat[1, :, 0], lat[1, :, 1], lon[1, :, 0], lon[1, :, 1]))
+    for _ in range(20):
+        u = rng.uniform(0, 1, (2, 2, 500))
+        plat = lat[:, :, 0] + u[0] * (lat[:, :, 1] - lat[:, :, 0])
+        plon = lon[:, :, 0] + u[1] * (lon[:, :, 1] - lon[:, :, 0])
+        assert np.all(haversine(plat[0], plon[0], plat[1], plon[1]) >= bound - 1e-6)
+    assert np.all(box_distance_lower_bound((0, 0, 179, 179), (0, 0, -179, -179)) < 300 * 1000)
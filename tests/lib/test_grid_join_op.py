@@ -0,0 +1,56 @@
+import os
+
+import networkx as nx
+import numpy as np
+
+from app.lib.datasets import GeolifeData
+from app.lib.ops.grid import ContactSweepOp, GridJoinContactsOp
+from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp
+from app.lib.trajectory_store import TrajectoryStore
+
+GLOBAL_ORIGIN = (39.75872, 116.04142)
+
+
+def test_grid_join_finds_contacts_across_tile_edges(tmp_path, monkeypatch, write_plt):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('app/data/graphs')
+    tiles_op = GenerateTilesOp([], 100, 300, GLOBAL_ORIGIN)
+    # Two users 40 m apart on either side of a tile edge, at the same time.
+    edge_lat, edge_lon = tiles_op.get_lat_lng_from_meters(2000 * 100, 2000 * 100)
+    step = edge_lon - tiles_op.get_lat_lng_from_meters(1999.8 * 100, 2000.5 * 100)[1]
+    write_plt('Data', '000', '1.plt', [(edge_lat + 0.0001, edge_lon - step, 0, 39744.5)])
+    write_plt('Data', '001', '1.plt', [(edge_lat + 0.0001, edge_lon + step, 0, 39744.5)])
+    data = GeolifeData(store=TrajectoryStore('Data', 'store'))
+
+    tiles = GenerateTilesOp(['000', '001'], 100, 300, GLOBAL_ORIGIN, data_op=data).output()
+    assert len(GraphContactPointsOp(tiles, weight='count_weight', contact_points=True).output()['contact_points']) == 0
+
+    result = GridJoinContactsOp(['000', '001'], 100, 300, data_op=data).output()
+    assert result['graph_generated'] is True
+    assert list(result['contacts']['uid1']) == ['000']
+    assert list(result['contacts']['uid2']) == ['001']
+    assert 30 < result['contacts']['dist_apart'][0] < 50
+
+
+def test_contact_sweep_matches_single_delta_runs(tmp_path, monkeypatch, write_plt):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(4)
+    users = ['000', '001', '002', '003']
+    for uid in users:
+        rows = zip(40.0 + rng.uniform(0, 0.01, 150), 116.0 + rng.uniform(0, 0.01, 150),
+                   np.zeros(150), 39744.5 + np.sort(rng.uniform(0, 0.02, 150)))
+        write_plt('Data', uid, '1.plt', rows)
+    data = GeolifeData(store=TrajectoryStore('Data', 'store'))
+    deltas = [(100, 300), (500, 60), (1000, 1200)]
+
+    sweep = ContactSweepOp(users, deltas, weight='dist_weight', data_op=data).output()['deltas']
+    # The single-delta runs write to the same GML paths, so the sweep's graphs are read first.
+    graphs = [nx.read_gml(result['graph_filepath']) for result in sweep]
+
+    assert [(r['ds'], r['dt']) for r in sweep] == deltas
+    for result, graph, (ds, dt) in zip(sweep, graphs, deltas):
+        single = GridJoinContactsOp(users, ds, dt, weight='dist_weight', data_op=data).output()
+        expected = nx.read_gml(single['graph_filepath'])
+        assert result['contacts'] == len(single['contacts']['uid1'])
+        assert sorted(graph.edges(data=True)) == sorted(expected.edges(data=True))
+        assert result['largest_component'] == max(len(c) for c in nx.connected_components(expected))
@@ -0,0 +1,85 @@
+import itertools
+
+import networkx as nx
+import numpy as np
+
+from app.lib.datasets import GeolifeData
+from app.lib.ops.incremental import IncrementalContactsOp
+from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp, weight_by_count
+from app.lib.trajectory_store import TrajectoryStore
+
+ORIGIN = (39.98, 116.31)
+
+
+def write_day(write_plt, data_dir, rng, uid, name, day):
+    rows = zip(39.98 + rng.uniform(-0.01, 0.01, 150), 116.31 + rng.uniform(-0.01, 0.01, 150),
+               np.zeros(150), day + np.sort(rng.uniform(0, 0.05, 150)))
+    write_plt(data_dir, uid, name, rows)
+
+
+def edge_weights(graph, data='weight'):
+    return {tuple(sorted((u, v))): w for u, v, w in graph.edges(data=data)}
+
+
+def test_incremental_update_matches_full_rebuild(tmp_path, write_plt, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(5)
+    data_dir, state_dir = tmp_path / 'Data', str(tmp_path / 'incremental')
+    users = ['000', '001', '002']
+    for uid in ['000', '001']:
+        write_day(write_plt, data_dir, rng, uid, '20081023.plt', 39744.5)
+
+    def data():
+        return GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    first = IncrementalContactsOp(users, 500, 600, ORIGIN, data_op=data(), state_dir=state_dir).output()
+    assert first['updated_users'] == ['000', '001']
+
+    # A new day for one user, a rewritten file for another and a brand new user.
+    write_day(write_plt, data_dir, rng, '000', '20081024.plt', 39745.5)
+    write_day(write_plt, data_dir, rng, '001', '20081023.plt', 39744.5)
+    write_day(write_plt, data_dir, rng, '002', '20081024.plt', 39745.5)
+    update = IncrementalContactsOp(users, 500, 600, ORIGIN, data_op=data(), state_dir=state_dir).output()
+    assert update['updated_users'] == users
+    assert update['retiled_users'] == ['001']
+
+    tiles = GenerateTilesOp(users, 500, 600, ORIGIN, data_op=data()).output()
+    assert {key: set(tile) for key, tile in update['tiles'].items()} == {key: set(tile) for key, tile in tiles.items()}
+
+    rebuilt = nx.Graph()
+    for tile in tiles.values():
+        for user1, user2 in itertools.combinations(tile, 2):
+            weight_by_count(rebuilt, user1, user2)
+    assert edge_weights(update['graph'].to_networkx()) == edge_weights(rebuilt)
+
+    # The GML has the attributes of the tile-method graph of the same tiling.
+    exported = nx.read_gml(update['graph_filepath'])
+    expected = nx.read_gml(GraphContactPointsOp(tiles, 'count_weight', contact_points=True).output()['graph_filepath'])
+    for attribute in ['weight', 'count', 'distance']:
+        assert edge_weights(exported, attribute) == edge_weights(expected, attribute)
+
+    unchanged = IncrementalContactsOp(users, 500, 600, ORIGIN, data_op=data(), state_dir=state_dir).output()
+    assert unchanged['updated_users'] == [] and unchanged['new_rows'] == 0
+
+
+def test_incremental_state_is_kept_per_tiling(tmp_path, write_plt, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.RandomState(6)
+    data_dir, state_dir = tmp_path / 'Data', str(tmp_path / 'incremental')
+    for uid in ['000', '001', '002']:
+        write_day(write_plt, data_dir, rng, uid, '20081023.plt', 39744.5)
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    users = ['000', '001', '002']
+    IncrementalContactsOp(users, 500, 600, ORIGIN, data_op=data, state_dir=state_dir).output()
+    # Another origin is another grid: nothing is reused from the first state.
+    moved = IncrementalContactsOp(users, 500, 600, (39.9, 116.2), data_op=data, state_dir=state_dir).output()
+    assert moved['updated_users'] == users
+    tiles = GenerateTilesOp(users, 500, 600, (39.9, 116.2), data_op=data).output()
+    assert {key: set(tile) for key, tile in moved['tiles'].items()} == {key: set(tile) for key, tile in tiles.items()}
+
+    # Users left out of a run are retracted.
+    fewer = IncrementalContactsOp(['000', '001'], 500, 600, ORIGIN, data_op=data, state_dir=state_dir).output()
+    assert fewer['removed_users'] == ['002'] and fewer['updated_users'] == []
+    assert all('002' not in tile.uids for tile in fewer['tiles'].values())
+    assert '002' not in fewer['graph'].nodes
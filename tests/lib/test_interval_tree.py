@@ -0,0 +1,17 @@
+import numpy as np
+
+from app.lib.interval_tree import IntervalTree
+
+
+def test_overlaps_match_brute_force():
+    rng = np.random.RandomState(4)
+    starts = rng.uniform(0, 1000, 300)
+    ends = starts + rng.exponential(20, 300)
+    lo = rng.uniform(-50, 1050, 200)
+    hi = lo + rng.exponential(10, 200)
+
+    query, interval = IntervalTree(starts, ends).overlaps(lo, hi)
+    expected = [(q, k) for q in range(len(lo)) for k in np.argsort(starts, kind='stable')
+                if starts[k] <= hi[q] and ends[k] >= lo[q]]
+    assert list(zip(query.tolist(), interval.tolist())) == expected
+    assert len(IntervalTree([], []).query(0, 1)) == 0
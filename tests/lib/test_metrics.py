@@ -0,0 +1,70 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from app.lib import metrics
+from app.lib.contacts import sweep_contacts
+from app.lib.metrics import Metrics
+from app.lib.pipeline_ops import PipelineOp
+
+
+@pytest.fixture
+def enabled():
+    stream = io.StringIO()
+    yield metrics.enable(progress_interval=60., stream=stream), stream
+    metrics.disable()
+
+
+class SquareOp(PipelineOp):
+    def __init__(self, x):
+        PipelineOp.__init__(self)
+        self.x = x
+
+    def perform(self):
+        return self._apply_output(self.x ** 2)
+
+
+def test_disabled_metrics_record_nothing():
+    m = Metrics()
+    m.count('contacts_found', 3)
+    with m.timer('stage'):
+        pass
+    m.progress('pairs', 1, 2)
+    assert m.counters == {} and m.timers == {}
+
+
+def test_counters_timers_and_dump(enabled, tmp_path):
+    m, _ = enabled
+    metrics.count('tiles_processed')
+    metrics.count('tiles_processed', 4)
+    assert SquareOp(3).output() == 9
+
+    snapshot = json.loads(open(m.dump(str(tmp_path / 'metrics' / 'run.json'))).read())
+    assert snapshot['counters'] == {'tiles_processed': 5}
+    assert snapshot['timers']['SquareOp']['calls'] == 1
+    assert snapshot['timers']['SquareOp']['seconds'] >= 0
+    assert snapshot['peak_memory'] > 0
+
+
+def test_progress_is_rate_limited(enabled):
+    _, stream = enabled
+    for done in range(1, 101):
+        metrics.progress('user pairs', done, 100)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('user pairs: 1/100 (1%)')
+    assert lines[1].startswith('user pairs: 100/100 (100%)')
+
+
+def test_sweep_reports_pruned_pairs(enabled):
+    m, _ = enabled
+    t = np.array([0., 10., 20.])
+    points1 = (np.array([40., 40., 40.]), np.array([116., 116., 117.]), t)
+    points2 = (np.array([40., 40., 40.]), np.array([116., 116., 116.]), t + 0.5)
+    idx1, _, _ = sweep_contacts(points1, points2, (100, 1))
+
+    assert m.counters['contacts_found'] == len(idx1) == 2
+    assert m.counters['point_pairs_examined'] == 3
+    assert m.counters['point_pairs_pruned_by_distance'] == 1
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from app.lib.datasets import GeolifeData
+from app.lib.op_cache import OpCache
+from app.lib.ops.tiles import GenerateTilesOp
+from app.lib.trajectory_store import TrajectoryStore
+
+GLOBAL_ORIGIN = (39.75872, 116.04142)
+
+
+def write_users(write_plt, data_dir, seed):
+    rng = np.random.RandomState(seed)
+    for uid in ['000', '001']:
+        rows = zip(40.0 + rng.uniform(0, 0.01, 50), 116.0 + rng.uniform(0, 0.01, 50),
+                   np.zeros(50), 39744.5 + np.sort(rng.uniform(0, 0.02, 50)))
+        write_plt(data_dir, uid, '1.plt', rows)
+
+
+def test_persisted_op_reuses_cached_output(tmp_path, monkeypatch, write_plt):
+    write_users(write_plt, tmp_path / 'Data', 1)
+    data = GeolifeData(store=TrajectoryStore(str(tmp_path / 'Data'), str(tmp_path / 'store')))
+    cache = OpCache(str(tmp_path / 'cache'))
+
+    tiles = GenerateTilesOp(['000', '001'], 100, 300, GLOBAL_ORIGIN, data_op=data).persist(cache).output()
+    assert cache.stats()['misses'] == 1 and cache.stats()['entries'] == 1
+
+    monkeypatch.setattr(GenerateTilesOp, 'perform', lambda op: 1 / 0)
+    cached = GenerateTilesOp(['000', '001'], 100, 300, GLOBAL_ORIGIN, data_op=data).persist(cache).output()
+    assert cache.stats()['hits'] == 1
+    assert list(cached.items()) == list(tiles.items())
+    assert cached[next(iter(cached))].uids == tiles[next(iter(tiles))].uids
+    monkeypatch.undo()
+
+    # Other inputs or changed data files miss.
+    GenerateTilesOp(['000', '001'], 100, 600, GLOBAL_ORIGIN, data_op=data).persist(cache).output()
+    write_users(write_plt, tmp_path / 'Data', 2)
+    os.utime(str(tmp_path / 'Data' / '000' / 'Trajectory' / '1.plt'), ns=(1, 1))
+    GenerateTilesOp(['000', '001'], 100, 300, GLOBAL_ORIGIN, data_op=data).persist(cache).output()
+    assert cache.stats()['misses'] == 3 and cache.stats()['entries'] == 3
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = OpCache(str(tmp_path / 'cache'), max_bytes=2500)
+    for key in ['a', 'b', 'c']:
+        cache.store(key, b'x' * 1000)
+        os.utime(cache.path(key), ns=(ord(key), ord(key)))
+    assert cache.stats()['evictions'] == 1 and not os.path.exists(cache.path('a'))
+    # Loading 'b' makes it the most recently used, so 'c' goes next.
+    assert cache.load('b')[0]
+    cache.store('d', b'x' * 1000)
+    assert sorted(os.listdir(str(tmp_path / 'cache'))) == ['b.pickle', 'd.pickle']
@@ -0,0 +1,60 @@
+import numpy as np
+
+from app.lib.pipeline_graph import PipelineGraph
+from app.lib.pipeline_ops import PipelineOp
+
+performed = []
+
+
+class RangeOp(PipelineOp):
+    def __init__(self, n):
+        PipelineOp.__init__(self)
+        self.n = n
+
+    def perform(self):
+        performed.append(('range', self.n))
+        return self._apply_output(np.arange(self.n))
+
+
+class ScaleOp(PipelineOp):
+    def __init__(self, values, factor):
+        PipelineOp.__init__(self)
+        self.values = values
+        self.factor = factor
+
+    def perform(self):
+        performed.append(('scale', self.factor))
+        return self._apply_output(self.values * self.factor)
+
+
+def test_graph_is_lazy_and_deduplicates_nodes():
+    del performed[:]
+    pipeline = PipelineGraph(workers=2, trace_memory=True)
+    base = pipeline.op(RangeOp, 1000)
+    double = pipeline.op(ScaleOp, base, 2)
+    triple = pipeline.op(ScaleOp, pipeline.op(RangeOp, 1000), factor=3)
+    assert pipeline.op(RangeOp, 1000) is base
+    assert performed == []
+
+    doubled, tripled = pipeline.run(double, triple)
+    assert np.array_equal(doubled, np.arange(1000) * 2) and np.array_equal(tripled, np.arange(1000) * 3)
+    assert sorted(performed) == [('range', 1000), ('scale', 2), ('scale', 3)]
+
+    # Computed nodes are reused.
+    assert np.array_equal(double.output(), doubled)
+    assert len(performed) == 3
+    stats = {s['node']: s for s in pipeline.stats()}
+    assert stats[double.name]['upstream'] == [base.name]
+    assert all(s['wall_time'] >= 0 and s['peak_memory'] >= 0 for s in stats.values())
+    assert stats[base.name]['peak_memory'] >= 1000 * 8
+
+
+def test_process_pool_runs_match_serial_runs():
+    serial = PipelineGraph()
+    parallel = PipelineGraph(workers=2, executor='process')
+    for pipeline in (serial, parallel):
+        base = pipeline.op(RangeOp, 50)
+        pipeline.run(pipeline.op(ScaleOp, base, 2), pipeline.op(ScaleOp, base, 5))
+    assert [s['node'] for s in serial.stats()] == [s['node'] for s in parallel.stats()]
+    assert all(s['peak_memory'] is None for s in serial.stats())
+    assert np.array_equal(parallel.op(ScaleOp, parallel.op(RangeOp, 50), 5).output(), np.arange(50) * 5)
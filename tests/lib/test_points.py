@@ -0,0 +1,42 @@
+import datetime
+import pickle
+
+import numpy as np
+import pytz
+
+from app.lib.points import TrajectoryPoint, ContactPoint, ole_days_to_unix
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    The saved contacts were pickled from `proj.py`, which imported the point classes into `__main__`.
+    """
+    def find_class(self, module, name):
+        return pickle.Unpickler.find_class(self, 'app.lib.points' if module == '__main__' else module, name)
+
+
+def test_point_times_match_datetime_conversion():
+    rng = np.random.RandomState(1)
+    days = np.concatenate((39000 + rng.uniform(0, 2000, 2000), 39744 + np.arange(2000) / 86400.))
+    expected = [(datetime.datetime(1899, 12, 30, tzinfo=pytz.utc) + datetime.timedelta(days=d)).timestamp()
+                for d in days.tolist()]
+
+    assert [TrajectoryPoint([0, 0, 0, 0, d]).t for d in days.tolist()] == expected
+    assert [pnt.t for pnt in TrajectoryPoint.from_columns(days, days, days, days)] == expected
+    assert ole_days_to_unix(days).tolist() == expected
+    assert TrajectoryPoint([0, 0, 0, 0, days[0]]).datetime.timestamp() == expected[0]
+
+
+def test_contact_point_pickles_load():
+    p1 = TrajectoryPoint([40.0, 116.0, 0, 10, 39744.5], '000')
+    p2 = TrajectoryPoint([40.001, 116.0, 0, 20, 39744.501], '001')
+    contact = pickle.loads(pickle.dumps(ContactPoint(p1, p2, '1.plt', '2.plt'), pickle.HIGHEST_PROTOCOL))
+    assert (contact.lat, contact.alt, contact.t) == (40.0005, 15, (p1.t + p2.t) / 2)
+    assert contact.p2.uid == '001' and contact.traj_plt_p2 == '2.plt'
+
+    with open('app/data/contacts/Contacts_ds1000_dt1200.pickle', 'rb') as f:
+        legacy = LegacyUnpickler(f).load()
+    contact = list(legacy['contacts'])[0]
+    assert isinstance(contact, ContactPoint)
+    assert contact.p1.datetime.timestamp() == contact.p1.t
+    assert 0 < contact.dist_apart() <= 1000
@@ -0,0 +1,25 @@
+import numpy as np
+
+from app.lib.reachability import TemporalReachability
+
+
+def test_reachability_respects_contact_order():
+    reach = TemporalReachability(['a', 'b', 'c', 'd'], ['b', 'c', 'e', 'c'], [10, 5, 30, 20], [11, 5, 31, 20])
+    assert reach.arrival_times('a') == {'a': -np.inf, 'b': 11}
+    assert reach.reachable('c', 0) == {'c', 'b', 'd', 'e', 'a'}
+    assert reach.reachable('c', 6) == {'c', 'd', 'e'}
+    assert reach.reachable_from(['a', 'zzz'], [0, 0]) == {'a': {'a', 'b'}, 'zzz': {'zzz'}}
+
+
+def test_batched_reachability_matches_single_source():
+    rng = np.random.RandomState(12)
+    users = np.array(['{:03d}'.format(k) for k in range(30)])
+    uid1, uid2 = users[rng.randint(0, 30, 60)], users[rng.randint(0, 30, 60)]
+    t1 = rng.uniform(0, 1000, 60)
+    reach = TemporalReachability(uid1, uid2, t1, t1 + rng.uniform(0, 10, 60))
+
+    sources, starts = users[:20], rng.uniform(0, 500, 20)
+    batched = reach.reachable_from(sources, starts)
+    for source, start in zip(sources, starts):
+        assert batched[source] == set(reach.arrival_times(source, start))
+    assert sum(len(reached) > 1 for reached in batched.values()) > 5
@@ -0,0 +1,64 @@
+import numpy as np
+
+from app.lib.contacts import grid_join_contacts
+from app.lib.datasets import GeolifeData
+from app.lib.geodesy import haversine
+from app.lib.ops.tiles import GenerateTilesOp
+from app.lib.points import ole_days_to_unix
+from app.lib.simplify import contact_tolerance, inflate_delta, simplify_user
+from app.lib.synthetic import SyntheticGeolife
+
+
+def test_every_dropped_point_is_near_a_kept_point():
+    user = SyntheticGeolife(users=1, trajectories=4, points=2000, interval=2.).store().user('000')
+    meters, seconds = contact_tolerance(100, 300)
+    simplified = simplify_user(user, (meters, seconds))
+
+    assert len(simplified) < len(user) / 4
+    assert simplified.plts == user.plts
+    t, kept_t = ole_days_to_unix(user.days), ole_days_to_unix(simplified.days)
+    for i in range(user.trajectory_count()):
+        s, k = user.trajectory(i), simplified.trajectory(i)
+        d = haversine(user.lat[s][:, None], user.lon[s][:, None], simplified.lat[k][None, :], simplified.lon[k][None, :])
+        near = (d <= meters) & (np.abs(t[s][:, None] - kept_t[k][None, :]) <= seconds)
+        assert near.any(axis=1).all()
+
+
+def test_simplified_data_keeps_every_user_pair_in_contact():
+    synthetic = SyntheticGeolife(users=6, trajectories=3, points=600, clusters=1, spread=0., days=1, seed=4)
+    delta = (100, 300)
+    raw = GeolifeData(store=synthetic.store())
+    simplified = GeolifeData(store=synthetic.store(), simplify=contact_tolerance(*delta))
+
+    def contact_pairs(data, delta):
+        users = [data.user_points(uid) for uid in data.users()]
+        owner = np.concatenate([np.full(len(user), k) for k, user in enumerate(users)])
+        columns = [np.concatenate([np.asarray(c) for c in columns]) for columns in
+                   zip(*[(user.lat, user.lon, ole_days_to_unix(user.days)) for user in users])]
+        idx1, idx2, _ = grid_join_contacts(owner, *columns, delta)
+        return set(zip(owner[idx1].tolist(), owner[idx2].tolist()))
+
+    pairs = contact_pairs(raw, delta)
+    assert len(pairs) > 0
+    assert pairs <= contact_pairs(simplified, inflate_delta(delta, simplified.simplify))
+    reduction = simplified.reduction()
+    assert reduction['points'] == synthetic.point_count()
+    assert reduction['ratio'] > 2
+    assert simplified.fingerprint() != raw.fingerprint()
+
+
+def test_tiling_reads_raw_points_unless_asked_for_simplified_ones():
+    synthetic = SyntheticGeolife(users=4, trajectories=2, points=500, interval=2., seed=3)
+    raw, data = GeolifeData(store=synthetic.store()), GeolifeData(store=synthetic.store(), simplify=contact_tolerance(100, 300))
+    users = raw.users()
+
+    expected = GenerateTilesOp(users, 100, 300, data_op=raw).output()
+    tiles = GenerateTilesOp(users, 100, 300, data_op=data).output()
+    assert {key: list(tile) for key, tile in tiles.items()} == {key: list(tile) for key, tile in expected.items()}
+    simplified = GenerateTilesOp(users, 100, 300, data_op=data, simplified=True).output()
+    assert sum(len(tile) for tile in simplified.values()) < sum(len(tile) for tile in expected.values())
+
+    # Single trajectory files are served simplified too.
+    plt = data.user_points('000').plts[0]
+    assert np.array_equal(data.load_trajectory_plt_points(plt), data.user_points('000').points(0))
+    assert len(data.load_trajectory_plt_points(plt)) < len(raw.load_trajectory_plt_points(plt))
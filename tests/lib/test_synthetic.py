@@ -0,0 +1,64 @@
+import numpy as np
+
+from app.lib.datasets import GeolifeData
+from app.lib.ops.incremental import IncrementalContactsOp
+from app.lib.ops.tiles import GenerateTilesOp
+from app.lib.synthetic import SyntheticGeolife
+from app.lib.trajectory_store import TrajectoryStore
+
+
+def test_synthetic_users_are_deterministic():
+    a = SyntheticGeolife(users=3, trajectories=2, points=50, seed=7)
+    b = SyntheticGeolife(users=5, trajectories=2, points=50, seed=7)
+    c = SyntheticGeolife(users=3, trajectories=2, points=50, seed=8)
+
+    for uid in a.uids():
+        for rows_a, rows_b in zip(a.user_trajectories(uid), b.user_trajectories(uid)):
+            assert np.array_equal(rows_a, rows_b)
+    assert not np.array_equal(a.user_trajectories('000')[0], c.user_trajectories('000')[0])
+
+
+def test_synthetic_trajectories_are_shaped_like_geolife():
+    synthetic = SyntheticGeolife(users=2, trajectories=3, points=100, interval=5.)
+    trajectories = synthetic.user_trajectories('001')
+
+    assert len(trajectories) == 3
+    assert all(rows.shape == (100, 4) for rows in trajectories)
+    assert all(np.allclose(np.diff(rows[:, 3]) * 86400, 5.) for rows in trajectories)
+    assert [rows[0, 3] for rows in trajectories] == sorted(rows[0, 3] for rows in trajectories)
+    assert synthetic.point_count() == 600
+
+
+def test_written_tree_matches_in_memory_store(tmp_path):
+    synthetic = SyntheticGeolife(users=3, trajectories=2, points=40, seed=1)
+    data_dir = synthetic.write(str(tmp_path / 'Data'))
+    written, memory = TrajectoryStore(data_dir, str(tmp_path / 'store')), synthetic.store()
+
+    assert list(written.users()) == list(memory.users()) == ['000', '001', '002']
+    for uid in synthetic.uids():
+        a, b = written.user(uid), memory.user(uid)
+        assert [p.split('/')[-1] for p in a.plts] == [p.split('/')[-1] for p in b.plts]
+        assert list(a.offsets) == list(b.offsets)
+        assert np.allclose(a.lat, b.lat, atol=1e-6) and np.allclose(a.lon, b.lon, atol=1e-6)
+        assert np.array_equal(a.days, b.days)
+
+    # Both feed the pipeline the same way.
+    tiles = [GenerateTilesOp(synthetic.uids(), 500, 600, data_op=GeolifeData(store=store)).output() for store in (written, memory)]
+    assert sorted(tiles[0]) == sorted(tiles[1])
+
+
+def test_synthetic_store_runs_parallel_and_incremental_ops(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    synthetic = SyntheticGeolife(4, 2, 200, seed=2, spread=500.)
+    data = GeolifeData(store=synthetic.store())
+    users = data.users()
+
+    serial = GenerateTilesOp(users, 500, 600, data_op=data).output()
+    parallel = GenerateTilesOp(users, 500, 600, data_op=data, workers=2).output()
+    assert list(parallel.keys()) == list(serial.keys())
+    assert all(parallel[key] == serial[key] for key in serial)
+
+    op = IncrementalContactsOp(users, 500, 600, data_op=data, state_dir=str(tmp_path / 'incremental'))
+    assert op.output()['updated_users'] == users.tolist()
+    again = IncrementalContactsOp(users, 500, 600, data_op=data, state_dir=str(tmp_path / 'incremental'))
+    assert again.output()['updated_users'] == []
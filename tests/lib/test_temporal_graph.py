@@ -0,0 +1,35 @@
+import numpy as np
+
+from app.lib.contact_graph import ContactGraph
+from app.lib.temporal_graph import HOUR, TemporalContactGraph
+
+
+def edges(graph):
+    g = graph.to_networkx()
+    return sorted((tuple(sorted((u, v))), d['count'], d['distance'], d['weight']) for u, v, d in g.edges(data=True))
+
+
+def test_snapshots_and_ranges_match_static_graphs():
+    rng = np.random.RandomState(6)
+    users = np.array(['{:03d}'.format(k) for k in range(12)])
+    uid1, uid2 = users[rng.randint(0, 6, 500)], users[rng.randint(6, 12, 500)]
+    t = rng.uniform(0, 10 * HOUR, 500)
+    distance = rng.uniform(0, 100, 500)
+    temporal = TemporalContactGraph(uid1, uid2, t, distance, window=HOUR, weight='dist_weight', dt=300)
+
+    assert list(temporal.windows()) == [k * HOUR for k in range(10)]
+    for t0, t1 in [(0, HOUR), (3 * HOUR, 7 * HOUR), (2.5 * HOUR, 4.2 * HOUR)]:
+        expected = np.floor(t0 / HOUR) * HOUR, np.ceil(t1 / HOUR) * HOUR
+        keep = (t >= expected[0]) & (t < expected[1])
+        static = ContactGraph.from_contacts(uid1[keep], uid2[keep], distance[keep], weight='dist_weight', dt=300)
+        assert edges(temporal.between(t0, t1)) == edges(static)
+
+    metrics = temporal.metrics()
+    for k, start in enumerate(temporal.windows()):
+        keep = (t >= start) & (t < start + HOUR)
+        static = ContactGraph.from_contacts(uid1[keep], uid2[keep], distance[keep], weight='dist_weight', dt=300)
+        assert edges(temporal.snapshot(start + 1)) == edges(static)
+        assert metrics['contacts'][k] == np.count_nonzero(keep)
+        assert metrics['largest_component'][k] == static.largest_component()
+        assert metrics['average_degree'][k] == static.average_degree()
+    assert temporal.snapshot(-HOUR).number_of_edges() == 0
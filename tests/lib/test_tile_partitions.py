@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.lib.datasets import GeolifeData
+from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp, GraphHottestPointsOp, tile_contacts
+from app.lib.synthetic import SyntheticGeolife
+from app.lib.tile_partitions import TILE_ROW_DTYPE, TilePartitions, TilePartitionWriter
+
+
+def contact_rows(table):
+    columns = ('uid1', 'uid2', 'tile_hash', 't1', 't2', 'dist_apart')
+    return sorted(zip(*(np.asarray(table[c]).tolist() for c in columns)))
+
+
+def graph_edges(graph):
+    return sorted(zip(graph.nodes[graph.row].tolist(), graph.nodes[graph.col].tolist(), graph.count.tolist()))
+
+
+def test_writer_sorts_partitions_by_cell(tmp_path):
+    rng = np.random.RandomState(2)
+    rows = np.zeros(500, dtype=TILE_ROW_DTYPE)
+    for c in ('ix', 'iy', 'it'):
+        rows[c] = rng.randint(-3, 3, len(rows))
+    rows['uid'] = np.arange(len(rows)) % 7
+    rows['t'] = np.arange(len(rows))
+
+    writer = TilePartitionWriter(str(tmp_path), 4, 100, 300, (39.98, 116.31), ['{:03d}'.format(k) for k in range(7)],
+                                 buffer_rows=64)
+    for k in range(0, len(rows), 50):
+        writer.write(rows[k:k + 50])
+    partitions = writer.close()
+
+    reopened = TilePartitions.open(str(tmp_path))
+    assert reopened.fingerprint() == partitions.fingerprint()
+    assert sum(reopened.rows) == len(rows)
+    cells = set()
+    for k in range(reopened.partition_count()):
+        part, starts, sizes = reopened.partition(k)
+        keys = list(zip(part['it'].tolist(), part['iy'].tolist(), part['ix'].tolist()))
+        assert keys == sorted(keys)
+        # Rows of a tile keep their write order.
+        assert all(np.all(np.diff(part['t'][s:s + n]) > 0) for s, n in zip(starts, sizes))
+        tile_cells = set(keys[s] for s in starts)
+        assert not cells & tile_cells
+        cells |= tile_cells
+    assert len(reopened) == len(cells) == len(set(zip(rows['it'].tolist(), rows['iy'].tolist(), rows['ix'].tolist())))
+
+
+def test_spilled_tiles_pair_like_in_memory_tiles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('app/data/graphs')
+    data = GeolifeData(store=SyntheticGeolife(20, 3, 300, seed=1, spread=500., days=1).store())
+    users = data.users()
+
+    tiles = GenerateTilesOp(users, 500, 600, data_op=data).output()
+    # A budget this small spreads the rows over many partitions.
+    partitions = GenerateTilesOp(users, 500, 600, data_op=data, memory_budget=100000, spill_dir='partitions').output()
+    assert isinstance(partitions, TilePartitions)
+    assert partitions.partition_count() > 1
+    assert len(partitions) == len(tiles)
+    assert partitions.max_tile_size == max(len(tile) for tile in tiles.values())
+
+    expected, spilled = tile_contacts(tiles), tile_contacts(partitions)
+    assert len(expected) > 0
+    assert contact_rows(spilled) == contact_rows(expected)
+
+    for weight in ['count_weight', 'dist_weight']:
+        expected = GraphContactPointsOp(tiles, weight, contact_points=True).output()
+        spilled = GraphContactPointsOp(partitions, weight, contact_points=True).output()
+        assert graph_edges(spilled['graph']) == graph_edges(expected['graph'])
+        assert np.allclose(np.sort(spilled['graph'].weights()), np.sort(expected['graph'].weights()))
+        assert contact_rows(spilled['contact_points']) == contact_rows(expected['contact_points'])
+
+    expected = GraphContactPointsOp(tiles, 'count_weight').output()['graph']
+    spilled = GraphContactPointsOp(partitions, 'count_weight').output()['graph']
+    assert graph_edges(spilled) == graph_edges(expected)
+    hottest = GraphHottestPointsOp(partitions, 'count_weight').output()['graph']
+    assert graph_edges(hottest) == graph_edges(GraphHottestPointsOp(tiles, 'count_weight').output()['graph'])
+
+
+def test_spilled_tilings_never_overwrite_each_other(tmp_path):
+    data = GeolifeData(store=SyntheticGeolife(20, 3, 300, seed=1, spread=500., days=1).store())
+    users = data.users()
+    first = GenerateTilesOp(users, 500, 600, data_op=data, memory_budget=100000, spill_dir=str(tmp_path)).output()
+    expected = contact_rows(tile_contacts(first))
+    second = GenerateTilesOp(users, 100, 300, data_op=data, memory_budget=100000, spill_dir=str(tmp_path)).output()
+
+    assert first.path != second.path
+    assert contact_rows(tile_contacts(first)) == expected
+    second.remove()
+    assert not os.path.exists(second.path)
+
+    # Nothing is ever written over existing partitions...
+    with pytest.raises(ValueError):
+        TilePartitionWriter(first.path, 2, 500, 600, (39.98, 116.31), users)
+    # ...and partitions changed behind the metadata's back are refused.
+    k = int(np.argmax(first.rows))
+    with open(os.path.join(first.path, '{}.bin'.format(k)), 'r+b') as f:
+        f.write(b'\xff' * 8)
+    with pytest.raises(ValueError):
+        first.partition(k)
+    with open(os.path.join(first.path, '{}.bin'.format(k)), 'ab') as f:
+        f.write(b'\x00')
+    with pytest.raises(ValueError):
+        TilePartitions.open(first.path)
@@ -1,10 +1,14 @@
 from builtins import AssertionError
+import os
 
-from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp
+from app.lib.cells import cell_key
+from app.lib.contact_table import ContactTableWriter
+from app.lib.datasets import GeolifeData
+from app.lib.ops.tiles import GenerateTilesOp, GraphContactPointsOp, TileIndex, tile_contact_graph
+from app.lib.trajectory_store import TrajectoryStore
 from hypothesis import given, example
 import hypothesis.strategies as st
 import numpy as np
-import pandas as pd
 
 ALL_USER_IDS = [f'{i:03d}' for i in range(0, 100)]
 GLOBAL_ORIGIN = (39.75872, 116.04142)
@@ -20,6 +24,38 @@ GLOBAL_ORIGIN = (39.75872, 116.04142)
     # pass
 
 
+def test_batch_tiles_match_per_point_tiles(tmp_path, write_plt):
+    rng = np.random.RandomState(3)
+    data_dir = tmp_path / 'Data'
+    for uid in ['000', '001', '002']:
+        rows = zip(39.98 + rng.uniform(-0.02, 0.02, 200), 116.31 + rng.uniform(-0.02, 0.02, 200),
+                   np.zeros(200), 39744.5 + np.sort(rng.uniform(0, 0.1, 200)))
+        write_plt(data_dir, uid, '1.plt', rows)
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    # A null point inside the data puts points on both sides of the truncation at zero.
+    origin = (39.98, 116.31)
+    batch = GenerateTilesOp(['000', '001', '002'], 500, 600, origin, data_op=data).output()
+    per_point = GenerateTilesOp(['000', '001', '002'], 500, 600, origin, data_op=data, batch=False).output()
+
+    assert list(batch.keys()) == list(per_point.keys())
+    assert all(batch[k] == per_point[k] for k in per_point)
+
+
+def test_tile_index_renders_legacy_hash():
+    tiles = TileIndex(100, 300, GLOBAL_ORIGIN)
+    op = GenerateTilesOp([], 100, 300, GLOBAL_ORIGIN)
+    x, y = op.meters_for_lat_lon(39.98, 116.31)
+    key = cell_key(int(x / 100), int(y / 100), int(1224730384.0 / 300))
+    tiles.tile(key).add(('000', 39.98, 116.31, 1224730384.0, 100, 300))
+    tiles.tile(key).add(('000', 39.981, 116.311, 1224730390.0, 100, 300))
+
+    local_lat, local_lon = op.get_lat_lng_from_meters(int(x / 100) * 100, int(y / 100) * 100)
+    expected_hash = "lat{}_lon{}_t{}".format(local_lat, local_lon, int(1224730384.0 / 300) * 300)
+    assert list(tiles.hashed_items()) == [(expected_hash, [('000', 39.98, 116.31, 1224730384.0, 100, 300)])]
+    assert tiles[key].uids == {'000'}
+
+
 def test_generate_contacts_by_invalid_weight():
     try:
         GraphContactPointsOp(hashed_tiles={}, weight='invalid')
@@ -45,12 +81,12 @@ def test_generate_contacts_by_count_weight(users, ds, dt, global_origin):
     tiles_op = GenerateTilesOp(users, ds, dt, global_origin)
 
     # find contact points involving most users. (most occupied tile/s)
-    graph_op = GraphContactPointsOp(tiles_op.output(), weight='count_weight')
+    graph_op = GraphContactPointsOp(tiles_op.output(), weight='count_weight', contact_points=True)
 
     # Test that a graph has been generated
     result = graph_op.output()
 
-    pd.DataFrame(result['contact_points']).to_csv("contact_points_by_count_weight_{}ds_{}dt.csv".format(ds, dt), header=None, index=None)
+    result['contact_points'].save("contact_points_by_count_weight_{}ds_{}dt".format(ds, dt))
 
     assert result['graph_generated'] is True
 
@@ -66,11 +102,69 @@ def test_generate_contacts_by_distance(users, ds, dt, global_origin):
     tiles_op = GenerateTilesOp(users, ds, dt, global_origin)
 
     # find contact points involving most users. (most occupied tile/s)
-    graph_op = GraphContactPointsOp(tiles_op.output(), weight='dist_weight')
+    graph_op = GraphContactPointsOp(tiles_op.output(), weight='dist_weight', contact_points=True)
 
     # Test that a graph has been generated
     result = graph_op.output()
 
-    pd.DataFrame(result['contact_points']).to_csv("contact_points_by_distance_{}ds_{}dt.csv".format(ds, dt), header=None, index=None)
+    result['contact_points'].save("contact_points_by_distance_{}ds_{}dt".format(ds, dt))
 
     assert result['graph_generated'] is True
+
+
+def test_parallel_tiles_match_serial_tiles(tmp_path, write_plt):
+    rng = np.random.RandomState(5)
+    data_dir = tmp_path / 'Data'
+    for uid in ['000', '001', '002', '003']:
+        rows = zip(39.98 + rng.uniform(-0.02, 0.02, 100), 116.31 + rng.uniform(-0.02, 0.02, 100),
+                   np.zeros(100), 39744.5 + np.sort(rng.uniform(0, 0.1, 100)))
+        write_plt(data_dir, uid, '1.plt', rows)
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    users = ['000', '001', '002', '003']
+    serial = GenerateTilesOp(users, 500, 600, GLOBAL_ORIGIN, data_op=data).output()
+    parallel = GenerateTilesOp(users, 500, 600, GLOBAL_ORIGIN, data_op=data, workers=2).output()
+
+    assert list(parallel.keys()) == list(serial.keys())
+    assert all(parallel[k] == serial[k] for k in serial)
+
+
+def test_count_weight_graph_counts_shared_tiles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tiles = TileIndex(100, 300, GLOBAL_ORIGIN)
+    tiles.tile(1).add(('000', 39.98, 116.31, 0., 100, 300))
+    tiles.tile(1).add(('001', 39.98, 116.31, 1., 100, 300))
+    tiles.tile(1).add(('002', 39.98, 116.31, 2., 100, 300))
+    tiles.tile(2).add(('001', 39.98, 116.31, 0., 100, 300))
+    tiles.tile(2).add(('000', 39.98, 116.31, 0., 100, 300))
+    os.makedirs('app/data/graphs')
+
+    result = GraphContactPointsOp(tiles, weight='count_weight', contact_points=True).output()
+    graph = result['graph'].to_networkx()
+    assert result['graph_filepath'] == 'app/data/graphs/100ds_300dt_count_weight.gml'
+    assert sorted(graph.edges(data='weight')) == [('000', '001', 2), ('000', '002', 1), ('001', '002', 1)]
+    assert len(result['contact_points']) == 4
+
+    # Without contact points the counts come from the tile incidence matrix.
+    fast = GraphContactPointsOp(tiles, weight='count_weight').output()
+    assert 'contact_points' not in fast
+    assert sorted(fast['graph'].to_networkx().edges(data='weight')) == sorted(graph.edges(data='weight'))
+
+
+def test_incidence_graph_matches_pairwise_counts():
+    rng = np.random.RandomState(3)
+    tiles = TileIndex(100, 300, GLOBAL_ORIGIN)
+    for key in range(300):
+        for uid in rng.choice(40, rng.randint(1, 12), replace=False):
+            tiles.tile(key).add(('{:03d}'.format(uid), 39.98, 116.31, 0., 100, 300))
+
+    pairwise, _ = tile_contact_graph(tiles, 'count_weight', 300, writer=ContactTableWriter())
+    fast, _ = tile_contact_graph(tiles, 'count_weight', 300)
+    assert fast.min_distance is None
+    assert list(fast.nodes) == list(pairwise.nodes)
+    assert list(fast.row) == list(pairwise.row) and list(fast.col) == list(pairwise.col)
+    assert list(fast.count) == list(pairwise.count)
+
+    hot, _ = tile_contact_graph(tiles, 'count_weight', 300, size=11)
+    hot_pairwise, _ = tile_contact_graph(tiles, 'count_weight', 300, size=11, writer=ContactTableWriter())
+    assert list(hot.count) == list(hot_pairwise.count) and hot.number_of_edges() > 0
@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+from app.lib.datasets import GeolifeData, STREAM_DTYPE
+from app.lib.points import ole_days_to_unix
+from app.lib.trajectory_store import TrajectoryStore
+
+
+def test_store_columns_match_plt(tmp_path, write_plt):
+    data_dir, store_dir = tmp_path / 'Data', tmp_path / 'store'
+    a = write_plt(data_dir, '000', '1.plt', [(39.98, 116.31, 492, 39744.12), (39.99, 116.32, 493, 39744.13)])
+    b = write_plt(data_dir, '000', '2.plt', [(40.01, 116.35, 100, 39745.5)])
+
+    store = TrajectoryStore(str(data_dir), str(store_dir))
+    user = store.user('000')
+
+    assert isinstance(user.lat, np.memmap)
+    assert user.plts == [a, b]
+    assert list(user.offsets) == [0, 2, 3]
+    assert list(user.alt) == [492, 493, 100]
+    assert np.array_equal(store.points(a), np.genfromtxt(a, delimiter=',', skip_header=6, usecols=range(0, 5)))
+    assert store.user('001').trajectory_count() == 0
+
+
+def test_store_rebuilds_only_on_change(tmp_path, write_plt):
+    data_dir, store_dir = tmp_path / 'Data', tmp_path / 'store'
+    write_plt(data_dir, '000', '1.plt', [(39.98, 116.31, 492, 39744.12)])
+    TrajectoryStore(str(data_dir), str(store_dir)).user('000')
+    manifest = os.path.join(str(store_dir), '000', TrajectoryStore.MANIFEST)
+    built_at = os.stat(manifest).st_mtime_ns
+
+    TrajectoryStore(str(data_dir), str(store_dir)).user('000')
+    assert os.stat(manifest).st_mtime_ns == built_at
+
+    write_plt(data_dir, '000', '1.plt', [(39.98, 116.31, 492, 39744.12), (39.99, 116.32, 10, 39744.13)])
+    user = TrajectoryStore(str(data_dir), str(store_dir)).user('000')
+    assert len(user) == 2
+    assert list(user.alt) == [492, 10]
+
+
+def test_geolife_data_reads_from_store(tmp_path, write_plt):
+    data_dir = tmp_path / 'Data'
+    plt = write_plt(data_dir, '007', '1.plt', [(39.98, 116.31, 492, 39744.12), (39.99, 116.32, 493, 39744.13)])
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    assert list(data.users()) == ['007']
+    points = list(data.trajectories('007'))
+    assert len(points) == 2
+    assert all(traj_plt == plt for _, traj_plt in points)
+    assert points[1][0][0] == 39.99
+
+
+def test_stream_chunks_and_time_order(tmp_path, write_plt):
+    rng = np.random.RandomState(2)
+    data_dir = tmp_path / 'Data'
+    expected = []
+    for uid in ['000', '001', '002']:
+        for k in range(3):
+            # Overlapping trajectories with coarse (often tied) times.
+            days = 39744.5 + np.round(rng.uniform(0, 0.01, 20), 4)
+            rows = list(zip(rng.uniform(39, 40, 20), rng.uniform(116, 117, 20), np.zeros(20), days))
+            write_plt(data_dir, uid, '{}.plt'.format(k), rows)
+            expected.extend((ole_days_to_unix(d), uid, k, i) for i, (lat, lon, alt, d) in enumerate(rows))
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    chunks = list(data.stream(chunk_size=7))
+    assert [len(c) for c in chunks] == [7] * 25 + [5]
+    assert chunks[0].dtype == STREAM_DTYPE
+    assert list(np.concatenate(chunks)['traj_id'][:21]) == [0] * 20 + [1]
+
+    ordered = np.concatenate(list(data.stream(chunk_size=7, time_ordered=True)))
+    expected.sort()
+    assert list(zip(ordered['t'], ordered['uid'], ordered['traj_id'])) == [e[:3] for e in expected]
+
+    # Trajectory views can be iterated more than once.
+    trajectories = data.trajectories()
+    assert len(list(trajectories['001'])) == len(list(trajectories['001'])) == 60
+
+
+def test_datasets_never_share_a_store(tmp_path, write_plt, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    a = write_plt(tmp_path / 'a' / 'Data', '000', '1.plt', [(39.9, 116.3, 0, 39744.5)])
+    b = write_plt(tmp_path / 'b' / 'Data', '000', '1.plt', [(40.1, 116.5, 0, 39744.5)])
+    # Same name, size and mtime in both datasets.
+    stat = os.stat(a)
+    os.utime(b, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    store_a = TrajectoryStore(str(tmp_path / 'a' / 'Data'))
+    store_b = TrajectoryStore(str(tmp_path / 'b' / 'Data'))
+    assert store_a.store_dir != store_b.store_dir
+    assert store_a.user('000').lat[0] == 39.9
+    assert store_b.user('000').lat[0] == 40.1
+
+    # Even an explicitly shared store directory serves each dataset its own points.
+    shared = str(tmp_path / 'shared')
+    assert TrajectoryStore(str(tmp_path / 'a' / 'Data'), shared).user('000').lat[0] == 39.9
+    assert TrajectoryStore(str(tmp_path / 'b' / 'Data'), shared).user('000').lat[0] == 40.1
+
+
+def test_time_ordered_stream_merges_long_and_short_runs(tmp_path, write_plt):
+    rng = np.random.RandomState(5)
+    data_dir = tmp_path / 'Data'
+    # One long trajectory overlapping many short ones, all on a coarse time grid.
+    days = 39744.5 + np.round(np.sort(rng.uniform(0, 0.1, 2000)), 4)
+    write_plt(data_dir, '000', '0.plt', zip(np.zeros(2000), np.zeros(2000), np.zeros(2000), days))
+    for k in range(40):
+        days = 39744.5 + np.round(np.sort(rng.uniform(k * 0.0025, (k + 1) * 0.0025, 30)), 4)
+        write_plt(data_dir, '{:03d}'.format(1 + k % 3), '{}.plt'.format(k), zip(np.zeros(30), np.zeros(30), np.zeros(30), days))
+    data = GeolifeData(store=TrajectoryStore(str(data_dir), str(tmp_path / 'store')))
+
+    chunks = list(data.stream(chunk_size=50, time_ordered=True))
+    ordered = np.concatenate(chunks)
+    everything = np.concatenate(list(data.stream()))
+    expected = everything[np.lexsort((everything['point_id'], everything['traj_id'], everything['uid'], everything['t']))]
+    assert [len(c) for c in chunks[:-1]] == [50] * (len(chunks) - 1)
+    assert np.array_equal(ordered[['t', 'uid', 'traj_id', 'point_id']], expected[['t', 'uid', 'traj_id', 'point_id']])